@@ -0,0 +1,131 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""Load test: GET latency of the ServeCore event loop under concurrent large Fills.
+
+An HTTP server with a trivial GET endpoint runs in the same event loop as the tokenization
+workload, like the ServeCore does. A client thread keeps sending GETs and records their
+latency, while several coroutines tokenize large documents:
+- sync: TokenizersWrapper.tokenize in the event loop (the previous behavior).
+- thread / process: TokenizersWrapper.atokenize with the executor.
+
+The tokenizer can be a HuggingFace name or a local path.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import threading
+import time
+import urllib.request
+from typing import List
+
+import numpy as np
+from aiohttp import web
+
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+
+
+def _make_document(num_words: int, seed: int) -> str:
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocab = [
+        "".join(rng.choice(letters) for _ in range(rng.randint(2, 9)))
+        for _ in range(10000)
+    ]
+    return " ".join(rng.choices(vocab, k=num_words))
+
+
+def _client(url: str, stop_event: threading.Event, latencies: List[float]):
+    while not stop_event.is_set():
+        st = time.perf_counter()
+        with urllib.request.urlopen(url) as resp:
+            resp.read()
+        latencies.append((time.perf_counter() - st) * 1e3)  # ms
+        time.sleep(0.005)
+
+
+async def _bench(mode: str, args) -> dict:
+    tokenizers_wrapper = TokenizersWrapper(
+        executor_type="none" if mode == "sync" else mode,
+        num_workers=args.num_workers,
+    )
+    tokenizers_wrapper.register_tokenizer(args.tokenizer)
+    documents = [
+        _make_document(args.doc_words, seed) for seed in range(args.num_fills)
+    ]
+
+    # Warm up the executor (e.g. loading tokenizers in worker processes).
+    if mode != "sync":
+        await asyncio.gather(
+            *[tokenizers_wrapper.atokenize(doc, args.tokenizer) for doc in documents]
+        )
+
+    app = web.Application()
+    app.router.add_get("/ping", lambda request: web.json_response({}))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", args.port)
+    await site.start()
+
+    latencies: List[float] = []
+    stop_event = threading.Event()
+    client = threading.Thread(
+        target=_client,
+        args=(f"http://localhost:{args.port}/ping", stop_event, latencies),
+    )
+    client.start()
+
+    async def _fill(doc: str):
+        for _ in range(args.rounds):
+            if mode == "sync":
+                tokenizers_wrapper.tokenize(doc, args.tokenizer)
+                await asyncio.sleep(0)
+            else:
+                await tokenizers_wrapper.atokenize(doc, args.tokenizer)
+
+    st = time.perf_counter()
+    await asyncio.gather(*[_fill(doc) for doc in documents])
+    elapsed = time.perf_counter() - st
+
+    stop_event.set()
+    await asyncio.get_running_loop().run_in_executor(None, client.join)
+    await runner.cleanup()
+    tokenizers_wrapper.shutdown()
+
+    return {
+        "fills_per_sec": args.num_fills * args.rounds / elapsed,
+        "get_p50_ms": float(np.percentile(latencies, 50)),
+        "get_p99_ms": float(np.percentile(latencies, 99)),
+        "gets_num": len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of async tokenization")
+    parser.add_argument(
+        "--tokenizer", type=str, default="hf-internal-testing/llama-tokenizer"
+    )
+    parser.add_argument("--num_fills", type=int, default=8)
+    parser.add_argument("--doc_words", type=int, default=50000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--modes", type=str, default="sync,thread,process")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for mode in args.modes.split(","):
+        result = asyncio.run(_bench(mode, args))
+        print(
+            f"[{mode}] {result['fills_per_sec']:.1f} fills/sec, "
+            f"GET latency p50: {result['get_p50_ms']:.2f} ms, "
+            f"p99: {result['get_p99_ms']:.2f} ms ({result['gets_num']} GETs)",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""CPU cost of building the address tables of an iteration from BlockContexts.
+
+A batch of Generate jobs fork from a shared prefix, and each of them has its own long context.
+In every iteration, each job appends one token and we build what the paged attention needs:
+the block table of the whole context and the slot of the new token.
+
+Compares the array-backed BlockContext with token-level lists (the previous implementation:
+one block id and one slot id per token, rebuilt recursively with list concatenation).
+"""
+
+import argparse
+import time
+from typing import List, Optional
+
+from parrot.utils import RecyclePool
+from parrot.engine.context.block_context import BlockContext
+
+
+class _TokenLevelContext:
+    """Token-level block/slot lists, for reference."""
+
+    def __init__(
+        self, parent: Optional["_TokenLevelContext"], pool: RecyclePool, block_size: int
+    ):
+        self.parent_context = parent
+        self.block_size = block_size
+        self.pool = pool
+        self.token_kv_block_ids: List[int] = []
+        self.token_kv_slot_ids: List[int] = []
+        if parent is not None:
+            pad_len = -len(parent.token_kv_block_ids) % block_size
+            parent.allocate(pad_len)
+
+    def allocate(self, length: int):
+        for _ in range(length):
+            if len(self.token_kv_block_ids) % self.block_size == 0:
+                block_id = self.pool.allocate()
+                self.token_kv_block_ids.append(block_id)
+                self.token_kv_slot_ids.append(block_id * self.block_size)
+            else:
+                self.token_kv_block_ids.append(self.token_kv_block_ids[-1])
+                self.token_kv_slot_ids.append(self.token_kv_slot_ids[-1] + 1)
+
+    def get_context_block_ids(self) -> List[int]:
+        parent_ids = (
+            self.parent_context.get_context_block_ids() if self.parent_context else []
+        )
+        return parent_ids + self.token_kv_block_ids
+
+    def get_context_slot_ids(self) -> List[int]:
+        parent_ids = (
+            self.parent_context.get_context_slot_ids() if self.parent_context else []
+        )
+        return parent_ids + self.token_kv_slot_ids
+
+    def build_tables(self):
+        block_table = self.get_context_block_ids()[:: self.block_size]
+        slot_mapping = self.get_context_slot_ids()[-1:]
+        return block_table, slot_mapping
+
+
+class _ArrayContext(BlockContext):
+    def __init__(self, parent, pool: RecyclePool, block_size: int):
+        super().__init__(
+            context_id=0,
+            parent_context=parent,
+            kv_cache_manager=pool,
+            block_size=block_size,
+        )
+
+    def build_tables(self):
+        block_table = self.get_context_block_table().tolist()
+        slot_mapping = self.get_last_slot_ids(1)
+        return block_table, slot_mapping
+
+
+def _bench(context_cls, args) -> float:
+    pool = RecyclePool("KVCache pool")
+    prefix = context_cls(None, pool, args.block_size)
+    prefix.allocate(args.prefix_len)
+
+    contexts = []
+    for _ in range(args.batch_size):
+        ctx = context_cls(prefix, pool, args.block_size)
+        ctx.allocate(args.context_len)
+        contexts.append(ctx)
+
+    st = time.process_time()
+    for _ in range(args.num_iters):
+        for ctx in contexts:
+            ctx.allocate(1)
+            ctx.build_tables()
+    return (time.process_time() - st) / args.num_iters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BlockContext")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--prefix_len", type=int, default=4096)
+    parser.add_argument("--context_len", type=int, default=4096)
+    parser.add_argument("--block_size", type=int, default=16)
+    parser.add_argument("--num_iters", type=int, default=50)
+    args = parser.parse_args()
+
+    for name, context_cls in [
+        ("token-level", _TokenLevelContext),
+        ("array", _ArrayContext),
+    ]:
+        iter_time = _bench(context_cls, args)
+        print(f"[{name}] CPU time per iteration: {iter_time * 1e3:.2f} ms", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""Compare sending primitives with a new ClientSession per request and with the pooled
+ClientSession (keep-alive connections) used by the Core.
+
+Metric: primitives/sec of Fill primitives with zero tokens, so the fake engine returns
+immediately and the cost is dominated by the HTTP client.
+
+Please start the fake engine server first:
+    python -m parrot.testing.fake_engine_server
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from parrot.protocol.internal.primitive_request import Fill
+from parrot.protocol.client_session_pool import ClientSessionPool
+from parrot.testing.fake_engine_server import TESTING_SERVER_URL as ENGINE_URL
+from parrot.constants import (
+    ENGINE_CLIENT_CONNECTIONS_LIMIT,
+    ENGINE_CLIENT_KEEPALIVE_TIMEOUT,
+)
+
+
+def _make_primitive(i: int) -> Fill:
+    return Fill(
+        session_id=0,
+        task_id=i,
+        context_id=i,
+        parent_context_id=-1,
+        end_flag=False,
+        token_ids=[],
+    )
+
+
+async def _bench(pooled: bool, num_primitives: int, concurrency: int) -> float:
+    pool = ClientSessionPool(
+        limit_per_host=ENGINE_CLIENT_CONNECTIONS_LIMIT,
+        keepalive_timeout=ENGINE_CLIENT_KEEPALIVE_TIMEOUT,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _send(i: int):
+        async with semaphore:
+            client_session = pool.get_session(ENGINE_URL) if pooled else None
+            await _make_primitive(i).apost(ENGINE_URL, client_session)
+
+    # Warm up
+    await asyncio.gather(*[_send(i) for i in range(concurrency)])
+
+    st = time.perf_counter()
+    await asyncio.gather(*[_send(i) for i in range(num_primitives)])
+    ed = time.perf_counter()
+
+    await pool.close_all()
+    return num_primitives / (ed - st)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pooled ClientSession")
+    parser.add_argument("--num_primitives", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for pooled in [False, True]:
+        mode = "pooled session" if pooled else "session per primitive"
+        throughput = asyncio.run(
+            _bench(pooled, args.num_primitives, args.concurrency)
+        )
+        print(f"[{mode}] {throughput:.1f} primitives/sec", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""Compare the polling and the event-driven ServeCore loop.
+
+Metrics:
+- CPU usage of the Core process when it's idle.
+- Schedule-to-dispatch latency, i.e. the time from `submit_task` to the task being scheduled.
+
+No engine server is launched. A text engine is registered so no tokenizer is loaded.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from dataclasses import asdict
+from typing import Dict, List
+
+import numpy as np
+
+from parrot.serve.core import create_serve_core
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
+from parrot.testing.get_configs import get_sample_core_config_path
+
+
+def _build_core(event_driven_loop: bool):
+    config_path = get_sample_core_config_path("localhost_serve_core.json")
+    core = create_serve_core(
+        config_path, override_args={"event_driven_loop": event_driven_loop}
+    )
+    engine_config = EngineConfig(engine_type=ENGINE_TYPE_OPENAI)
+    core.register_engine({"engine_config": asdict(engine_config)})
+    core.var_mgr.register_local_var_space(0)
+    return core
+
+
+def _create_task(core):
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill("This is a test "),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+        ],
+        metadata=metadata,
+    )
+    core.var_mgr.create_vars_for_request(0, request_chain)
+    comp_chain = request_chain.comp_chains[0]
+    activate_completion_chain(comp_chain, PerformanceCriteria.LATENCY)
+    return core.task_creator.create_task(comp_chain)
+
+
+async def _bench(event_driven_loop: bool, idle_time: float, num_tasks: int) -> Dict:
+    core = _build_core(event_driven_loop)
+    loop_task = asyncio.create_task(core.serve_loop())
+
+    # Idle CPU usage
+    await asyncio.sleep(0.1)  # Warm up
+    cpu_st = time.process_time()
+    wall_st = time.perf_counter()
+    await asyncio.sleep(idle_time)
+    cpu_usage = (time.process_time() - cpu_st) / (time.perf_counter() - wall_st)
+
+    # Schedule-to-dispatch latency
+    latencies: List[float] = []
+    for _ in range(num_tasks):
+        task = _create_task(core)
+        st = time.perf_counter_ns()
+        core.global_scheduler.submit_task(task)
+        await task.wait_scheduled()
+        latencies.append((time.perf_counter_ns() - st) / 1e3)  # us
+        core.task_creator.free_task(task)
+        await asyncio.sleep(0.001)  # Spread the submissions
+
+    loop_task.cancel()
+
+    return {
+        "idle_cpu_usage": cpu_usage,
+        "dispatch_latency_mean_us": float(np.mean(latencies)),
+        "dispatch_latency_p99_us": float(np.percentile(latencies, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ServeCore loop modes")
+    parser.add_argument("--idle_time", type=float, default=3.0)
+    parser.add_argument("--num_tasks", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for event_driven_loop in [False, True]:
+        mode = "event-driven" if event_driven_loop else "polling"
+        result = asyncio.run(_bench(event_driven_loop, args.idle_time, args.num_tasks))
+        print(
+            f"[{mode}] idle CPU usage: {result['idle_cpu_usage'] * 100:.1f}%, "
+            f"dispatch latency mean: {result['dispatch_latency_mean_us']:.1f} us, "
+            f"p99: {result['dispatch_latency_p99_us']:.1f} us",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""CPU cost of finding candidate engines for a task in EngineManager.
+
+Compares the live-engine indexes (keyed by model) with scanning all engines and filtering
+them by model type and model name (the previous implementation of
+GlobalScheduler._get_engine_list).
+"""
+
+import argparse
+import logging
+import time
+
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.serve.scheduler import GlobalScheduler  # Import first (circular import).
+from parrot.serve.backend_repr import ModelType
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.engine_manager import EngineManager
+
+
+def _scan(engine_mgr: EngineManager, model_type: ModelType, models):
+    return [
+        engine
+        for engine in engine_mgr.get_live_engines()
+        if engine.model_type == model_type
+        and (len(models) == 0 or engine.model_name in models)
+    ]
+
+
+def _index(engine_mgr: EngineManager, model_type: ModelType, models):
+    return engine_mgr.get_live_engines_by_model(model_type, models)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark engine indexes")
+    parser.add_argument("--num_engines", type=int, default=128)
+    parser.add_argument("--num_models", type=int, default=16)
+    parser.add_argument("--num_queries", type=int, default=100000)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=ServeCoreContextManager(),
+        engine_heartbeat_timeout=666,
+    )
+    for i in range(args.num_engines):
+        engine_mgr.register_engine(
+            EngineConfig(
+                model=f"model-{i % args.num_models}", engine_type=ENGINE_TYPE_OPENAI
+            )
+        )
+
+    queries = [[f"model-{i % args.num_models}"] for i in range(args.num_queries)]
+
+    for name, func in [("scan", _scan), ("index", _index)]:
+        st = time.process_time()
+        for models in queries:
+            func(engine_mgr, ModelType.TEXT, models)
+        cpu_time = time.process_time() - st
+        print(
+            f"[{name}] {args.num_engines} engines, {args.num_queries} queries, "
+            f"CPU time: {cpu_time:.3f} s",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
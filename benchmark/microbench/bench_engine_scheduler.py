@@ -0,0 +1,112 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""CPU cost of EngineScheduler with thousands of queued jobs.
+
+Compares the heap-based waiting queue with a list-based one (the previous implementation:
+`pop(0)` to take the next job, `insert(0, job)` to push back a preempted job, and a linear
+scan over running jobs to check whether a context is running).
+
+Each iteration schedules a batch, checks every queued context as `free_context` does, and
+finishes a part of the running jobs. Some jobs are preempted by the total tokens limit.
+"""
+
+import argparse
+import logging
+import time
+from typing import List
+
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import PrimitiveJob, Generate
+from parrot.engine.context.text_context import TextContext
+from parrot.sampling_config import SamplingConfig
+
+
+class _ListScheduler(EngineScheduler):
+    """The list-based waiting queue, for reference."""
+
+    def __init__(self, config: SchedulerConfig) -> None:
+        super().__init__(config)
+        self._waiting_list: List[PrimitiveJob] = []
+
+    def _push_waiting(self, job: PrimitiveJob) -> None:
+        if job.context_id in self.job_arrival_time and job in self.running_jobs:
+            self._waiting_list.insert(0, job)  # Preempted
+        else:
+            self._waiting_list.append(job)
+
+    def _peek_waiting(self):
+        return self._waiting_list[0] if len(self._waiting_list) > 0 else None
+
+    def _pop_waiting(self) -> PrimitiveJob:
+        return self._waiting_list.pop(0)
+
+    @property
+    def num_waiting_jobs(self) -> int:
+        return len(self._waiting_list)
+
+    def is_running(self, context_id: int) -> bool:
+        return any(job.context_id == context_id for job in self.running_jobs)
+
+
+def _make_jobs(num_jobs: int, context_len: int) -> List[PrimitiveJob]:
+    jobs = []
+    for i in range(num_jobs):
+        job = Generate(
+            session_id=0,
+            task_id=i,
+            context_id=i,
+            parent_context_id=-1,
+            sampling_config=SamplingConfig(),
+            end_flag=True,
+        )
+        job.context = TextContext(context_id=i, parent_context=None)
+        job.context.append_text("x" * context_len, role_is_user=True)
+        jobs.append(job)
+    return jobs
+
+
+def _bench(scheduler_cls, args) -> float:
+    config = SchedulerConfig(
+        max_batch_size=args.batch_size,
+        max_num_batched_tokens=args.batch_size,
+        # Preempt the last quarter of a full batch.
+        max_total_tokens=args.context_len * args.batch_size * 3 // 4,
+    )
+    scheduler = scheduler_cls(config)
+    jobs = _make_jobs(args.num_jobs, args.context_len)
+
+    st = time.process_time()
+    for job in jobs:
+        scheduler.add_job(job)
+
+    while not scheduler.is_empty:
+        running = scheduler.schedule()
+        for context_id in range(0, args.num_jobs, args.num_jobs // 100):
+            scheduler.is_running(context_id)
+        for job in running[: len(running) // 2 + 1]:
+            job.finish_event.set()
+        scheduler.finish()
+    return time.process_time() - st
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EngineScheduler")
+    parser.add_argument("--num_jobs", type=int, default=20000)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--context_len", type=int, default=16)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for name, scheduler_cls in [("list", _ListScheduler), ("heap", EngineScheduler)]:
+        cpu_time = _bench(scheduler_cls, args)
+        print(
+            f"[{name}] {args.num_jobs} jobs, CPU time: {cpu_time:.3f} s",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
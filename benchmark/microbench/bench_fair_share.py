@@ -0,0 +1,152 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""Latency of chat tenants sharing the GlobalScheduler with a bulk tenant.
+
+The bulk tenant submits many map tasks at once; chat tenants submit a task periodically.
+Time is simulated in ticks: each tick the scheduler runs once, and a task finishes a fixed
+number of ticks after it's scheduled. We report the latency (in ticks, from submission to
+finish) of chat tasks with and without fair sharing.
+"""
+
+import argparse
+import logging
+from typing import Dict, List
+
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.serve.scheduler import (
+    CompletionTask,
+    GlobalScheduler,
+    GlobalSchedulerConfig,
+    TaskCreator,
+)
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    ComputeGraph,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
+
+
+def run(args, fair_share: bool) -> List[int]:
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=GlobalSchedulerConfig(fair_share=fair_share, max_queue_size=99999),
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+    engine_mgr.register_engine(
+        EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=args.capacity)
+    )
+
+    graph = ComputeGraph()
+    var_mgr = SemanticVariableManager(666)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+
+    def submit(session_id: int) -> CompletionTask:
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"Session {session_id} "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        request_chain.session_id = session_id
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+        task = task_creator.create_task(comp_chain)
+        scheduler.submit_task(task)
+        return task
+
+    bulk_session_id = 0
+    chat_session_ids = list(range(1, args.num_chat_tenants + 1))
+    for session_id in [bulk_session_id] + chat_session_ids:
+        var_mgr.register_local_var_space(session_id)
+        scheduler.register_session(session_id)
+
+    queued: List[CompletionTask] = [
+        submit(bulk_session_id) for _ in range(args.num_bulk_tasks)
+    ]
+    running: List[CompletionTask] = []
+    # task_id -> tick
+    submit_ticks: Dict[int, int] = {}
+    finish_ticks: Dict[int, int] = {}
+    latencies: List[int] = []
+
+    for tick in range(args.num_ticks):
+        # Finish tasks.
+        for task in [task for task in running if finish_ticks[task.task_id] == tick]:
+            running.remove(task)
+            task.leave_scheduled()
+            if task.task_id in submit_ticks:
+                latencies.append(tick - submit_ticks[task.task_id])
+
+        # Chat tenants submit tasks.
+        if tick % args.chat_interval == 0:
+            for session_id in chat_session_ids:
+                task = submit(session_id)
+                submit_ticks[task.task_id] = tick
+                queued.append(task)
+
+        scheduler.schedule()
+        for task in queued:
+            if task.is_scheduled:
+                finish_ticks[task.task_id] = tick + args.task_ticks
+                running.append(task)
+        queued = [task for task in queued if not task.is_scheduled]
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fair sharing")
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--num_bulk_tasks", type=int, default=1000)
+    parser.add_argument("--num_chat_tenants", type=int, default=4)
+    parser.add_argument("--chat_interval", type=int, default=10)
+    parser.add_argument("--task_ticks", type=int, default=4)
+    parser.add_argument("--num_ticks", type=int, default=400)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for fair_share in [False, True]:
+        latencies = sorted(run(args, fair_share))
+        if len(latencies) == 0:
+            print(
+                f"[fair_share={fair_share}] No chat task finished in "
+                f"{args.num_ticks} ticks.",
+                flush=True,
+            )
+            continue
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(
+            f"[fair_share={fair_share}] {len(latencies)} chat tasks finished. "
+            f"Latency (ticks): avg={sum(latencies) / len(latencies):.2f}, "
+            f"p99={p99}, max={latencies[-1]}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
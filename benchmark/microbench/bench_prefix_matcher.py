@@ -0,0 +1,59 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""Latency of PrefixMatcher.add_prefix / query_prefix w.r.t. the number of stored prefixes.
+
+Prompts share a long common system prompt and differ in the suffix, which is the worst case
+for a matcher that scans the stored prefixes under the same leading characters.
+"""
+
+import argparse
+import random
+import time
+
+from parrot.serve.prefix_matcher import PrefixMatcher, PrefixMatcherConfig
+
+
+def _random_text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(length))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PrefixMatcher")
+    parser.add_argument("--prompt_len", type=int, default=1000)
+    parser.add_argument("--num_queries", type=int, default=1000)
+    parser.add_argument("--memory_budget", type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    system_prompt = _random_text(rng, args.prompt_len // 2)
+
+    for num_prefixes in [1000, 10000, 100000]:
+        prefix_matcher = PrefixMatcher(
+            PrefixMatcherConfig(memory_budget=args.memory_budget)
+        )
+        prompts = [
+            system_prompt + _random_text(rng, args.prompt_len // 2)
+            for _ in range(args.num_queries)
+        ]
+
+        for i in range(num_prefixes):
+            prefix_matcher.add_prefix(system_prompt + str(i) + prompts[i % 100])
+
+        st = time.perf_counter_ns()
+        for prompt in prompts:
+            prefix_matcher.add_prefix(prompt)
+            prefix_matcher.query_prefix(prompt)
+        per_op_us = (time.perf_counter_ns() - st) / 1e3 / args.num_queries
+
+        print(
+            f"stored prefixes: {num_prefixes}, add+query: {per_op_us:.1f} us, "
+            f"trie nodes: {prefix_matcher.nodes_num}, "
+            f"memory usage: {prefix_matcher.memory_usage / 1024 / 1024:.1f} MiB, "
+            f"evicted nodes: {prefix_matcher.evicted_nodes_num}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
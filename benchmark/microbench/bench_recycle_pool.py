@@ -0,0 +1,101 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""Microbenchmarks of RecyclePool, compared with the previous deque-only implementation
+(which checks double free with `id in free_ids`).
+
+Cases:
+- single: allocate/free one id at a time, with a long free list.
+- context: allocate the blocks of a context and free them, like BlockContext does.
+- churn: several contexts alive at the same time, freed in random order.
+"""
+
+import argparse
+import random
+import time
+from collections import deque
+from typing import List
+
+from parrot.utils import RecyclePool
+
+
+class _DequeRecyclePool:
+    """The previous implementation, for reference."""
+
+    def __init__(self):
+        self.allocated_num = 0
+        self.cur_max_id = 0
+        self.free_ids = deque()
+
+    def allocate(self) -> int:
+        self.allocated_num += 1
+        if len(self.free_ids) == 0:
+            self.cur_max_id += 1
+            return self.cur_max_id - 1
+        return self.free_ids.popleft()
+
+    def free(self, id: int) -> None:
+        self.allocated_num -= 1
+        if id in self.free_ids:
+            raise ValueError("The id is already free.")
+        self.free_ids.append(id)
+
+    def allocate_many(self, num: int) -> List[int]:
+        return [self.allocate() for _ in range(num)]
+
+    def free_many(self, ids: List[int]) -> None:
+        for id in ids:
+            self.free(id)
+
+
+def _bench_single(pool, args) -> float:
+    # Build a long free list.
+    pool.free_many(pool.allocate_many(args.pool_size))
+
+    st = time.process_time()
+    for _ in range(args.num_ops):
+        pool.free(pool.allocate())
+    return time.process_time() - st
+
+
+def _bench_context(pool, args) -> float:
+    st = time.process_time()
+    for _ in range(args.num_ops // args.blocks_per_context):
+        ids = pool.allocate_many(args.blocks_per_context)
+        pool.free_many(ids)
+    return time.process_time() - st
+
+
+def _bench_churn(pool, args) -> float:
+    rng = random.Random(0)
+    alive: List[List[int]] = []
+    max_alive = 8
+
+    st = time.process_time()
+    for _ in range(args.num_ops // args.blocks_per_context * 4):
+        alive.append(pool.allocate_many(args.blocks_per_context))
+        if len(alive) > max_alive:
+            ids = alive.pop(rng.randrange(len(alive)))
+            pool.free_many(ids)
+    return time.process_time() - st
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RecyclePool")
+    parser.add_argument("--pool_size", type=int, default=20000)
+    parser.add_argument("--num_ops", type=int, default=20000)
+    parser.add_argument("--blocks_per_context", type=int, default=256)
+    args = parser.parse_args()
+
+    for case, bench_fn in [
+        ("single", _bench_single),
+        ("context", _bench_context),
+        ("churn", _bench_churn),
+    ]:
+        for name, pool_cls in [("deque", _DequeRecyclePool), ("bitmap", RecyclePool)]:
+            cpu_time = bench_fn(pool_cls(), args)
+            print(f"[{case}][{name}] CPU time: {cpu_time * 1e3:.1f} ms", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+"""Compare GlobalScheduler policies on a recorded task queue, without running engines.
+
+A trace is a JSONL file. Each line is a task:
+    {"arrival": int, "session_id": int, "prompt": str, "max_gen_length": int,
+     "criteria": "latency" | "throughput"}
+
+Time is simulated in ticks. Each tick, arrived tasks are submitted and the scheduler runs
+once. A scheduled task finishes after ceil(max_gen_length / tokens_per_tick) ticks. We
+report the task latency (in ticks, from arrival to finish), the makespan and the CPU time
+spent in GlobalScheduler.schedule().
+
+Without --trace, a synthetic trace is generated (and saved if --dump_trace is given).
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import time
+from typing import Dict, List
+
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.serve.scheduler import (
+    CompletionTask,
+    GlobalScheduler,
+    GlobalSchedulerConfig,
+    TaskCreator,
+)
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.tokenizer_wrapper import TokenizersWrapper
+from parrot.serve.engine_manager import EngineManager
+from parrot.serve.variable_manager import SemanticVariableManager
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    ComputeGraph,
+    activate_completion_chain,
+    get_performance_criteria,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
+
+
+def generate_trace(args) -> List[Dict]:
+    rng = random.Random(args.seed)
+    prompts = [f"System prompt {i}. " * 20 for i in range(8)]
+    trace = []
+    for i in range(args.num_tasks):
+        trace.append(
+            {
+                "arrival": int(i / args.num_tasks * args.arrival_ticks),
+                "session_id": rng.randrange(args.num_sessions),
+                "prompt": rng.choice(prompts),
+                "max_gen_length": rng.choice([16, 64, 256]),
+                "criteria": rng.choice(["latency", "throughput"]),
+            }
+        )
+    return trace
+
+
+def run(args, trace: List[Dict], policies: List[str]) -> None:
+    ordering, grouping, placement = policies
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=GlobalSchedulerConfig(
+            ctx_group=True,
+            max_queue_size=len(trace) + 1,
+            ordering_policy=ordering,
+            grouping_policy=grouping,
+            placement_policy=placement,
+        ),
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+    for _ in range(args.num_engines):
+        engine_mgr.register_engine(
+            EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=args.capacity)
+        )
+
+    graph = ComputeGraph()
+    var_mgr = SemanticVariableManager(666)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+    for session_id in set(record["session_id"] for record in trace):
+        var_mgr.register_local_var_space(session_id)
+
+    def submit(record: Dict) -> CompletionTask:
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(record["prompt"]),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(
+                        name="a",
+                        is_output=True,
+                        sampling_config={"max_gen_length": record["max_gen_length"]},
+                    )
+                ),
+            ],
+            metadata=metadata,
+        )
+        request_chain.session_id = record["session_id"]
+        var_mgr.create_vars_for_request(record["session_id"], request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(
+            comp_chain, get_performance_criteria(record["criteria"])
+        )
+        task = task_creator.create_task(comp_chain)
+        scheduler.submit_task(task)
+        return task
+
+    records = sorted(trace, key=lambda record: record["arrival"])
+    next_record = 0
+    queued: List[CompletionTask] = []
+    running: List[CompletionTask] = []
+    # task_id -> tick
+    arrival_ticks: Dict[int, int] = {}
+    finish_ticks: Dict[int, int] = {}
+    latencies: List[int] = []
+    schedule_time = 0.0
+
+    tick = 0
+    while len(latencies) < len(records):
+        # Finish tasks.
+        for task in [task for task in running if finish_ticks[task.task_id] == tick]:
+            running.remove(task)
+            task.leave_scheduled()
+            latencies.append(tick - arrival_ticks[task.task_id])
+
+        # Submit arrived tasks.
+        while next_record < len(records) and records[next_record]["arrival"] <= tick:
+            task = submit(records[next_record])
+            arrival_ticks[task.task_id] = tick
+            queued.append(task)
+            next_record += 1
+
+        st = time.perf_counter()
+        scheduler.schedule()
+        schedule_time += time.perf_counter() - st
+
+        for task in queued:
+            if task.is_scheduled:
+                duration = math.ceil(
+                    task.chain.gen_node.sampling_config.max_gen_length
+                    / args.tokens_per_tick
+                )
+                finish_ticks[task.task_id] = tick + max(1, duration)
+                running.append(task)
+        queued = [task for task in queued if not task.is_scheduled]
+        tick += 1
+
+    latencies.sort()
+    print(
+        f"[ordering={ordering}, grouping={grouping}, placement={placement}] "
+        f"latency (ticks): avg={sum(latencies) / len(latencies):.2f}, "
+        f"p99={latencies[int(len(latencies) * 0.99)]}, makespan={tick} ticks, "
+        f"schedule CPU time: {schedule_time:.3f} s",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scheduler policies")
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("--dump_trace", type=str, default=None)
+    parser.add_argument(
+        "--policies",
+        type=str,
+        nargs="+",
+        default=["edf,default,default", "fifo,default,default", "edf,none,least_tasks"],
+        help="Policies to compare, each as ordering,grouping,placement.",
+    )
+    parser.add_argument("--num_engines", type=int, default=4)
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--tokens_per_tick", type=int, default=16)
+    parser.add_argument("--num_tasks", type=int, default=1000)
+    parser.add_argument("--num_sessions", type=int, default=8)
+    parser.add_argument("--arrival_ticks", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    if args.trace is not None:
+        with open(args.trace) as f:
+            trace = [json.loads(line) for line in f if line.strip()]
+    else:
+        trace = generate_trace(args)
+        if args.dump_trace is not None:
+            with open(args.dump_trace, "w") as f:
+                for record in trace:
+                    f.write(json.dumps(record) + "\n")
+
+    for policies in args.policies:
+        run(args, trace, policies.split(","))
+
+
+if __name__ == "__main__":
+    main()
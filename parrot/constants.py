@@ -15,9 +15,24 @@ DEFAULT_ENGINE_URL = f"http://{DEFAULT_SERVER_HOST}:{DEFAULT_ENGINE_SERVER_PORT}
 
 # ---------- Loop Interval ----------
 CORE_LOOP_INTERVAL = 0.0001
+# In the event-driven mode, the Core only schedules when woken up. Sweeping sessions/engines
+# and expiring constant prefixes are done in their own coarse timers.
+CORE_SWEEP_INTERVAL = 1.0
+CORE_EXPIRE_CONSTANT_PREFIX_INTERVAL = 5.0
+# Contexts freed in the Core are sent to engines in batches, once per this interval.
+CORE_FREE_CONTEXTS_INTERVAL = 0.01
 # The engine need a very short interval, prevent it from affecting the performance of LLM
 ENGINE_LOOP_INTERVAL = 0.000001
 
+# ---------- Connection Pool ----------
+# Max concurrent connections from the Core to an engine.
+ENGINE_CLIENT_CONNECTIONS_LIMIT = 256
+ENGINE_CLIENT_KEEPALIVE_TIMEOUT = 60.0
+
+# ---------- Retry ----------
+FREE_CONTEXTS_RETRY_TIMES = 3
+FREE_CONTEXTS_RETRY_INTERVAL = 0.1
+
 # ---------- Chunk Related ----------
 FILL_NO_CHUNK = -1
 PIPELINE_SEND_CHUNK_NUM = 128
@@ -33,6 +48,13 @@ ENGINE_TYPES = [
     ENGINE_TYPE_BUILTIN,
     ENGINE_TYPE_OPENAI,
 ]
+# Priorities of jobs in an engine. Higher is more urgent: waiting jobs with higher priority
+# are scheduled first, and running jobs with lower priority are preempted first.
+JOB_PRIORITY_NORMAL = 0
+# For TPOT: The job keeps its priority during the whole decoding.
+JOB_PRIORITY_PACED = 1
+# For TTFT: The priority only lasts until the first token is generated.
+JOB_PRIORITY_FIRST_TOKEN = 2
 
 # ---------- None Number ----------
 NONE_SEED = 1
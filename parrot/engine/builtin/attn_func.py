@@ -82,7 +82,7 @@ class xFormersWithBuffer(AttnFunc):
 
         for job in jobs:
             if isinstance(job, Fill):
-                num_tokens = len(job.token_ids)
+                num_tokens = job.chunk_len
                 iteration_state.num_fill_tokens.append(num_tokens)
             elif isinstance(job, Generate):
                 num_tokens = 1
@@ -209,8 +209,6 @@ class xFormersFill_vLLMPagedAttentionGenerate(AttnFunc):
         num_heads: int,
         head_size: int,
     ):
-        block_size = builtin_config.block_size
-
         # Address Tables
         block_tables = []  # [num_generation_seqs, max_num_blocks_per_seq]
         slot_mapping = []  # [num_tokens]
@@ -227,25 +225,23 @@ class xFormersFill_vLLMPagedAttentionGenerate(AttnFunc):
 
         for job in jobs:
             if isinstance(job, Fill):
-                num_tokens = len(job.token_ids)
+                num_tokens = job.chunk_len
                 iteration_state.num_fill_tokens.append(num_tokens)
             elif isinstance(job, Generate):
                 num_tokens = 1
                 iteration_state.generation_sampling_config.append(job.sampling_config)
 
-            context_block_ids = job.context.get_context_block_ids()
-            context_slot_ids = job.context.get_context_slot_ids()
+            context_block_table = job.context.get_context_block_table()
             context_len = job.context.get_context_len()
 
             # Maintain slot mapping for query tokens
-            slot_mapping.append(context_slot_ids[-num_tokens:])
+            slot_mapping.append(job.context.get_last_slot_ids(num_tokens))
             max_num_slots_per_seq = max(max_num_slots_per_seq, len(slot_mapping[-1]))
 
             if isinstance(job, Generate):
                 # Update block tables for generation tokens
-                # This tables is logicial block id -> physical block id, so we need to
-                # squeeze the tokens to blocks
-                block_tables.append(context_block_ids[::block_size])
+                # This tables is logicial block id -> physical block id
+                block_tables.append(context_block_table.tolist())
                 context_lens.append(context_len)
                 max_num_blocks_per_seq = max(
                     max_num_blocks_per_seq, len(block_tables[-1])
@@ -253,7 +249,7 @@ class xFormersFill_vLLMPagedAttentionGenerate(AttnFunc):
             else:
                 fill_q_lens.append(num_tokens)
                 fill_kv_lens.append(context_len)
-                fill_slots.extend(context_slot_ids)
+                fill_slots.extend(job.context.get_context_slot_ids())
                 # assert (
                 #     context_len == num_tokens
                 # ), f"In vLLM, context-aware Fill is not allowed: context_len={context_len}."
@@ -484,14 +480,12 @@ class xFormersFill_SharedPromptsGenerate(AttnFunc):
         logger.debug(f"Shared context length: {flash_context_len}")
 
         flash_block_num = (flash_context_len + block_size - 1) // block_size
-        flash_pad_len = flash_block_num * block_size
 
         # Address Tables
         paged_context_lens = []  # [num_generation_seqs]
-        context_block_ids = jobs[0].context.get_context_block_ids()
-        flash_block_table = context_block_ids[
-            :flash_pad_len:block_size
-        ]  # [max_num_blocks_per_seq]
+        flash_block_table = jobs[0].context.get_context_block_table()[
+            :flash_block_num
+        ].tolist()  # [max_num_blocks_per_seq]
         paged_block_tables = []  # [num_generation_seqs, max_num_blocks_per_seq]
         slot_mapping = []  # [num_tokens]
 
@@ -506,25 +500,25 @@ class xFormersFill_SharedPromptsGenerate(AttnFunc):
 
         for job in jobs:
             if isinstance(job, Fill):
-                num_tokens = len(job.token_ids)
+                num_tokens = job.chunk_len
                 iteration_state.num_fill_tokens.append(num_tokens)
             elif isinstance(job, Generate):
                 num_tokens = 1
                 iteration_state.generation_sampling_config.append(job.sampling_config)
 
-            context_block_ids = job.context.get_context_block_ids()
-            context_slot_ids = job.context.get_context_slot_ids()
+            context_block_table = job.context.get_context_block_table()
             context_len = job.context.get_context_len()
 
             # Maintain slot mapping for query tokens
-            slot_mapping.append(context_slot_ids[-num_tokens:])
+            slot_mapping.append(job.context.get_last_slot_ids(num_tokens))
             max_num_slots_per_seq = max(max_num_slots_per_seq, len(slot_mapping[-1]))
 
             if isinstance(job, Generate):
                 # Update block tables for generation tokens
-                # This tables is logicial block id -> physical block id, so we need to
-                # squeeze the tokens to blocks
-                paged_block_tables.append(context_block_ids[flash_pad_len::block_size])
+                # This tables is logicial block id -> physical block id
+                paged_block_tables.append(
+                    context_block_table[flash_block_num:].tolist()
+                )
                 paged_context_lens.append(context_len - flash_context_len)
                 max_num_blocks_per_seq = max(
                     max_num_blocks_per_seq, len(paged_block_tables[-1])
@@ -532,7 +526,7 @@ class xFormersFill_SharedPromptsGenerate(AttnFunc):
             else:
                 fill_q_lens.append(num_tokens)
                 fill_kv_lens.append(context_len)
-                fill_slots.extend(context_slot_ids)
+                fill_slots.extend(job.context.get_context_slot_ids())
                 # assert (
                 #     context_len == num_tokens
                 # ), f"In vLLM, context-aware Fill is not allowed: context_len={context_len}."
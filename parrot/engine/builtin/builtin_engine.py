@@ -7,7 +7,7 @@ from typing import Dict, AsyncGenerator
 from parrot.utils import get_logger, MemTracker, get_cpu_memory_usage, cprofile
 from parrot.sampling_config import SamplingConfig
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
-from parrot.constants import UNKNOWN_DATA_FIELD
+from parrot.constants import UNKNOWN_DATA_FIELD, JOB_PRIORITY_NORMAL
 
 from ..llm_engine import LLMEngine
 from .builtin_runner import BuiltinRunner
@@ -39,7 +39,9 @@ class BuiltinEngine(LLMEngine):
         self.runner = BuiltinRunner(
             model_name=self.engine_config.model, config=builtin_config
         )
-        self.scheduler = EngineScheduler(scheduler_config)
+        self.scheduler = EngineScheduler(
+            scheduler_config, fill_chunk_size=self.engine_config.fill_chunk_size
+        )
         self.latency_analyzer = LatencyAnalyzer()
         self.gpu_mem_tracker = MemTracker(device=self.runner.local_rank)
 
@@ -76,6 +78,7 @@ class BuiltinEngine(LLMEngine):
             parent_context_id=payload["parent_context_id"],
             end_flag=payload["end_flag"],
             token_ids=payload["token_ids"],
+            priority=payload.get("priority", JOB_PRIORITY_NORMAL),
         )
 
         self._add_job(fill_job)
@@ -93,6 +96,7 @@ class BuiltinEngine(LLMEngine):
             parent_context_id=payload["parent_context_id"],
             sampling_config=SamplingConfig(**payload["sampling_config"]),
             end_flag=payload["end_flag"],
+            priority=payload.get("priority", JOB_PRIORITY_NORMAL),
         )
 
         self._add_job(generation_job)
@@ -115,6 +119,7 @@ class BuiltinEngine(LLMEngine):
         parent_context_id = payload["parent_context_id"]
         sampling_config = SamplingConfig(**payload["sampling_config"])
         end_flag = payload["end_flag"]
+        priority = payload.get("priority", JOB_PRIORITY_NORMAL)
 
         generation_job = Generate(
             session_id=session_id,
@@ -123,6 +128,7 @@ class BuiltinEngine(LLMEngine):
             parent_context_id=parent_context_id,
             sampling_config=sampling_config,
             end_flag=end_flag,
+            priority=priority,
         )
         self._add_job(generation_job)
 
@@ -131,10 +137,9 @@ class BuiltinEngine(LLMEngine):
     # override
     async def free_context(self, payload: Dict) -> Dict:
         context_id = payload["context_id"]
-        for job in self.scheduler.running_jobs:
-            if job.context_id == context_id:
-                # NOTE(chaofan): We cannot free the context when it is still running.
-                raise RuntimeError(f"Context {context_id} is still running.")
+        if self.scheduler.is_running(context_id):
+            # NOTE(chaofan): We cannot free the context when it is still running.
+            raise RuntimeError(f"Context {context_id} is still running.")
 
         context_len = self.runner.context_manager.free_context(context_id)
         return {
@@ -92,11 +92,9 @@ class BuiltinRunner:
                 )
 
             # Allocate blocks
-            allocated_blocks_id: List[int] = []
-
             if isinstance(job, Fill):
-                job.context.token_ids.extend(job.token_ids)
-                job.context.allocate(len(job.token_ids))
+                job.context.token_ids.extend(job.chunk_token_ids)
+                job.context.allocate(job.chunk_len)
             elif isinstance(job, Generate):
                 job.context.allocate(1)
                 last_hidden_state = job.context.get_last_hidden_state()
@@ -106,8 +104,6 @@ class BuiltinRunner:
                     first_sampling_jobs.append(job)
                     job.context.last_hidden_state = None
 
-            job.context.token_kv_block_ids.extend(allocated_blocks_id)
-
         # First sampling
         if len(first_sampling_states) > 0:
             logger.debug(
@@ -136,10 +132,8 @@ class BuiltinRunner:
         for job in jobs:
             context_len = job.context.get_context_len()
             if isinstance(job, Fill):
-                input_ids.extend(job.token_ids)
-                input_positions.extend(
-                    range(context_len - len(job.token_ids), context_len)
-                )
+                input_ids.extend(job.chunk_token_ids)
+                input_positions.extend(range(context_len - job.chunk_len, context_len))
             elif isinstance(job, Generate):
                 input_ids.append(job.context.get_last_token_id())
                 input_positions.append(context_len - 1)
@@ -179,7 +173,9 @@ class BuiltinRunner:
             assert job.context is not None, "Context should be assigned."
             if isinstance(job, Fill):
                 job.context.last_hidden_state = fill_hidden_states[i]
-                job.finish_event.set()
+                # NOTE: A chunked Fill finishes after its last chunk.
+                if job.finish_chunk():
+                    job.finish_event.set()
             elif isinstance(job, Generate):
                 token_id = next_tokens[i - iteration_state.num_fill_jobs]
                 job.put_token(token_id)
@@ -120,6 +120,9 @@ class EngineConfig:
     # For local LLMs, the tokenizer name must follow the format of
     # HugoingFace tokenizer name, e.g. facebook/opt-13b.
     tokenizer: str = "unknown"
+
+    # Max number of tokens of a Fill executed in one iteration. A longer Fill is split
+    # into chunks. FILL_NO_CHUNK means a Fill is always executed as a whole.
     fill_chunk_size: int = FILL_NO_CHUNK
 
     # The folowing configs are forwarded from sub configs, and is not
@@ -2,7 +2,9 @@
 # Licensed under the MIT license.
 
 
+from array import array
 from typing import List, Optional
+import numpy as np
 import torch
 
 from parrot.utils import RecyclePool
@@ -11,7 +13,15 @@ from .low_level_context import LowLevelContext
 
 
 class BlockContext(LowLevelContext):
-    """BlockContext: Use the idea of PagedAttention to manage the memory."""
+    """BlockContext: Use the idea of PagedAttention to manage the memory.
+
+    The context stores its block table (one block id per block) in an int32 array. The slot of
+    a token is computed from its position: table[pos // block_size] * block_size + pos % block_size.
+
+    NOTE: A parent context is padded to a multiple of block size when it's forked, so the
+    block table of the whole context is the concatenation of the tables along the ancestors. It's
+    cached and only rebuilt when an ancestor appends new blocks.
+    """
 
     def __init__(
         self,
@@ -37,12 +47,16 @@ class BlockContext(LowLevelContext):
             )
             self.parent_context.pad_to(total_len)
 
-        # KV blocks address
-        # length = num_tokens. Each element is a block id.
-        # Hence the list is like [0, 0, 0, 1, 1, 1, 2, 2, 2] (block size = 3)
-        self.token_kv_block_ids: List[int] = []
-        # KV blocks offset. like [0, 1, 2, 3, 4, 5, 6, 7, 8]
-        self.token_kv_slot_ids: List[int] = []
+        # KV blocks address. Each element is a block id, e.g. [3, 7, 2].
+        self.block_table = array("i")
+        # Number of tokens (including padded ones) in this context.
+        self._num_tokens = 0
+
+        # Cached block table of the whole context (parent tables + this table), and the
+        # parent table it was built from.
+        self._context_block_table: Optional[array] = None
+        self._cached_parent_table: Optional[array] = None
+        self._cached_parent_num_blocks = 0
 
         # Token ids
         self.token_ids: List[int] = []  # length = num_tokens
@@ -54,19 +68,6 @@ class BlockContext(LowLevelContext):
         # `last_hidden_state` for the `generation` primitive.
         self.last_hidden_state: Optional[torch.Tensor] = None
 
-    def _allocate_one(self):
-        idx = len(self.token_kv_block_ids)
-        if idx % self.block_size == 0:
-            cur_block_id = self.kv_cache_manager.allocate()
-            self.token_kv_block_ids.append(cur_block_id)
-            self.token_kv_slot_ids.append(cur_block_id * self.block_size)
-            # print(self.token_kv_block_ids, idx)
-        else:
-            cur_block_id = self.token_kv_block_ids[-1]
-            last_slot_id = self.token_kv_slot_ids[-1]
-            self.token_kv_block_ids.append(cur_block_id)
-            self.token_kv_slot_ids.append(last_slot_id + 1)
-
     def pad_to(self, length: int):
         """Pad the context to a certain length."""
 
@@ -75,9 +76,7 @@ class BlockContext(LowLevelContext):
 
         # Padded len = length - cur_len
         self.padded_len = length - cur_len
-
-        for _ in range(self.padded_len):
-            self._allocate_one()
+        self.allocate(self.padded_len)
 
         self.padded = True
 
@@ -86,18 +85,26 @@ class BlockContext(LowLevelContext):
         super().destruction()
 
         # Free every block in the manager
-        for block_id in self.token_kv_block_ids[:: self.block_size]:
-            self.kv_cache_manager.free(block_id)
+        self.kv_cache_manager.free_many(self.block_table)
 
     def allocate(self, length: int):
         """Allocate a certain length of blocks."""
 
-        for _ in range(length):
-            self._allocate_one()
+        num_tokens = self._num_tokens + length
+        num_new_blocks = (num_tokens + self.block_size - 1) // self.block_size - len(
+            self.block_table
+        )
+        if num_new_blocks > 0:
+            block_ids = self.kv_cache_manager.allocate_many(num_new_blocks)
+            self.block_table.extend(block_ids)
+            # Appending to the cached table keeps it valid.
+            if self._context_block_table is not None:
+                self._context_block_table.extend(block_ids)
+        self._num_tokens = num_tokens
 
     # override
     def get_this_context_len(self) -> int:
-        return len(self.token_kv_block_ids)  # token len
+        return self._num_tokens  # token len
 
     # override
     def get_last_token_id(self) -> int:
@@ -107,21 +114,51 @@ class BlockContext(LowLevelContext):
     def push_token_id(self, token_id: int):
         self.token_ids.append(token_id)
 
+    def get_context_block_table(self) -> array:
+        """Return the block table (one block id per block) of the whole context.
+
+        The returned array is owned by the context. Don't modify it.
+        """
+
+        if self.parent_context is None:
+            return self.block_table
+
+        parent_table = self.parent_context.get_context_block_table()
+        if (
+            self._context_block_table is None
+            or self._cached_parent_table is not parent_table
+            or self._cached_parent_num_blocks != len(parent_table)
+        ):
+            self._context_block_table = parent_table + self.block_table
+            self._cached_parent_table = parent_table
+            self._cached_parent_num_blocks = len(parent_table)
+        return self._context_block_table
+
+    def _get_slot_ids(self, start: int, end: int) -> List[int]:
+        block_table = np.array(self.get_context_block_table(), dtype=np.int64)
+        positions = np.arange(start, end, dtype=np.int64)
+        slot_ids = (
+            block_table[positions // self.block_size] * self.block_size
+            + positions % self.block_size
+        )
+        return slot_ids.tolist()
+
     def get_context_block_ids(self) -> List[int]:
-        """Return the context block ids."""
+        """Return the block id of each token in the context."""
 
-        parent_block_ids = (
-            self.parent_context.get_context_block_ids() if self.parent_context else []
-        )
-        return parent_block_ids + self.token_kv_block_ids
+        block_table = np.array(self.get_context_block_table(), dtype=np.int64)
+        return np.repeat(block_table, self.block_size)[: self.get_context_len()].tolist()
 
     def get_context_slot_ids(self) -> List[int]:
         """Return the context slot (block + offset) ids."""
 
-        parent_slot_ids = (
-            self.parent_context.get_context_slot_ids() if self.parent_context else []
-        )
-        return parent_slot_ids + self.token_kv_slot_ids
+        return self._get_slot_ids(0, self.get_context_len())
+
+    def get_last_slot_ids(self, num_tokens: int) -> List[int]:
+        """Return the slot ids of the last num_tokens tokens in the context."""
+
+        context_len = self.get_context_len()
+        return self._get_slot_ids(context_len - num_tokens, context_len)
 
     def get_last_hidden_state(self) -> torch.Tensor:
         """Return the last hidden state."""
@@ -2,11 +2,13 @@
 # Licensed under the MIT license.
 
 
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+import heapq
 import time
 
 from parrot.exceptions import parrot_assert
 from parrot.utils import get_logger, time_counter_in_nanoseconds
+from parrot.constants import FILL_NO_CHUNK
 
 from .primitive_job import PrimitiveJob, Fill, Generate
 from .config import SchedulerConfig
@@ -21,16 +23,43 @@ class EngineScheduler:
     Different from "scheduler/dispatcher" (which is actually a cluster scheduler) in serve layer,
     the scheduler in a engine/LLM is for deciding the order of jobs/sequences to be executed in the
     next batch.
+
+    Waiting jobs are kept in two heaps (Fill and Generate) ordered by (-priority,
+    task_arrival_time, job_arrival_time), so popping the next job and pushing back a
+    preempted job are O(log n). All jobs in the scheduler are also indexed by their context
+    ids. Running jobs with lower priority are preempted first (See JOB_PRIORITY_* in
+    constants).
+
+    If fill_chunk_size is set, a long Fill is executed in chunks of at most fill_chunk_size
+    tokens. Chunks are co-scheduled with Generate jobs under the batched tokens budget, and
+    running Generate jobs are served first, so decoding is not blocked by a long Fill.
     """
 
-    def __init__(self, config: SchedulerConfig) -> None:
+    def __init__(
+        self, config: SchedulerConfig, fill_chunk_size: int = FILL_NO_CHUNK
+    ) -> None:
         self.max_batch_size = config.max_batch_size
         self.max_num_batched_tokens = config.max_num_batched_tokens
         self.max_total_tokens = config.max_total_tokens
 
-        self.waiting_jobs: List[PrimitiveJob] = []
+        parrot_assert(
+            fill_chunk_size == FILL_NO_CHUNK or fill_chunk_size > 0,
+            f"Invalid fill_chunk_size: {fill_chunk_size}",
+        )
+        self.fill_chunk_size = fill_chunk_size
+
+        # Heap entries: (-priority, task_arrival_time, job_arrival_time, job_seq, job)
+        self._waiting_fill_jobs: List[Tuple[int, float, float, int, PrimitiveJob]] = []
+        self._waiting_gen_jobs: List[Tuple[int, float, float, int, PrimitiveJob]] = []
+        self._job_seq = 0  # Break ties in the heaps.
+
         self.running_jobs: List[PrimitiveJob] = []
 
+        # context_id -> job. Including both waiting and running jobs.
+        self._jobs: Dict[int, PrimitiveJob] = {}
+        # Context ids of waiting jobs.
+        self._waiting_context_ids = set()
+
         self.policy = config.policy
 
         # Use context id as key. Different jobs with the same context id can't
@@ -40,23 +69,101 @@ class EngineScheduler:
         # task_id as key.
         self.task_arrival_time: Dict[int, float] = {}
 
+    # ---------- Waiting Queue ----------
+
+    def _job_key(self, job: PrimitiveJob) -> Tuple[int, float, float]:
+        return (
+            -job.effective_priority,
+            self.task_arrival_time[job.task_id],
+            self.job_arrival_time[job.context_id],
+        )
+
+    def _push_waiting(self, job: PrimitiveJob) -> None:
+        heap = (
+            self._waiting_gen_jobs
+            if isinstance(job, Generate)
+            else self._waiting_fill_jobs
+        )
+        heapq.heappush(heap, (*self._job_key(job), self._job_seq, job))
+        self._job_seq += 1
+        self._waiting_context_ids.add(job.context_id)
+
+    def _peek_waiting(self) -> Optional[PrimitiveJob]:
+        """Get the first waiting job (Fill or Generate) without popping it."""
+
+        heap = self._first_waiting_heap()
+        if heap is None:
+            return None
+        return heap[0][-1]
+
+    def _pop_waiting(self) -> PrimitiveJob:
+        heap = self._first_waiting_heap()
+        parrot_assert(heap is not None, "No waiting jobs.")
+        job = heapq.heappop(heap)[-1]
+        self._waiting_context_ids.discard(job.context_id)
+        return job
+
+    def _first_waiting_heap(self) -> Optional[List]:
+        if len(self._waiting_fill_jobs) == 0:
+            return self._waiting_gen_jobs if len(self._waiting_gen_jobs) > 0 else None
+        if len(self._waiting_gen_jobs) == 0:
+            return self._waiting_fill_jobs
+        if self._waiting_fill_jobs[0] < self._waiting_gen_jobs[0]:
+            return self._waiting_fill_jobs
+        return self._waiting_gen_jobs
+
+    @property
+    def waiting_jobs(self) -> List[PrimitiveJob]:
+        """Waiting jobs, in the order to be scheduled."""
+
+        entries = sorted(self._waiting_fill_jobs + self._waiting_gen_jobs)
+        return [entry[-1] for entry in entries]
+
+    @property
+    def num_waiting_jobs(self) -> int:
+        """Get the number of waiting jobs."""
+
+        return len(self._waiting_fill_jobs) + len(self._waiting_gen_jobs)
+
+    # ---------- Jobs ----------
+
     def add_job(self, job: PrimitiveJob) -> None:
         """Add a job to the scheduler."""
 
-        self.waiting_jobs.append(job)
+        parrot_assert(
+            job.context_id not in self._jobs,
+            f"Context {job.context_id} already has a job in the scheduler.",
+        )
+
         cur_time = time_counter_in_nanoseconds()
         self.job_arrival_time[job.context_id] = cur_time
         if job.task_id not in self.task_arrival_time:
             self.task_arrival_time[job.task_id] = cur_time
 
+        self._jobs[job.context_id] = job
+        self._push_waiting(job)
+
     def remove_job(self, job: PrimitiveJob) -> None:
         """Remove a job from the scheduler."""
 
         # self.running_jobs.remove(job)
+        self._jobs.pop(job.context_id, None)
         self.job_arrival_time.pop(job.context_id)
         if job.end_flag:
             self.task_arrival_time.pop(job.task_id)
 
+    def get_job(self, context_id: int) -> Optional[PrimitiveJob]:
+        """Get the job (waiting or running) of a context. None if there is no such job."""
+
+        return self._jobs.get(context_id)
+
+    def is_running(self, context_id: int) -> bool:
+        """Whether the job of a context is running."""
+
+        return (
+            context_id in self._jobs and context_id not in self._waiting_context_ids
+        )
+
     @property
     def num_running_jobs(self) -> int:
         """Get the number of running jobs."""
@@ -67,7 +174,7 @@ class EngineScheduler:
     def num_total_jobs(self) -> int:
         """Get the number of total jobs."""
 
-        return len(self.waiting_jobs) + len(self.running_jobs)
+        return self.num_waiting_jobs + len(self.running_jobs)
 
     @property
     def is_empty(self) -> bool:
@@ -77,47 +184,117 @@ class EngineScheduler:
         # return len(self.waiting_jobs) == 0 and len(self.running_jobs) == 0
         return self.num_total_jobs == 0
 
+    # ---------- Chunked Fill ----------
+
+    def _next_num_tokens(self, job: PrimitiveJob, budget: int) -> int:
+        """Number of tokens the job will process in the next iteration, given the left
+        batched tokens budget. For a chunked Fill, it's the length of its next chunk."""
+
+        if isinstance(job, Generate) or job.token_ids is None:
+            return 1
+
+        num_tokens = job.num_remaining_tokens
+        if self.fill_chunk_size != FILL_NO_CHUNK and num_tokens > 0:
+            # Shrink the chunk to fit the budget. The chunk is never empty.
+            num_tokens = max(1, min(num_tokens, self.fill_chunk_size, budget))
+        return num_tokens
+
+    def _schedule_running_chunks(self) -> int:
+        """Assign the next chunks to running (partially filled) Fill jobs, after all running
+        Generate jobs. Fill jobs which can't fit the budget are preempted.
+
+        Returns:
+            The number of batched tokens of the running jobs.
+        """
+
+        num_batched_tokens = sum(
+            1 for job in self.running_jobs if not isinstance(job, Fill)
+        )
+
+        new_running: List[PrimitiveJob] = []
+        for job in self.running_jobs:
+            if isinstance(job, Fill):
+                job_num_tokens = self._next_num_tokens(
+                    job, self.max_num_batched_tokens - num_batched_tokens
+                )
+                if num_batched_tokens + job_num_tokens > self.max_num_batched_tokens:
+                    self._preempt(job)
+                    continue
+                job.chunk_len = job_num_tokens
+                num_batched_tokens += job_num_tokens
+            new_running.append(job)
+
+        self.running_jobs = new_running
+        return num_batched_tokens
+
+    # ---------- Schedule ----------
+
     def schedule(self) -> List[PrimitiveJob]:
         """Schedule jobs."""
 
         # TGI-style scheduling: Fill and Gen jobs are scheduled separately.
         if self.policy == "tgi":
-            cur_tokens_sum = 0
-            cur_num_jobs = 0
+            cur_num_batched_tokens = 0
+            cur_total_tokens = 0
             fill_running_jobs = []
 
-            for job in self.waiting_jobs:
-                if not isinstance(job, Fill):
-                    continue
+            # Partially filled Fill jobs are scheduled again with other Fill jobs.
+            new_running: List[PrimitiveJob] = []
+            for job in self.running_jobs:
+                if isinstance(job, Fill):
+                    self._preempt(job)
+                else:
+                    new_running.append(job)
+            self.running_jobs = new_running
 
-                job_num_tokens = len(job.token_ids) if job.token_ids else 0
+            while len(self._waiting_fill_jobs) > 0:
+                job = self._waiting_fill_jobs[0][-1]
 
-                if cur_tokens_sum + job_num_tokens > self.max_num_batched_tokens:
+                job_num_tokens = self._next_num_tokens(
+                    job, self.max_num_batched_tokens - cur_num_batched_tokens
+                )
+
+                if (
+                    cur_num_batched_tokens + job_num_tokens
+                    > self.max_num_batched_tokens
+                ):
                     break
 
+                heapq.heappop(self._waiting_fill_jobs)
+                self._waiting_context_ids.discard(job.context_id)
+                job.chunk_len = job_num_tokens
                 fill_running_jobs.append(job)
                 if job.start_time == -1:
                     job.start_time = time_counter_in_nanoseconds()
-                cur_tokens_sum += job_num_tokens
-                cur_num_jobs += 1
+                cur_num_batched_tokens += job_num_tokens
 
             if len(fill_running_jobs) > 0:
-                # Remove all fill_running_jobs from waiting_jobs.
-                self.waiting_jobs = [
-                    job for job in self.waiting_jobs if job not in fill_running_jobs
-                ]
-
                 # Preempte all running Generation jobs.
-                self.waiting_jobs = self.running_jobs + self.waiting_jobs  # FIFO
+                for job in self.running_jobs:
+                    self._preempt(job)
                 self.running_jobs = fill_running_jobs
-                ret = fill_running_jobs.copy()
+            else:
+                # No Fill jobs. Batch the Generation jobs.
+                cur_num_batched_tokens = len(self.running_jobs)
+                while len(self._waiting_gen_jobs) > 0:
+                    if cur_num_batched_tokens + 1 > self.max_batch_size:
+                        break
+                    if cur_num_batched_tokens + 1 > self.max_num_batched_tokens:
+                        break
+
+                    job = heapq.heappop(self._waiting_gen_jobs)[-1]
+                    self._waiting_context_ids.discard(job.context_id)
+                    self.running_jobs.append(job)
+                    if job.start_time == -1:
+                        job.start_time = time_counter_in_nanoseconds()
+                    cur_num_batched_tokens += 1
 
-            assert False  # TODO: fix
+            cur_num_jobs = len(self.running_jobs)
+            # NOTE(chaofan): Use copy() to avoid list modification.
+            ret = self.running_jobs.copy()
         elif self.policy == "fifo_v1":
             cur_num_jobs = len(self.running_jobs)
-            cur_num_batched_tokens = len(
-                self.running_jobs
-            )  # Note: running jobs must be all Gen jobs.
+            cur_num_batched_tokens = self._schedule_running_chunks()
             cur_total_tokens = sum(
                 [job.context.get_context_len() for job in self.running_jobs]
             )
@@ -126,13 +303,11 @@ class EngineScheduler:
             #     f"Scheduling: Waiting: {len(self.waiting_jobs)} Running: {len(self.running_jobs)}"
             # )
 
-            while self.waiting_jobs:
-                job = self.waiting_jobs[0]
+            while self.num_waiting_jobs > 0:
+                job = self._peek_waiting()
 
-                job_num_tokens = (
-                    1
-                    if isinstance(job, Generate) or job.token_ids is None
-                    else len(job.token_ids)
+                job_num_tokens = self._next_num_tokens(
+                    job, self.max_num_batched_tokens - cur_num_batched_tokens
                 )
                 # NOTE(chaofan): In shared prefix mode, we should only count the prefix context once.
                 job_total_tokens = job.context.get_context_len()
@@ -149,9 +324,11 @@ class EngineScheduler:
                     break
 
                 self.running_jobs.append(job)
+                if isinstance(job, Fill):
+                    job.chunk_len = job_num_tokens
                 if job.start_time == -1:
                     job.start_time = time_counter_in_nanoseconds()
-                self.waiting_jobs.pop(0)
+                self._pop_waiting()
 
                 # Update
                 cur_num_jobs += 1
@@ -162,21 +339,17 @@ class EngineScheduler:
             ret = self.running_jobs.copy()
         else:
             cur_num_jobs = len(self.running_jobs)
-            cur_num_batched_tokens = len(
-                self.running_jobs
-            )  # Note: running jobs must be all Gen jobs.
+            cur_num_batched_tokens = self._schedule_running_chunks()
 
             # print(
             #     f"Scheduling: Waiting: {len(self.waiting_jobs)} Running: {len(self.running_jobs)}"
             # )
 
-            while self.waiting_jobs:
-                job = self.waiting_jobs[0]
+            while self.num_waiting_jobs > 0:
+                job = self._peek_waiting()
 
-                job_num_tokens = (
-                    1
-                    if isinstance(job, Generate) or job.token_ids is None
-                    else len(job.token_ids)
+                job_num_tokens = self._next_num_tokens(
+                    job, self.max_num_batched_tokens - cur_num_batched_tokens
                 )
                 # Constraints
                 if cur_num_jobs + 1 > self.max_batch_size:
@@ -188,9 +361,11 @@ class EngineScheduler:
                     break
 
                 self.running_jobs.append(job)
+                if isinstance(job, Fill):
+                    job.chunk_len = job_num_tokens
                 if job.start_time == -1:
                     job.start_time = time.perf_counter_ns()
-                self.waiting_jobs.pop(0)
+                self._pop_waiting()
 
                 # Update
                 cur_num_jobs += 1
@@ -211,12 +386,7 @@ class EngineScheduler:
 
             # For normal mode, we repeatly count prefix because it's repeated loaded.
 
-            self.running_jobs.sort(
-                key=lambda job: (
-                    self.task_arrival_time[job.task_id],
-                    self.job_arrival_time[job.context_id],
-                )
-            )
+            self.running_jobs.sort(key=self._job_key)
 
             # print(f"Running jobs: {self.running_jobs}")
 
@@ -251,7 +421,7 @@ class EngineScheduler:
         return ret
 
     def _preempt(self, job) -> None:
-        self.waiting_jobs.insert(0, job)
+        self._push_waiting(job)
         # logger.debug(f"Job {job} preempted.")
 
     def finish(self) -> None:
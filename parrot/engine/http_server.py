@@ -59,6 +59,13 @@ async def free_context(request: Request):
     return await llm_engine.free_context(payload)
 
 
+@app.post("/free_contexts")
+async def free_contexts(request: Request):
+    payload = await request.json()
+    logger.debug(f"Received free_contexts request")
+    return await llm_engine.free_contexts(payload)
+
+
 @app.post("/ping")
 async def ping(request: Request):
     rt_info = llm_engine.get_runtime_info(profile=False)  # For speed
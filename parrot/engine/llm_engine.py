@@ -106,6 +106,37 @@ class LLMEngine(ABC):
         """
         ...
 
+    async def free_contexts(self, payload: Dict) -> Dict:
+        """Free contexts API (batched version of free_context).
+
+        Each context is freed on its own, so a context which can't be freed (e.g. it's
+        still running) doesn't block the others in the batch.
+
+        Args:
+            payload: Dict[str, Any]. The payload of the free contexts API.
+
+        Returns:
+            Dict. The response of the free contexts API. "freed" tells whether each
+            context is freed. The context_len of a context not freed is 0.
+        """
+
+        context_lens = []
+        freed = []
+        for context_id in payload["context_ids"]:
+            try:
+                resp = await self.free_context({"context_id": context_id})
+            except Exception as e:
+                logger.warning(f"Context {context_id} is not freed: {e}")
+                context_lens.append(0)
+                freed.append(False)
+                continue
+            context_lens.append(resp["context_len"])
+            freed.append(True)
+        return {
+            "context_lens": context_lens,
+            "freed": freed,
+        }
+
     @abstractmethod
     def get_runtime_info(self, profile: bool) -> EngineRuntimeInfo:
         """Get runtime info of this engine.
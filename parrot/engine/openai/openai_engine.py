@@ -10,7 +10,7 @@ import asyncio
 from parrot.utils import get_logger, create_task_in_loop, time_counter_in_nanoseconds
 from parrot.sampling_config import SamplingConfig
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
-from parrot.constants import UNKNOWN_DATA_FIELD
+from parrot.constants import UNKNOWN_DATA_FIELD, JOB_PRIORITY_NORMAL
 
 from .api_endpoint import Endpoint
 from ..context.text_context import TextContext
@@ -136,6 +136,7 @@ class OpenAIEngine(LLMEngine):
             context_id=payload["context_id"],
             parent_context_id=payload["parent_context_id"],
             text=payload["text"],
+            priority=payload.get("priority", JOB_PRIORITY_NORMAL),
         )
 
         self._add_job(fill_job)
@@ -155,6 +156,7 @@ class OpenAIEngine(LLMEngine):
             context_id=payload["context_id"],
             parent_context_id=payload["parent_context_id"],
             sampling_config=SamplingConfig(**payload["sampling_config"]),
+            priority=payload.get("priority", JOB_PRIORITY_NORMAL),
         )
 
         self._add_job(generation_job)
@@ -212,6 +214,7 @@ class OpenAIEngine(LLMEngine):
             elif isinstance(job, Generate):
                 # Execute it in background.
                 self.scheduler.running_jobs.remove(job)  # Avoiding repeated execution
+                self.scheduler.remove_job(job)
                 create_task_in_loop(self._execute_job(job))
 
         self.scheduler.finish()
@@ -6,6 +6,7 @@ from typing import List, Optional
 from asyncio import Event, Queue as AsyncQueue
 
 from parrot.sampling_config import SamplingConfig
+from parrot.constants import JOB_PRIORITY_NORMAL, JOB_PRIORITY_FIRST_TOKEN
 
 from .context.low_level_context import LowLevelContext
 
@@ -20,18 +21,26 @@ class PrimitiveJob:
         context_id: int,
         parent_context_id: int,
         end_flag: bool,
+        priority: int = JOB_PRIORITY_NORMAL,
     ) -> None:
         self.session_id = session_id
         self.task_id = task_id
         self.end_flag = end_flag
         self.context_id = context_id
         self.parent_context_id = parent_context_id
+        self.priority = priority
         self.context: Optional[LowLevelContext] = None
         self.finish_event = Event()
 
         self.start_time: float = -1
         self.end_time: float = -1
 
+    @property
+    def effective_priority(self) -> int:
+        """The priority used by the scheduler now. See JOB_PRIORITY_* in constants."""
+
+        return self.priority
+
 
 class Fill(PrimitiveJob):
     """Fill primitive is corresponding to the `prefill` stage in LLM.
@@ -49,11 +58,40 @@ class Fill(PrimitiveJob):
         end_flag: bool = False,
         token_ids: Optional[List[int]] = None,
         text: Optional[str] = None,
+        priority: int = JOB_PRIORITY_NORMAL,
     ) -> None:
-        super().__init__(session_id, task_id, context_id, parent_context_id, end_flag)
+        super().__init__(
+            session_id, task_id, context_id, parent_context_id, end_flag, priority
+        )
         self.token_ids = token_ids
         self.text = text
 
+        # For chunked Fill. A long Fill can be executed in several iterations, each
+        # filling a chunk of tokens. By default, the whole Fill is one chunk.
+        self.filled_len = 0  # Number of tokens filled in previous chunks.
+        self.chunk_len = self.num_remaining_tokens  # Length of the current chunk.
+
+    @property
+    def num_remaining_tokens(self) -> int:
+        """Number of tokens not filled yet."""
+
+        if self.token_ids is None:
+            return 0
+        return len(self.token_ids) - self.filled_len
+
+    @property
+    def chunk_token_ids(self) -> List[int]:
+        """Token ids of the current chunk."""
+
+        return self.token_ids[self.filled_len : self.filled_len + self.chunk_len]
+
+    def finish_chunk(self) -> bool:
+        """Mark the current chunk as filled. Return whether the whole Fill is finished."""
+
+        self.filled_len += self.chunk_len
+        self.chunk_len = self.num_remaining_tokens
+        return self.chunk_len == 0
+
     def __repr__(self) -> str:
         return (
             f"Fill(session_id={self.session_id}, "
@@ -77,13 +115,23 @@ class Generate(PrimitiveJob):
         parent_context_id: int,
         sampling_config: SamplingConfig,
         end_flag: bool = False,
+        priority: int = JOB_PRIORITY_NORMAL,
     ) -> None:
-        super().__init__(session_id, task_id, context_id, parent_context_id, end_flag)
+        super().__init__(
+            session_id, task_id, context_id, parent_context_id, end_flag, priority
+        )
         self.sampling_config = sampling_config
         self.output_queue: AsyncQueue[int] = AsyncQueue()  # For token streaming
         self.gen_text = ""  # For text generation
         self.gen_length = 0
 
+    @property
+    def effective_priority(self) -> int:
+        # The first-token priority is dropped once the first token is generated.
+        if self.priority == JOB_PRIORITY_FIRST_TOKEN and self.gen_length > 0:
+            return JOB_PRIORITY_NORMAL
+        return self.priority
+
     def __repr__(self) -> str:
         return (
             f"Generate(session_id={self.session_id}, "
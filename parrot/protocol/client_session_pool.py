@@ -0,0 +1,61 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+from typing import Dict
+
+import aiohttp
+
+from parrot.utils import get_logger, create_task_in_loop
+
+
+logger = get_logger("ClientSessionPool")
+
+
+class ClientSessionPool:
+    """A registry of aiohttp ClientSessions, keyed by the HTTP address of the server.
+
+    Each ClientSession owns a connector with keep-alive connections, so requests to the same
+    server reuse TCP connections instead of setting up a new one per request. The connector
+    also limits the number of concurrent connections to a server.
+
+    NOTE: ClientSessions are created lazily, since they must be created inside a
+    running event loop.
+    """
+
+    def __init__(self, limit_per_host: int, keepalive_timeout: float):
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+
+        # http_addr -> ClientSession
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def get_session(self, http_addr: str) -> aiohttp.ClientSession:
+        """Get the ClientSession of a server. Create it if it doesn't exist."""
+
+        session = self._sessions.get(http_addr)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[http_addr] = session
+            logger.debug(f"ClientSession for {http_addr} created.")
+        return session
+
+    def remove_session(self, http_addr: str) -> None:
+        """Remove the ClientSession of a server and close it in the background."""
+
+        session = self._sessions.pop(http_addr, None)
+        if session is not None and not session.closed:
+            create_task_in_loop(session.close(), fail_fast=False)
+            logger.debug(f"ClientSession for {http_addr} removed.")
+
+    async def close_all(self) -> None:
+        """Close all ClientSessions."""
+
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
@@ -3,6 +3,7 @@
 
 
 from typing import Type, Optional, Literal
+import contextlib
 import requests
 import aiohttp
 
@@ -14,6 +15,17 @@ from .base_response import BaseResponse, make_response, async_make_response
 logger = get_logger("API")
 
 
+@contextlib.asynccontextmanager
+async def client_session_scope(client_session: Optional[aiohttp.ClientSession]):
+    """Use the given (pooled) ClientSession, or a temporary one if not given."""
+
+    if client_session is not None:
+        yield client_session
+    else:
+        async with aiohttp.ClientSession() as new_client_session:
+            yield new_client_session
+
+
 def send_http_request(
     response_cls: Type[BaseResponse],
     http_addr: str,
@@ -2,14 +2,19 @@
 # Licensed under the MIT license.
 
 
+import asyncio
 import aiohttp
 from dataclasses import asdict
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from parrot.utils import get_logger
 
 from ..base_response import BaseResponse
-from ..http_utils import send_http_request
+from ..http_utils import (
+    send_http_request,
+    async_send_http_request,
+    client_session_scope,
+)
 from .runtime_info import EngineRuntimeInfo
 
 
@@ -25,6 +30,7 @@ Engine Management (Engine side):
 
 Context & LLMs:
     - free_context POST
+    - free_contexts POST
     - fill POST
     - generate POST
     - generate_stream POST
@@ -54,6 +60,11 @@ class FreeContextResponse(BaseResponse):
     context_len: int
 
 
+class FreeContextsResponse(BaseResponse):
+    context_lens: List[int]
+    freed: List[bool]
+
+
 class FillResponse(BaseResponse):
     filled_len: int
 
@@ -80,6 +91,66 @@ def free_context(http_addr: str, context_id: int) -> FreeContextResponse:
         raise e
 
 
+async def afree_contexts(
+    http_addr: str,
+    context_ids: List[int],
+    retry_times: int,
+    retry_interval: float,
+    client_session: Optional[aiohttp.ClientSession] = None,
+) -> Dict[int, int]:
+    """Free contexts in an engine in a batch. Only the contexts not freed yet are
+    retried.
+
+    The requests are sent by the given (pooled) ClientSession, or a temporary one if not
+    given.
+
+    Returns:
+        context_id -> context_len of the freed contexts. Contexts not freed (after the
+        retries) are absent.
+    """
+
+    freed_context_lens: Dict[int, int] = {}
+    pending_ids = list(context_ids)
+    async with client_session_scope(client_session) as client_session:
+        for i in range(retry_times):
+            try:
+                resp = await async_send_http_request(
+                    client_session,
+                    FreeContextsResponse,
+                    http_addr,
+                    "/free_contexts",
+                    context_ids=pending_ids,
+                )
+                failed_ids = []
+                for context_id, context_len, freed in zip(
+                    pending_ids, resp.context_lens, resp.freed
+                ):
+                    if freed:
+                        freed_context_lens[context_id] = context_len
+                    else:
+                        failed_ids.append(context_id)
+                pending_ids = failed_ids
+                if len(pending_ids) == 0:
+                    break
+                logger.warning(
+                    f"Contexts (context_ids={pending_ids}) are not freed in "
+                    f"{http_addr} (attempt {i + 1}/{retry_times})."
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Free contexts error in {http_addr} (attempt {i + 1}/{retry_times}). "
+                    f"Error: {e}"
+                )
+            if i + 1 < retry_times:
+                await asyncio.sleep(retry_interval)
+
+    if len(pending_ids) > 0:
+        logger.error(
+            f"Contexts (context_ids={pending_ids}) are not freed in {http_addr}."
+        )
+    return freed_context_lens
+
+
 def ping_engine(http_addr: str) -> PingEngineResponse:
     try:
         return send_http_request(
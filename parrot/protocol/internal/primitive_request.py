@@ -8,8 +8,10 @@ import time
 import aiohttp
 
 from parrot.utils import get_logger, time_counter_in_nanoseconds
+from parrot.constants import JOB_PRIORITY_NORMAL
 
 from ..http_utils import (
+    client_session_scope,
     send_http_request,
     async_send_http_request,
     async_send_http_request_streaming,
@@ -43,6 +45,7 @@ class Fill(Primitive):
 
     token_ids: Optional[List[int]] = None
     text: Optional[str] = None
+    priority: int = JOB_PRIORITY_NORMAL
 
     def post(self, engine_url: str) -> FillResponse:
         try:
@@ -59,6 +62,7 @@ class Fill(Primitive):
                 end_flag=self.end_flag,
                 token_ids=self.token_ids,
                 text=self.text,
+                priority=self.priority,
             )
             ed = time_counter_in_nanoseconds()
             logger.debug(
@@ -69,9 +73,13 @@ class Fill(Primitive):
             logger.error(f"Fill error in {engine_url} error: {e}")
             raise e
 
-    async def apost(self, engine_url: str) -> FillResponse:
+    async def apost(
+        self,
+        engine_url: str,
+        client_session: Optional[aiohttp.ClientSession] = None,
+    ) -> FillResponse:
         try:
-            async with aiohttp.ClientSession() as client_session:
+            async with client_session_scope(client_session) as client_session:
                 st = time_counter_in_nanoseconds()
                 resp: FillResponse = await async_send_http_request(
                     client_session=client_session,
@@ -85,6 +93,7 @@ class Fill(Primitive):
                     parent_context_id=self.parent_context_id,
                     token_ids=self.token_ids,
                     text=self.text,
+                    priority=self.priority,
                 )
                 ed = time_counter_in_nanoseconds()
                 logger.debug(
@@ -105,10 +114,15 @@ class Generate(Primitive):
     """
 
     sampling_config: SamplingConfig
+    priority: int = JOB_PRIORITY_NORMAL
 
-    async def apost(self, engine_url: str) -> GenerateResponse:
+    async def apost(
+        self,
+        engine_url: str,
+        client_session: Optional[aiohttp.ClientSession] = None,
+    ) -> GenerateResponse:
         try:
-            async with aiohttp.ClientSession() as client_session:
+            async with client_session_scope(client_session) as client_session:
                 st = time_counter_in_nanoseconds()
                 resp: GenerateResponse = await async_send_http_request(
                     client_session=client_session,
@@ -121,6 +135,7 @@ class Generate(Primitive):
                     parent_context_id=self.parent_context_id,
                     end_flag=self.end_flag,
                     sampling_config=asdict(self.sampling_config),
+                    priority=self.priority,
                 )
                 ed = time_counter_in_nanoseconds()
                 logger.debug(
@@ -132,9 +147,13 @@ class Generate(Primitive):
             logger.error(f"Generate error in {engine_url} error: {e}")
             raise e
 
-    async def astream(self, engine_url: str) -> AsyncGenerator:
+    async def astream(
+        self,
+        engine_url: str,
+        client_session: Optional[aiohttp.ClientSession] = None,
+    ) -> AsyncGenerator:
         try:
-            async with aiohttp.ClientSession() as client_session:
+            async with client_session_scope(client_session) as client_session:
                 st = time_counter_in_nanoseconds()
                 async for resp in async_send_http_request_streaming(
                     client_session=client_session,
@@ -146,6 +165,7 @@ class Generate(Primitive):
                     end_flag=self.end_flag,
                     parent_context_id=self.parent_context_id,
                     sampling_config=asdict(self.sampling_config),
+                    priority=self.priority,
                 ):
                     # self.context.token_nums += 1
                     yield resp
@@ -71,7 +71,9 @@ class GetSemanticVariableListResponse(BaseResponse):
 # ---------- APIs ----------
 
 
-def register_session(http_addr: str, api_key: str) -> RegisterSessionResponse:
+def register_session(
+    http_addr: str, api_key: str, weight: float = 1.0
+) -> RegisterSessionResponse:
     try:
         return send_http_request(
             RegisterSessionResponse,
@@ -79,6 +81,7 @@ def register_session(http_addr: str, api_key: str) -> RegisterSessionResponse:
             f"/{API_VERSION}/session",
             retry_times=1,
             api_key=api_key,
+            weight=weight,
         )
     except BaseException as e:
         logger.error(f"Register session error in {http_addr}. Error: {e}")
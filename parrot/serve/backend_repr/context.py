@@ -45,6 +45,10 @@ class Context:
             Event()
         )  # Ready event indicates the context has been filled in the backend.
 
+        # Whether filling the context failed (e.g. its engine died). A failed context is
+        # also marked ready, to wake up the tasks waiting for it.
+        self.failed = False
+
         # The number of tokens this context (don't include its parent) holds.
         self.tokens_num = 0
 
@@ -3,7 +3,8 @@
 
 
 from enum import Enum
-from typing import List, Dict, Optional
+from asyncio import Event
+from typing import Callable, List, Dict, Optional
 
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 
@@ -40,6 +41,9 @@ class ServeLayerRuntimeInfo:
         # task_id -> upperbound
         self.tasks_num_upperbounds: Dict[int, int] = {}
 
+        # task_id -> tokens_num added by the task
+        self.tasks_tokens_nums: Dict[int, int] = {}
+
 
 class ExecutionEngine:
     """Represent an execution engine in the backend."""
@@ -58,6 +62,8 @@ class ExecutionEngine:
         # ---------- Status ----------
         self.status: EngineStatus = EngineStatus.RUNNING
         self.bad_exception: Optional[Exception] = None
+        # Set when the engine stops running, to cancel the requests in flight to it.
+        self._stopped_event: Event = Event()
 
         # ---------- Runtime Info ----------
 
@@ -72,6 +78,10 @@ class ExecutionEngine:
         self._real_time_runtime_info = EngineRuntimeInfo()
         self._serve_layer_runtime_info = ServeLayerRuntimeInfo()
 
+        # Called when the status or the remaining tokens capacity of the engine changes,
+        # so the indexes of the engine (in EngineManager) can be updated.
+        self._change_listener: Optional[Callable[["ExecutionEngine"], None]] = None
+
     @classmethod
     def from_engine_config(
         cls, engine_id: int, config: EngineConfig
@@ -84,14 +94,35 @@ class ExecutionEngine:
 
     # ---------- Status Methods ----------
 
+    def set_change_listener(
+        self, listener: Optional[Callable[["ExecutionEngine"], None]]
+    ) -> None:
+        self._change_listener = listener
+
+    def _notify_change(self) -> None:
+        if self._change_listener is not None:
+            self._change_listener(self)
+
     def mark_bad(self, exception: Exception) -> None:
         self.status = EngineStatus.BAD
         self.bad_exception = exception
+        self._stopped_event.set()
+        self._notify_change()
+
+    def mark_dead(self) -> None:
+        self.status = EngineStatus.DEAD
+        self._stopped_event.set()
+        self._notify_change()
 
     @property
     def is_running(self) -> bool:
         return self.status == EngineStatus.RUNNING
 
+    async def wait_stopped(self) -> None:
+        """Wait until the engine stops running (i.e. it's marked dead or bad)."""
+
+        await self._stopped_event.wait()
+
     # ---------- Basic Info ----------
 
     @property
@@ -151,10 +182,16 @@ class ExecutionEngine:
             + list(self._serve_layer_runtime_info.tasks_num_upperbounds.values())
         )
 
-    def update_realtime_runtime_info(self, runtime_info: EngineRuntimeInfo) -> None:
-        """Update the real-time runtime info of the engine."""
+    def update_realtime_runtime_info(self, runtime_info: EngineRuntimeInfo) -> bool:
+        """Update the real-time runtime info of the engine.
+
+        Returns:
+            bool: Whether the runtime info is changed.
+        """
 
+        changed = runtime_info != self._real_time_runtime_info
         self._real_time_runtime_info = runtime_info
+        return changed
 
     def update_servelayer_runtime_info_add_task(self, task: "CompletionTask") -> None:
         """Update the serve-layer runtime info by a task scheduled to it."""
@@ -173,6 +210,8 @@ class ExecutionEngine:
         if self.model_type == ModelType.TOKEN_ID:
             tokens_num = task.get_token_nums(self.tokenizer_name)
             self._serve_layer_runtime_info.tokens_num += tokens_num
+            self._serve_layer_runtime_info.tasks_tokens_nums[task.task_id] = tokens_num
+            self._notify_change()
             debug_str = f" (Add {tokens_num} tokens, Total {self._serve_layer_runtime_info.tokens_num} tokens)"
 
         # logger.debug(
@@ -193,8 +232,12 @@ class ExecutionEngine:
         self._serve_layer_runtime_info.tasks_num_upperbounds.pop(task.task_id)
 
         if self.model_type == ModelType.TOKEN_ID:
-            tokens_num = task.get_token_nums(self.tokenizer_name)
+            # NOTE: Subtract exactly what the task added.
+            tokens_num = self._serve_layer_runtime_info.tasks_tokens_nums.pop(
+                task.task_id
+            )
             self._serve_layer_runtime_info.tokens_num -= tokens_num
+            self._notify_change()
             debug_str = f" (Lose {tokens_num} tokens, Remaining {self._serve_layer_runtime_info.tokens_num} tokens)"
 
         # logger.debug(
@@ -209,3 +252,9 @@ class ExecutionEngine:
 
     def get_num_cached_tokens(self) -> int:
         return self._real_time_runtime_info.num_cached_tokens
+
+    def get_num_total_jobs(self) -> int:
+        return self._real_time_runtime_info.num_total_jobs
+
+    def get_recent_average_latency(self) -> float:
+        return self._real_time_runtime_info.recent_average_latency
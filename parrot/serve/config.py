@@ -19,6 +19,22 @@ class ServeCoreConfig:
     session_life_span: int = 600
     engine_heartbeat_timeout: int = 600
     constant_prefix_var_timeout: int = 600
+    # Whether the ServeCore loop is woken up by events (submit/finish/heartbeat) instead of
+    # busy polling.
+    event_driven_loop: bool = True
+    # Memory budget (in bytes) of the tokenization cache of each tokenizer.
+    tokenization_cache_budget: int = 256 * 1024 * 1024
+    # Where large inputs are tokenized/detokenized: "thread", "process" or "none" (in the
+    # event loop), and the number of workers.
+    tokenizer_executor: str = "thread"
+    tokenizer_workers: int = 4
+    # Whether the content of a SV is tokenized in the background once it's set, instead
+    # of when its consumers are scheduled.
+    eager_tokenization: bool = True
+    # How many times a task is rescheduled to another engine when its engine fails, and
+    # the time window (in seconds, since the first failure) in which it's rescheduled.
+    task_max_retries: int = 2
+    task_retry_timeout: float = 60.0
 
     @classmethod
     def verify_config(cls, config: Dict) -> bool:
@@ -30,7 +46,15 @@ class ServeCoreConfig:
         - max_sessions_num: int
         - max_engines_num: int
         - session_life_span: int
+        - event_driven_loop: bool (Optional)
+        - tokenization_cache_budget: int (Optional)
+        - tokenizer_executor: str (Optional)
+        - tokenizer_workers: int (Optional)
+        - eager_tokenization: bool (Optional)
+        - task_max_retries: int (Optional)
+        - task_retry_timeout: float (Optional)
         - global_scheduler: Dict (Global scheduler config)
+        - prefix_matcher: Dict (Optional, PrefixMatcher config)
         """
 
         if "global_scheduler" not in config:
@@ -2,12 +2,19 @@
 # Licensed under the MIT license.
 
 
-from typing import Dict, List
+import asyncio
+from asyncio import Event
+from typing import Dict, List, Set, Optional
 
-from parrot.protocol.internal.layer_apis import free_context
+from parrot.protocol.internal.layer_apis import afree_contexts
+from parrot.protocol.client_session_pool import ClientSessionPool
 from parrot.utils import get_logger, RecyclePool
-from parrot.constants import NONE_CONTEXT_ID
-from parrot.exceptions import parrot_assert, ParrotCoreInternalError
+from parrot.constants import (
+    NONE_CONTEXT_ID,
+    FREE_CONTEXTS_RETRY_TIMES,
+    FREE_CONTEXTS_RETRY_INTERVAL,
+)
+from parrot.exceptions import parrot_assert
 
 from parrot.serve.backend_repr import Context, ExecutionEngine
 from parrot.serve.scheduler import CompletionTask
@@ -16,62 +23,187 @@ from parrot.serve.scheduler import CompletionTask
 logger = get_logger("ContextManager")
 
 
-_PREFIX_HASH_BRACKET_LEFT = "{{"
-_PREFIX_HASH_BRACKET_RIGHT = "}}"
+class PrefixCacheNode:
+    """A node in the PrefixCache radix tree.
+
+    A node represents the prefix formed by the var ids on the path from the root to it.
+    It stores the context ids of this prefix in different engines.
+    """
+
+    def __init__(self, var_id: Optional[str], parent: Optional["PrefixCacheNode"]):
+        self.var_id = var_id
+        self.parent = parent
+
+        # var_id -> child node
+        self.children: Dict[str, "PrefixCacheNode"] = {}
+
+        # engine_id -> context id
+        self.engine_contexts: Dict[int, int] = {}
+
+    @property
+    def is_root(self) -> bool:
+        return self.parent is None
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.children) == 0 and len(self.engine_contexts) == 0
 
 
 class PrefixCache:
-    """PrefixCache maps a prefix hash to a context id.
+    """PrefixCache maps a prefix to its contexts in different engines.
 
-    A prefix hash is a List of SemanticVariable ids.
+    A prefix is a List of SemanticVariable ids. Prefixes are stored in a radix tree shared by
+    all engines, with one child edge per var id and per-engine context ids stored at each node.
 
     Example:
-    {{sv0}} -> Context0
-    {{sv0}}{{sv1}} -> Context1
-    {{sv0}}{{sv1}}{{sv2}} -> Context2
-    {{sv0}}{{sv1}}{{sv3}} -> Context3
+    [sv0] -> {engine0: Context0, engine1: Context4}
+    [sv0, sv1] -> {engine0: Context1}
+    [sv0, sv1, sv2] -> {engine0: Context2}
+    [sv0, sv1, sv3] -> {engine0: Context3}
     """
 
     def __init__(self):
-        # prefix hash -> context id.
-        self._prefix_ctx_map: Dict[str, int] = {}
+        self._root = PrefixCacheNode(var_id=None, parent=None)
+
+        # engine_id -> context ids cached in the engine.
+        self._engine_context_ids: Dict[int, Set[int]] = {}
+
+        # Reversed dict for freeing context.
+        # context id -> nodes holding the context.
+        # NOTE: A context can be cached as multiple prefixes, e.g. when "fuse_fill"
+        # is enabled, several Fill nodes share one context.
+        self._context_nodes: Dict[int, List[PrefixCacheNode]] = {}
 
-        # reversed dict for freeing context.
-        self._prefix_ctx_map_reversed: Dict[int, str] = {}
+    def _prune(self, node: PrefixCacheNode) -> None:
+        # Remove empty nodes upward.
+        while not node.is_root and node.is_empty:
+            node.parent.children.pop(node.var_id)
+            node = node.parent
 
-    def get_cached_prefix_context(self, prefix_hash: str) -> int:
-        """Get the context id of a prefix from the cache.
+    def register_engine(self, engine_id: int) -> None:
+        """Register an engine in the cache."""
+
+        parrot_assert(
+            engine_id not in self._engine_context_ids, "Engine is already registered."
+        )
+        self._engine_context_ids[engine_id] = set()
+
+    def remove_engine(self, engine_id: int) -> None:
+        """Remove an engine and all its cached contexts from the cache."""
+
+        parrot_assert(
+            engine_id in self._engine_context_ids, "Engine is not registered."
+        )
+        for context_id in list(self._engine_context_ids[engine_id]):
+            self.remove_context_id(context_id)
+        self._engine_context_ids.pop(engine_id)
+
+    def get_cached_prefix_contexts(self, engine_id: int, var_ids: List[str]) -> List[int]:
+        """Get the contexts of the longest cached prefix of var_ids in an engine.
 
         Args:
-            prefix_hash: The hash of the prefix.
+            engine_id: The id of the engine.
+            var_ids: The var ids of the prefix.
 
         Returns:
-            The context id of the prefix. If the prefix is not in the cache, return NONE_CONTEXT_ID.
+            The context ids of the cached prefixes var_ids[:1], var_ids[:2], ..., in order.
+            Empty if no prefix is cached in the engine.
         """
 
-        return self._prefix_ctx_map.get(prefix_hash, NONE_CONTEXT_ID)
+        ret: List[int] = []
+        node = self._root
+        for var_id in var_ids:
+            node = node.children.get(var_id)
+            if node is None or engine_id not in node.engine_contexts:
+                break
+            ret.append(node.engine_contexts[engine_id])
+        return ret
 
-    def cache_prefix_context(self, prefix_hash: str, context_id: int) -> None:
-        """Cache contexts of the prefix.
+    def cache_prefix_contexts(
+        self, engine_id: int, var_ids: List[str], context_ids: List[int]
+    ) -> None:
+        """Cache contexts of the prefixes.
 
         Args:
-            prefix_hash: The hash of the prefix.
-            context_id: The context id of the prefix.
+            engine_id: The id of the engine.
+            var_ids: The var ids of the prefix.
+            context_ids: context_ids[i] is the context id of the prefix var_ids[:i+1].
+                Prefixes which are already cached should keep the same context id.
         """
 
         parrot_assert(
-            prefix_hash not in self._prefix_ctx_map, "Prefix should not be cached."
+            engine_id in self._engine_context_ids, "Engine is not registered."
+        )
+        parrot_assert(
+            len(context_ids) <= len(var_ids),
+            "The number of contexts should not exceed the length of the prefix.",
         )
-        self._prefix_ctx_map[prefix_hash] = context_id
-        self._prefix_ctx_map_reversed[context_id] = prefix_hash
+
+        node = self._root
+        for var_id, context_id in zip(var_ids, context_ids):
+            child = node.children.get(var_id)
+            if child is None:
+                child = PrefixCacheNode(var_id=var_id, parent=node)
+                node.children[var_id] = child
+            node = child
+
+            cached_context_id = node.engine_contexts.get(engine_id, NONE_CONTEXT_ID)
+            if cached_context_id != NONE_CONTEXT_ID:
+                parrot_assert(
+                    cached_context_id == context_id, "Prefix should not be cached."
+                )
+                continue
+
+            node.engine_contexts[engine_id] = context_id
+            self._engine_context_ids[engine_id].add(context_id)
+            if context_id not in self._context_nodes:
+                self._context_nodes[context_id] = []
+            self._context_nodes[context_id].append(node)
 
     def remove_context_id(self, context_id: int) -> None:
         """Remove the context id of a prefix."""
 
-        if context_id in self._prefix_ctx_map_reversed:
-            prefix_hash = self._prefix_ctx_map_reversed[context_id]
-            self._prefix_ctx_map.pop(prefix_hash)
-            self._prefix_ctx_map_reversed.pop(context_id)
+        if context_id not in self._context_nodes:
+            return
+
+        for node in self._context_nodes.pop(context_id):
+            for engine_id, node_context_id in list(node.engine_contexts.items()):
+                if node_context_id == context_id:
+                    node.engine_contexts.pop(engine_id)
+                    self._engine_context_ids[engine_id].discard(context_id)
+            self._prune(node)
+
+    def query_engines(self, var_ids: List[str]) -> Dict[int, int]:
+        """Query the engines holding prefixes of var_ids in a single walk.
+
+        Args:
+            var_ids: The var ids of the prefix.
+
+        Returns:
+            engine_id -> the number of cached prefixes (i.e. the length of the longest
+            cached prefix) in the engine. Engines without any cached prefix are omitted.
+        """
+
+        ret: Dict[int, int] = {}
+        node = self._root
+        alive_engines: Optional[Set[int]] = None
+
+        for var_id in var_ids:
+            node = node.children.get(var_id)
+            if node is None:
+                break
+
+            if alive_engines is None:
+                alive_engines = set(node.engine_contexts)
+            else:
+                alive_engines.intersection_update(node.engine_contexts)
+            if len(alive_engines) == 0:
+                break
+
+            for engine_id in alive_engines:
+                ret[engine_id] = ret.get(engine_id, 0) + 1
+
+        return ret
 
 
 class ServeCoreContextManager:
@@ -106,12 +238,16 @@ class ServeCoreContextManager:
 
         self._context_id_pool = RecyclePool("Context pool")
 
-        # engine_id -> PrefixCache
-        self.prefix_caches: Dict[int, PrefixCache] = {}
+        # Prefix cache shared by all engines.
+        self.prefix_cache = PrefixCache()
 
-    @staticmethod
-    def _hash_var_id(var_id: str) -> str:
-        return f"{_PREFIX_HASH_BRACKET_LEFT}{var_id}{_PREFIX_HASH_BRACKET_RIGHT}"
+        # engine_id -> contexts waiting to be freed in the engine.
+        # NOTE: Freeing is asynchronous. Contexts are removed from the Manager
+        # immediately, but they are freed in engines in batches (see flush_free_contexts).
+        # Their ids are recycled only after the engine frees them, so that a reused id
+        # never points to a stale context in the engine.
+        self._pending_free_contexts: Dict[int, List[Context]] = {}
+        self._pending_free_event: Event = Event()
 
     # ---------- Basic Context Operation ----------
 
@@ -159,29 +295,75 @@ class ServeCoreContextManager:
         if self._context_ref_counter[context_id] > 0:
             return
 
-        try:
-            engine = context.engine
-            resp = free_context(
-                http_addr=engine.http_address,
-                context_id=context_id,
-            )
-        except BaseException as e:
-            logger.error(
-                f"Context (context_id={context_id}) did not free correctly: {type(e)}, {e}."
-            )
-            raise ParrotCoreInternalError(e)
-        else:
-            logger.debug(
-                f"Context (context_id={context_id}) freed. Freed tokens: {resp.context_len}"
-            )
-
         # Remove context from the PrefixCache.
-        prefix_cache = self.prefix_caches[engine.engine_id]
-        prefix_cache.remove_context_id(context_id)
+        self.prefix_cache.remove_context_id(context_id)
 
         # Remove context from the Manager.
         self.contexts.pop(context_id)
-        self._context_id_pool.free(context_id)
+
+        # NOTE: A context in a dead (or bad) engine can't be freed there. We
+        # drop it without recycling its id, since the engine may come back with the
+        # stale context.
+        if not context.engine.is_running:
+            logger.debug(
+                f"Context (context_id={context_id}) dropped, since its engine "
+                f"(engine_id={context.engine.engine_id}) is not running."
+            )
+            return
+
+        self._queue_free_context(context)
+
+    def _queue_free_context(self, context: Context) -> None:
+        """Queue the context to be freed in the engine."""
+
+        engine_id = context.engine.engine_id
+        if engine_id not in self._pending_free_contexts:
+            self._pending_free_contexts[engine_id] = []
+        self._pending_free_contexts[engine_id].append(context)
+        self._pending_free_event.set()
+
+    async def _free_contexts_in_engine(
+        self,
+        contexts: List[Context],
+        client_session_pool: Optional[ClientSessionPool],
+    ) -> None:
+        engine = contexts[0].engine
+        context_ids = [context.context_id for context in contexts]
+
+        freed_context_lens = await afree_contexts(
+            http_addr=engine.http_address,
+            context_ids=context_ids,
+            retry_times=FREE_CONTEXTS_RETRY_TIMES,
+            retry_interval=FREE_CONTEXTS_RETRY_INTERVAL,
+            client_session=(
+                client_session_pool.get_session(engine.http_address)
+                if client_session_pool is not None
+                else None
+            ),
+        )
+
+        # NOTE: Only the ids of the freed contexts are recycled. The others may
+        # still be alive in the engine (e.g. still running), so they are queued again,
+        # unless the engine stops running meanwhile.
+        failed_contexts = []
+        for context in contexts:
+            if context.context_id in freed_context_lens:
+                self._context_id_pool.free(context.context_id)
+            else:
+                failed_contexts.append(context)
+                if engine.is_running:
+                    self._queue_free_context(context)
+
+        logger.debug(
+            f"Contexts (context_ids={list(freed_context_lens)}) freed in Engine "
+            f"(engine_id={engine.engine_id}). "
+            f"Freed tokens: {sum(freed_context_lens.values())}"
+        )
+        if len(failed_contexts) > 0:
+            logger.error(
+                f"Contexts (context_ids={[c.context_id for c in failed_contexts]}) did "
+                f"not free correctly in Engine (engine_id={engine.engine_id})."
+            )
 
     def _add_ref_counter(self, context: Context) -> None:
         context_id = context.context_id
@@ -191,6 +373,36 @@ class ServeCoreContextManager:
 
     # ---------- Memory Management Public Methods ----------
 
+    @property
+    def num_pending_free_contexts(self) -> int:
+        return sum(len(contexts) for contexts in self._pending_free_contexts.values())
+
+    async def wait_pending_free_contexts(self) -> None:
+        """Wait until there are contexts waiting to be freed in engines."""
+
+        await self._pending_free_event.wait()
+
+    async def flush_free_contexts(
+        self, client_session_pool: Optional[ClientSessionPool] = None
+    ) -> None:
+        """Free the queued contexts in engines, with one batched request per engine.
+
+        Args:
+            client_session_pool: The pooled ClientSessions of the engines (in
+                EngineManager). If not given, a temporary ClientSession is used.
+        """
+
+        pending_free_contexts = self._pending_free_contexts
+        self._pending_free_contexts = {}
+        self._pending_free_event.clear()
+
+        await asyncio.gather(
+            *[
+                self._free_contexts_in_engine(contexts, client_session_pool)
+                for contexts in pending_free_contexts.values()
+            ]
+        )
+
     def free_context(self, context: Context) -> None:
         """Free the context and return the number of freed tokens.
 
@@ -203,6 +415,24 @@ class ServeCoreContextManager:
         )
         self._free_context(context)
 
+    def fail_context(self, context: Context) -> None:
+        """Mark the context as failed, and wake up the tasks waiting for it.
+
+        The context is no longer cached as a prefix (nor held for its constant prefix),
+        so later tasks create a fresh context instead of reusing the failed one. It's
+        freed once the tasks holding it free their contexts.
+        """
+
+        context.failed = True
+        context.ready_event.set()
+
+        self.prefix_cache.remove_context_id(context.context_id)
+        for contexts in self.constant_prefix_contexts.values():
+            if context in contexts:
+                contexts.remove(context)
+                self._free_context(context)
+                break
+
     def set_task_contexts(self, task: CompletionTask) -> None:
         """Initialize the contexts for a CompletionTask.
 
@@ -217,24 +447,26 @@ class ServeCoreContextManager:
         )
 
         chain = task.chain
-        prefix_cache = self.prefix_caches[task.engine.engine_id]
-        prefix_hash = ""
-        prefix_no_cache_flag = False
-
-        for node in chain.iter():
-            prefix_hash += self._hash_var_id(node.var_id)
-
-            if not prefix_no_cache_flag:
-                # If the prefix is already cached, use cached context
-                context_id = prefix_cache.get_cached_prefix_context(prefix_hash)
-                if context_id != NONE_CONTEXT_ID:
-                    context = self.contexts[context_id]
-                    self._add_ref_counter(context)
-                    task.contexts.append(context)
-                    continue
-                else:
-                    # For succeeding nodes, the prefix couldn't be cached.
-                    prefix_no_cache_flag = True
+        engine_id = task.engine.engine_id
+        var_ids = [node.var_id for node in chain.iter()]
+
+        # If the prefix is already cached, use cached contexts.
+        cached_context_ids = self.prefix_cache.get_cached_prefix_contexts(
+            engine_id, var_ids
+        )
+        for context_id in cached_context_ids:
+            context = self.contexts[context_id]
+            self._add_ref_counter(context)
+            task.contexts.append(context)
+
+        # For succeeding nodes, the prefix couldn't be cached.
+        fill_var_ids: List[str] = []
+        for i, node in enumerate(chain.iter()):
+            if not node.is_gen:
+                fill_var_ids.append(node.var_id)
+
+            if i < len(cached_context_ids):
+                continue
 
             # The prefix is not cached. Create a new context and cache it.
             # If the node is the first node in the chain, create a new context.
@@ -260,9 +492,14 @@ class ServeCoreContextManager:
                     context = self._fork_context(task.contexts[-1])
 
             task.contexts.append(context)
-            # Cache the context, if it's the prefix.
-            if not node.is_gen:
-                prefix_cache.cache_prefix_context(prefix_hash, context.context_id)
+
+        # Cache the contexts of the prefixes (i.e. the Fill nodes).
+        # NOTE: The Gen node is always the last node in the chain.
+        self.prefix_cache.cache_prefix_contexts(
+            engine_id,
+            fill_var_ids,
+            [context.context_id for context in task.contexts[: len(fill_var_ids)]],
+        )
 
     def free_task_contexts(self, task: CompletionTask) -> None:
         """Free the contexts of a task."""
@@ -308,21 +545,9 @@ class ServeCoreContextManager:
         parrot_assert(not task.is_scheduled, "Task should not be scheduled.")
 
         # engine_id -> cached_prefix_num
-        sort_dict = {}
-
-        for engine_id, prefix_cache in self.prefix_caches.items():
-            prefix_hash = ""
-            for node in task.chain.iter():
-                prefix_hash += self._hash_var_id(node.var_id)
-                if (
-                    prefix_cache.get_cached_prefix_context(prefix_hash)
-                    != NONE_CONTEXT_ID
-                ):
-                    if engine_id not in sort_dict:
-                        sort_dict[engine_id] = 0
-                    sort_dict[engine_id] += 1
-                else:
-                    break
+        sort_dict = self.prefix_cache.query_engines(
+            [node.var_id for node in task.chain.iter()]
+        )
 
         return sorted(sort_dict, key=lambda x: sort_dict[x], reverse=True)
 
@@ -370,9 +595,9 @@ class ServeCoreContextManager:
     def register_engine_prefix_cache(self, engine_id: int):
         """Register the prefix cache of an engine."""
 
-        self.prefix_caches[engine_id] = PrefixCache()
+        self.prefix_cache.register_engine(engine_id)
 
     def remove_engine_prefix_cache(self, engine_id: int):
         """Remove the prefix cache of an engine."""
 
-        self.prefix_caches.pop(engine_id)
+        self.prefix_cache.remove_engine(engine_id)
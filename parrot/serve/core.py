@@ -7,7 +7,12 @@ from typing import Dict
 import asyncio
 
 from parrot.utils import get_logger
-from parrot.constants import CORE_LOOP_INTERVAL
+from parrot.constants import (
+    CORE_LOOP_INTERVAL,
+    CORE_SWEEP_INTERVAL,
+    CORE_EXPIRE_CONSTANT_PREFIX_INTERVAL,
+    CORE_FREE_CONTEXTS_INTERVAL,
+)
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 from parrot.engine.config import EngineConfig
 from parrot.exceptions import ParrotCoreInternalError
@@ -20,7 +25,7 @@ from parrot.serve.graph import (
 from parrot.serve.scheduler import GlobalScheduler, GlobalSchedulerConfig, TaskCreator
 
 from .config import ServeCoreConfig
-from .prefix_matcher import PrefixMatcher
+from .prefix_matcher import PrefixMatcher, PrefixMatcherConfig
 from .variable_manager import SemanticVariableManager
 from .tokenizer_wrapper import TokenizersWrapper
 from .context_manager import ServeCoreContextManager
@@ -53,14 +58,19 @@ class ParrotServeCore:
         # ---------- Config ----------
         gs_config = config.pop("global_scheduler")
         gs_config = GlobalSchedulerConfig(**gs_config)
+        pm_config = PrefixMatcherConfig(**config.pop("prefix_matcher", {}))
         self.config = ServeCoreConfig(**config)
 
         # ---------- Components ----------
-        self.prefix_matcher = PrefixMatcher()
+        self.prefix_matcher = PrefixMatcher(config=pm_config)
         self.var_mgr = SemanticVariableManager(
             constant_prefix_var_timeout=self.config.constant_prefix_var_timeout
         )
-        self.tokenizers_wrapper = TokenizersWrapper()
+        self.tokenizers_wrapper = TokenizersWrapper(
+            cache_budget=self.config.tokenization_cache_budget,
+            executor_type=self.config.tokenizer_executor,
+            num_workers=self.config.tokenizer_workers,
+        )
         self.context_mgr = ServeCoreContextManager()
         self.task_creator = TaskCreator()
 
@@ -85,6 +95,9 @@ class ParrotServeCore:
             engine_mgr=self.engine_mgr,
             context_mgr=self.context_mgr,
             tokenizers_wrapper=self.tokenizers_wrapper,
+            eager_tokenization=self.config.eager_tokenization,
+            task_max_retries=self.config.task_max_retries,
+            task_retry_timeout=self.config.task_retry_timeout,
         )
 
         logger.info(
@@ -109,6 +122,10 @@ class ParrotServeCore:
         logger.debug(f"Register engine received.")
         engine_config = EngineConfig(**payload["engine_config"])
         engine_id = self.engine_mgr.register_engine(engine_config)
+
+        # New capacity is available.
+        self.global_scheduler.wakeup()
+
         return {"engine_id": engine_id}
 
     def engine_heartbeat(self, payload: Dict) -> Dict:
@@ -127,7 +144,8 @@ class ParrotServeCore:
         logger.debug(f"Engine {engine_name} (id={engine_id}) heartbeat received.")
         engine_info = EngineRuntimeInfo(**payload["runtime_info"])
 
-        self.engine_mgr.engine_heartbeat(engine_id, engine_info)
+        if self.engine_mgr.engine_heartbeat(engine_id, engine_info):
+            self.global_scheduler.wakeup()
 
         return {}
 
@@ -139,13 +157,15 @@ class ParrotServeCore:
         """Register a new session in Serve Core.
 
         Args:
-            payload: Dict. The payload.
+            payload: Dict. The payload. "weight" (optional) is the weight of the session
+                in fair sharing.
 
         Returns:
             Dict. The response.
         """
 
-        session_id = self.session_mgr.register_session()
+        weight = payload.get("weight", 1.0)
+        session_id = self.session_mgr.register_session(weight=weight)
         return {"session_id": session_id, "session_auth": "1"}
 
     def remove_session(self, session_id: int, payload: Dict) -> Dict:
@@ -267,7 +287,16 @@ class ParrotServeCore:
         self.session_mgr.session_access_update(session_id)
 
         var = self.var_mgr.get_var(session_id, var_id)
-        var.set(content)
+        if self.config.eager_tokenization:
+            var.set(
+                content,
+                tokenizers_wrapper=self.tokenizers_wrapper,
+                tokenizer_names=self.engine_mgr.get_live_tokenizer_names_by_consumers(
+                    var
+                ),
+            )
+        else:
+            var.set(content)
 
         logger.debug(
             f"SV set (id={var_id}) from session (session_id={session_id}). "
@@ -309,28 +338,95 @@ class ParrotServeCore:
 
         return {"content": content}
 
+    async def shutdown(self) -> None:
+        """Release the resources held by the ServeCore."""
+
+        await self.engine_mgr.close_client_sessions()
+        self.tokenizers_wrapper.shutdown()
+        logger.info("Parrot ServeCore shut down.")
+
     # ---------- ServeCore Loop ----------
 
-    async def serve_loop(self) -> None:
-        """Start the Core serving loop."""
+    def _sweep_sessions_and_engines(self) -> None:
+        """Update and clean up sessions and engines."""
 
-        while True:
-            # Update and clean up sessions and engines
-            self.session_mgr.check_running_sessions()
-            self.session_mgr.sweep_not_running_sessions()
-            self.engine_mgr.update_expired_engines()
-            self.engine_mgr.sweep_not_running_engines()
+        self.session_mgr.check_running_sessions()
+        self.session_mgr.sweep_not_running_sessions()
+        self.engine_mgr.update_expired_engines()
+        self.engine_mgr.sweep_not_running_engines()
+
+    def _expire_constant_prefix_vars(self) -> None:
+        """Clean up expired constant prefix vars."""
 
-            # Clean up expired constant prefix vars
-            expired_vars = self.var_mgr.free_expired_constant_prefix_vars()
-            for var in expired_vars:
-                self.context_mgr.free_constant_prefix_contexts(var.id)
+        expired_vars = self.var_mgr.free_expired_constant_prefix_vars()
+        for var in expired_vars:
+            self.context_mgr.free_constant_prefix_contexts(var.id)
+
+    async def _polling_serve_loop(self) -> None:
+        while True:
+            self._sweep_sessions_and_engines()
+            self._expire_constant_prefix_vars()
 
             # Schedule tasks
             self.global_scheduler.schedule()
 
             await asyncio.sleep(CORE_LOOP_INTERVAL)
 
+    async def _schedule_loop(self) -> None:
+        while True:
+            await self.global_scheduler.wait_wakeup()
+            self.global_scheduler.schedule()
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            self._sweep_sessions_and_engines()
+
+            # NOTE: Not every capacity change comes with a wakeup (e.g. an engine
+            # expires). Retry the queued tasks in this coarse timer as a fallback.
+            if self.global_scheduler.num_queued_tasks > 0:
+                self.global_scheduler.wakeup()
+
+            await asyncio.sleep(CORE_SWEEP_INTERVAL)
+
+    async def _free_contexts_loop(self) -> None:
+        while True:
+            await self.context_mgr.wait_pending_free_contexts()
+            await self.context_mgr.flush_free_contexts(
+                self.engine_mgr.client_session_pool
+            )
+            await asyncio.sleep(CORE_FREE_CONTEXTS_INTERVAL)
+
+    async def _expire_loop(self) -> None:
+        while True:
+            self._expire_constant_prefix_vars()
+            await asyncio.sleep(CORE_EXPIRE_CONSTANT_PREFIX_INTERVAL)
+
+    async def serve_loop(self) -> None:
+        """Start the Core serving loop.
+
+        There are two modes:
+        - Polling: Sweep and schedule every CORE_LOOP_INTERVAL.
+        - Event-driven: Schedule only when the GlobalScheduler is woken up. Sweeping and
+            constant prefix expiring are done in their own coarse timers.
+
+        In both modes, freed contexts are sent to engines in batches every
+        CORE_FREE_CONTEXTS_INTERVAL.
+        """
+
+        if not self.config.event_driven_loop:
+            await asyncio.gather(
+                self._polling_serve_loop(),
+                self._free_contexts_loop(),
+            )
+            return
+
+        await asyncio.gather(
+            self._schedule_loop(),
+            self._free_contexts_loop(),
+            self._sweep_loop(),
+            self._expire_loop(),
+        )
+
 
 def create_serve_core(
     core_config_path: str,
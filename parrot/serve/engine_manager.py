@@ -2,20 +2,29 @@
 # Licensed under the MIT license.
 
 
+from bisect import bisect_left, insort
 from typing import Dict, List, Optional, Tuple
 
+import aiohttp
+
 from parrot.exceptions import ParrotCoreUserError, parrot_assert
 from parrot.utils import RecyclePool, get_logger, time_counter_in_nanoseconds
 from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 from parrot.engine.config import EngineConfig
 from parrot.protocol.internal.layer_apis import ping_engine
+from parrot.protocol.client_session_pool import ClientSessionPool
+from parrot.constants import (
+    ENGINE_CLIENT_CONNECTIONS_LIMIT,
+    ENGINE_CLIENT_KEEPALIVE_TIMEOUT,
+)
 
 from parrot.serve.backend_repr import (
     ExecutionEngine,
     LanguageModel,
-    EngineStatus,
     ModelType,
 )
+from parrot.serve.backend_repr.model import get_model_type
+from parrot.serve.graph import SemanticVariable
 
 from .tokenizer_wrapper import TokenizersWrapper
 from .context_manager import ServeCoreContextManager
@@ -49,6 +58,36 @@ class EngineManager:
         self._models_ref_counter: Dict[str, int] = {}
         self._engine_id_pool = RecyclePool()
 
+        # ---------- Live Engine Indexes ----------
+        # NOTE: Only running engines are indexed. Engines in a bucket are kept
+        # in registration order, which is the same as the iteration order of
+        # self.engines.
+
+        # engine_id -> registration sequence number
+        self._engine_register_seq: Dict[int, int] = {}
+        self._register_counter = 0
+
+        # model_type -> {engine_id -> engine}
+        self._live_engines_by_type: Dict[ModelType, Dict[int, ExecutionEngine]] = {}
+        # (model_type, model_name) -> {engine_id -> engine}
+        self._live_engines_by_model: Dict[
+            Tuple[ModelType, str], Dict[int, ExecutionEngine]
+        ] = {}
+        # tokenizer_name -> {engine_id -> engine}
+        self._live_engines_by_tokenizer: Dict[str, Dict[int, ExecutionEngine]] = {}
+
+        # tokenizer_name -> sorted list of (remain_tokens_capacity, seq, engine_id)
+        # So "engines that can fit N tokens" is a range query.
+        self._tokens_capacity_index: Dict[str, List[Tuple[int, int, int]]] = {}
+        # engine_id -> its current key in _tokens_capacity_index
+        self._tokens_capacity_keys: Dict[int, Tuple[int, int, int]] = {}
+
+        # Pooled HTTP connections to engines, keyed by engine http address.
+        self.client_session_pool = ClientSessionPool(
+            limit_per_host=ENGINE_CLIENT_CONNECTIONS_LIMIT,
+            keepalive_timeout=ENGINE_CLIENT_KEEPALIVE_TIMEOUT,
+        )
+
         # ---------- Global Components ----------
         self.context_mgr = context_mgr
         self.tokenizers_wrapper = tokenizers_wrapper
@@ -79,8 +118,83 @@ class EngineManager:
 
             logger.debug(f"Model {model_name} removed.")
 
+    def _is_indexed(self, engine: ExecutionEngine) -> bool:
+        return engine.engine_id in self._live_engines_by_type.get(engine.model_type, {})
+
+    def _index_engine(self, engine: ExecutionEngine) -> None:
+        engine_id = engine.engine_id
+        self._live_engines_by_type.setdefault(engine.model_type, {})[engine_id] = engine
+        self._live_engines_by_model.setdefault(
+            (engine.model_type, engine.model_name), {}
+        )[engine_id] = engine
+
+        if engine.requires_token_ids:
+            self._live_engines_by_tokenizer.setdefault(engine.tokenizer_name, {})[
+                engine_id
+            ] = engine
+            self._index_tokens_capacity(engine)
+
+    def _index_tokens_capacity(self, engine: ExecutionEngine) -> None:
+        key = (
+            engine.get_remain_tokens_capacity(),
+            self._engine_register_seq[engine.engine_id],
+            engine.engine_id,
+        )
+        insort(self._tokens_capacity_index.setdefault(engine.tokenizer_name, []), key)
+        self._tokens_capacity_keys[engine.engine_id] = key
+
+    def _unindex_tokens_capacity(self, engine: ExecutionEngine) -> None:
+        key = self._tokens_capacity_keys.pop(engine.engine_id)
+        capacity_index = self._tokens_capacity_index[engine.tokenizer_name]
+        del capacity_index[bisect_left(capacity_index, key)]
+        if len(capacity_index) == 0:
+            self._tokens_capacity_index.pop(engine.tokenizer_name)
+
+    def _unindex_engine(self, engine: ExecutionEngine) -> None:
+        def _pop_from_bucket(buckets: Dict, bucket_key, engine_id: int) -> None:
+            bucket = buckets[bucket_key]
+            bucket.pop(engine_id)
+            if len(bucket) == 0:
+                buckets.pop(bucket_key)
+
+        engine_id = engine.engine_id
+        _pop_from_bucket(self._live_engines_by_type, engine.model_type, engine_id)
+        _pop_from_bucket(
+            self._live_engines_by_model,
+            (engine.model_type, engine.model_name),
+            engine_id,
+        )
+
+        if engine.requires_token_ids:
+            _pop_from_bucket(
+                self._live_engines_by_tokenizer, engine.tokenizer_name, engine_id
+            )
+            self._unindex_tokens_capacity(engine)
+
+    def _on_engine_changed(self, engine: ExecutionEngine) -> None:
+        """Keep the indexes consistent with the status/capacity of the engine."""
+
+        if engine.engine_id not in self.engines:
+            return
+
+        indexed = self._is_indexed(engine)
+        if not engine.is_running:
+            if indexed:
+                self._unindex_engine(engine)
+        elif not indexed:
+            self._index_engine(engine)
+        elif engine.requires_token_ids:
+            key = self._tokens_capacity_keys[engine.engine_id]
+            if key[0] != engine.get_remain_tokens_capacity():
+                self._unindex_tokens_capacity(engine)
+                self._index_tokens_capacity(engine)
+
     def _remove_engine(self, engine_id: int) -> None:
         engine = self.engines.pop(engine_id)
+        engine.set_change_listener(None)
+        if self._is_indexed(engine):
+            self._unindex_engine(engine)
+        self._engine_register_seq.pop(engine_id)
 
         self._remove_model(engine.model_name)
 
@@ -89,6 +203,13 @@ class EngineManager:
 
         self.context_mgr.remove_engine_prefix_cache(engine_id)
 
+        # Close the connections if no other engine is served at the same address.
+        if all(
+            other.http_address != engine.http_address
+            for other in self.engines.values()
+        ):
+            self.client_session_pool.remove_session(engine.http_address)
+
         logger.debug(f"Engine {engine.name} (id={engine_id}) is removed.")
 
     # ---------- Methods for Executor ----------
@@ -102,7 +223,24 @@ class EngineManager:
         """
 
         engine = self.engines[engine_id]
-        engine.mark_bad(exception)
+        engine.mark_bad(exception)  # Unindexed by the change listener.
+
+    def get_client_session(self, engine: ExecutionEngine) -> aiohttp.ClientSession:
+        """Get the pooled ClientSession for sending requests to the engine.
+
+        Args:
+            engine: ExecutionEngine. The engine.
+
+        Returns:
+            aiohttp.ClientSession: The ClientSession.
+        """
+
+        return self.client_session_pool.get_session(engine.http_address)
+
+    async def close_client_sessions(self) -> None:
+        """Close all pooled ClientSessions. Called when the ServeCore shuts down."""
+
+        await self.client_session_pool.close_all()
 
     # ---------- Methods for Global Scheduler ----------
 
@@ -111,6 +249,86 @@ class EngineManager:
 
         return [engine for engine in self.engines.values() if engine.is_running]
 
+    def get_live_engines_by_model(
+        self, model_type: ModelType, model_names: Optional[List[str]] = None
+    ) -> List[ExecutionEngine]:
+        """Get live engines of a model type, served with one of the models.
+
+        Args:
+            model_type: ModelType. The model type.
+            model_names: Optional[List[str]]. The model names. None or empty means any
+                model.
+
+        Returns:
+            List[ExecutionEngine]: The engines, in registration order.
+        """
+
+        if not model_names:
+            return list(self._live_engines_by_type.get(model_type, {}).values())
+
+        engines = []
+        for model_name in dict.fromkeys(model_names):
+            engines.extend(
+                self._live_engines_by_model.get((model_type, model_name), {}).values()
+            )
+        if len(model_names) > 1:
+            engines.sort(key=lambda engine: self._engine_register_seq[engine.engine_id])
+        return engines
+
+    def get_live_tokenizer_names_by_model(
+        self, model_type: ModelType, model_names: Optional[List[str]] = None
+    ) -> List[str]:
+        """Get the tokenizers used by live engines of a model type, served with one of
+        the models. Text engines have no tokenizers."""
+
+        if model_type != ModelType.TOKEN_ID:
+            return []
+        return list(
+            dict.fromkeys(
+                engine.tokenizer_name
+                for engine in self.get_live_engines_by_model(model_type, model_names)
+            )
+        )
+
+    def get_live_tokenizer_names_by_consumers(self, sv: SemanticVariable) -> List[str]:
+        """Get the tokenizers used by live engines which may serve the consumers of the
+        SV. Empty if the SV has no consumers yet."""
+
+        tokenizer_names: Dict[str, None] = {}
+        for consumer in sv.get_consumers():
+            if not consumer.comp_chain_is_set:
+                continue
+            metadata = consumer.comp_chain.metadata
+            for tokenizer_name in self.get_live_tokenizer_names_by_model(
+                get_model_type(metadata.model_type), metadata.models
+            ):
+                tokenizer_names[tokenizer_name] = None
+        return list(tokenizer_names)
+
+    def get_live_engines_by_tokenizer(
+        self, tokenizer_name: str
+    ) -> List[ExecutionEngine]:
+        """Get live engines using the tokenizer, in registration order."""
+
+        return list(self._live_engines_by_tokenizer.get(tokenizer_name, {}).values())
+
+    def get_live_engines_by_tokens_capacity(
+        self, tokenizer_name: str, tokens_num: int
+    ) -> List[ExecutionEngine]:
+        """Get live engines using the tokenizer, whose remaining tokens capacity can fit
+        tokens_num tokens.
+
+        Returns:
+            List[ExecutionEngine]: The engines, in ascending order of the remaining
+                tokens capacity.
+        """
+
+        capacity_index = self._tokens_capacity_index.get(tokenizer_name, [])
+        start = bisect_left(capacity_index, (tokens_num,))
+        return [
+            self.engines[engine_id] for _, _, engine_id in capacity_index[start:]
+        ]
+
     # ---------- Methods for Core ----------
 
     def register_engine(self, engine_config: EngineConfig) -> int:
@@ -134,6 +352,12 @@ class EngineManager:
         self.engines[engine_id] = engine
         self._engine_last_seen_time[engine_id] = time_counter_in_nanoseconds()
 
+        # Index the engine
+        self._engine_register_seq[engine_id] = self._register_counter
+        self._register_counter += 1
+        self._index_engine(engine)
+        engine.set_change_listener(self._on_engine_changed)
+
         # Register engine prefix cache
         self.context_mgr.register_engine_prefix_cache(engine_id=engine_id)
 
@@ -142,20 +366,25 @@ class EngineManager:
 
     def engine_heartbeat(
         self, engine_id: int, engine_runtime_info: EngineRuntimeInfo
-    ) -> None:
+    ) -> bool:
         """Update the last seen time of the engine.
 
         Args:
             engine_id: int. The engine ID.
+
+        Returns:
+            bool: Whether the runtime info of the engine is changed by this heartbeat.
         """
 
         if engine_id not in self.engines:
             raise ParrotCoreUserError(f"Engine {engine_id} not found.")
 
         engine = self.engines[engine_id]
-        engine.update_realtime_runtime_info(engine_runtime_info)
+        changed = engine.update_realtime_runtime_info(engine_runtime_info)
 
         self._engine_last_seen_time[engine_id] = time_counter_in_nanoseconds()
+        self._on_engine_changed(engine)
+        return changed
 
     def get_engine(self, engine_id: int) -> ExecutionEngine:
         """Get the ExecutionEngine by engine ID.
@@ -180,7 +409,7 @@ class EngineManager:
                 current_time - last_seen_time
                 > self.engine_heartbeat_timeout * 1_000_000_000
             ):
-                engine.status = EngineStatus.DEAD
+                engine.mark_dead()  # Unindexed by the change listener.
                 logger.debug(f"Engine {engine_id} is expired.")
 
     def sweep_not_running_engines(self) -> None:
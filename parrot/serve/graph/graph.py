@@ -3,7 +3,7 @@
 
 
 from asyncio import Event
-from typing import List, Dict, Set, Optional, Union
+from typing import Callable, List, Dict, Set, Optional, Union
 
 from parrot.exceptions import parrot_assert, ParrotCoreUserError
 from parrot.utils import RecyclePool
@@ -99,6 +99,31 @@ class CompletionChain:
         # Groups this chain belongs to.
         self.chain_groups: List[CompChainGroup] = []
 
+        # ---------- Critical Path ----------
+        # Chains whose outputs this chain consumes, and chains consuming the output of this
+        # chain. Only linked for activated chains.
+        self.producer_chains: List["CompletionChain"] = []
+        self.consumer_chains: List["CompletionChain"] = []
+        # Estimated work (prefill + decode tokens) along the longest path from this chain
+        # (included) to the "get" node. Maintained by graph_traverse.
+        self.remaining_work: float = 0.0
+        self.is_finished: bool = False
+        # Called when the remaining work changes, so the queue key of the task of the
+        # chain (in GlobalScheduler) can be updated.
+        self._remaining_work_listener: Optional[
+            Callable[["CompletionChain"], None]
+        ] = None
+
+    def set_remaining_work_listener(
+        self, listener: Optional[Callable[["CompletionChain"], None]]
+    ) -> None:
+        self._remaining_work_listener = listener
+
+    def set_remaining_work(self, remaining_work: float) -> None:
+        self.remaining_work = remaining_work
+        if self._remaining_work_listener is not None:
+            self._remaining_work_listener(self)
+
     @property
     def request_id(self) -> int:
         return self._request_chain.request_id
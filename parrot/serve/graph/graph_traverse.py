@@ -20,14 +20,73 @@ The algorithm works as follows:
 2. Then it traverses backward to its predecessors, activates them and propagates the performance
     deduction result recursively.
 3. Then algorithm ends when it reaches the end of the graph or an activated node.
+
+It also maintains the remaining critical-path work of activated chains, i.e. the estimated
+work (prefill + decode tokens) along the longest path from the chain to the "get" node. It's
+updated when an activated chain gets a new consumer and when a chain finishes.
 """
 
 
+# Rough number of characters per token, for estimating the work before tokenization.
+_CHARS_PER_TOKEN = 4
+
+
+def _estimate_chain_work(chain: CompletionChain) -> float:
+    """Estimated prefill + decode tokens of a chain.
+
+    Ready inputs are estimated by their contents. Inputs still being generated are
+    estimated by the max_gen_length of their producers.
+    """
+
+    work = 0.0
+    for node in chain.iter_fill():
+        if node.sv.is_ready():
+            work += len(node.sv.get()) / _CHARS_PER_TOKEN
+        elif node.sv.has_producer:
+            work += node.sv.get_producer().sampling_config.max_gen_length
+    if chain.gen_node is not None:
+        work += chain.gen_node.sampling_config.max_gen_length
+    return work
+
+
+def _update_remaining_work(chain: CompletionChain) -> None:
+    """Recompute the remaining work of a chain, and propagate the change to its
+    producers."""
+
+    downstream_work = 0.0
+    for consumer in chain.consumer_chains:
+        if not consumer.is_finished:
+            downstream_work = max(downstream_work, consumer.remaining_work)
+    remaining_work = _estimate_chain_work(chain) + downstream_work
+
+    if remaining_work == chain.remaining_work:
+        return
+
+    chain.set_remaining_work(remaining_work)
+    for producer in chain.producer_chains:
+        if not producer.is_finished:
+            _update_remaining_work(producer)
+
+
+def _link_chains(producer: CompletionChain, consumer: CompletionChain) -> None:
+    if consumer not in producer.consumer_chains:
+        producer.consumer_chains.append(consumer)
+    if producer not in consumer.producer_chains:
+        consumer.producer_chains.append(producer)
+
+
 def _back_propagate_criteria(criteria: PerformanceCriteria) -> PerformanceCriteria:
     if criteria == PerformanceCriteria.LATENCY:
         return PerformanceCriteria.LATENCY
     elif criteria == PerformanceCriteria.THROUGHPUT:
         return PerformanceCriteria.THROUGHPUT
+    elif criteria == PerformanceCriteria.TTFT:
+        # The first token can't be generated until all predecessors finish. So the whole
+        # predecessors are on the critical path of TTFT.
+        return PerformanceCriteria.LATENCY
+    elif criteria == PerformanceCriteria.TPOT:
+        # The pace of output tokens only depends on the last chain.
+        return PerformanceCriteria.THROUGHPUT
     else:
         raise NotImplementedError(f"PerformanceCriteria {criteria} is not supported.")
 
@@ -37,8 +96,14 @@ def _traverse(
     criteria: PerformanceCriteria,
 ) -> None:
     if chain.is_activated:
+        # The chain may be reached by a new consumer, through a longer path.
+        _update_remaining_work(chain)
         return
 
+    # NOTE: Consumers are traversed before their producers, so the remaining work
+    # of the consumers is already known.
+    _update_remaining_work(chain)
+
     # Propagate the performance criteria.
     next_criteria = _back_propagate_criteria(criteria)
     # Grouping chains.
@@ -52,6 +117,7 @@ def _traverse(
             next_chain: CompletionChain = producer.comp_chain
             next_chain.chain_groups.append(chain_group)
             chain_group.chains.add(next_chain)
+            _link_chains(next_chain, chain)
             _traverse(next_chain, next_criteria)
             next_chains.append(next_chain)
 
@@ -59,6 +125,7 @@ def _traverse(
         prev_gen = chain.first_node.get_edge_a_prev_node()
         parrot_assert(prev_gen.is_gen, "The previous node is not a Gen node.")
         next_chain = prev_gen.comp_chain
+        _link_chains(next_chain, chain)
         _traverse(next_chain, next_criteria)
         next_chains.append(next_chain)
 
@@ -83,3 +150,21 @@ def activate_completion_chain(
     parrot_assert(not chain.is_activated, "Chain is already activated.")
 
     _traverse(chain=chain, criteria=criteria)
+
+
+def finish_completion_chain(chain: CompletionChain) -> None:
+    """Mark the CompletionChain as finished and update the remaining critical-path work.
+
+    The outputs of the chain are ready now, so the work of its consumers is re-estimated by
+    the actual contents. The change propagates to the other (unfinished) producers of the
+    consumers.
+
+    Args:
+        chain: The finished CompletionChain.
+    """
+
+    chain.is_finished = True
+    chain.set_remaining_work(0.0)
+    for consumer in chain.consumer_chains:
+        if not consumer.is_finished:
+            _update_remaining_work(consumer)
@@ -89,6 +89,7 @@ class SemanticCallMetadata:
         "cache_prefix",
         "output_criteria",
         "fuse_fill",
+        "prefix_match",
     ]
 
     models: List[str]
@@ -97,6 +98,7 @@ class SemanticCallMetadata:
     cache_prefix: bool
     output_criteria: Optional[Union[PerformanceCriteria, str]]
     fuse_fill: bool
+    prefix_match: bool
 
     @classmethod
     def get_default_dict(cls) -> Dict:
@@ -109,6 +111,7 @@ class SemanticCallMetadata:
             "cache_prefix": True,
             "output_criteria": None,
             "fuse_fill": False,
+            "prefix_match": True,
         }
 
     @classmethod
@@ -192,9 +195,8 @@ class ChunkedSemanticCallRequest:
         processed_payload = payload.copy()
 
         # Assign default values.
-        processed_payload.setdefault("models", [])
-        processed_payload.setdefault("model_type", "token_id")
-        processed_payload.setdefault("remove_pure_fill", True)
+        for key, value in SemanticCallMetadata.get_default_dict().items():
+            processed_payload.setdefault(key, value)
 
         return processed_payload
 
@@ -1,10 +1,15 @@
 # Copyright (c) 2023 by Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import List, Optional
+from typing import Dict, List, Optional
 from asyncio import Event
+import asyncio
 
 from parrot.exceptions import parrot_assert
+from parrot.utils import get_logger, create_task_in_loop
+
+
+logger = get_logger("SemanticVariable")
 
 
 # ---------- SemanticVariable ----------
@@ -50,6 +55,12 @@ class SemanticVariable:
         # Text content.
         self._content: Optional[str] = None
 
+        # Tokenized content. Map from tokenizer name to token ids.
+        # It's filled in the background when the SV is set (See `set`).
+        self._token_ids: Dict[str, List[int]] = {}
+        self._tokenize_task: Optional[asyncio.Task] = None
+        self._tokenizing_names: List[str] = []
+
         # Events
         self._ready_event: Event = Event()  # Ready event means the content is ready.
 
@@ -62,13 +73,82 @@ class SemanticVariable:
     def is_ready(self) -> bool:
         return self._ready_event.is_set()
 
-    def set(self, content: str) -> None:
-        """Set the content of the semantic variable."""
+    def set(
+        self,
+        content: str,
+        tokenizers_wrapper: Optional["TokenizersWrapper"] = None,
+        tokenizer_names: Optional[List[str]] = None,
+    ) -> None:
+        """Set the content of the semantic variable.
+
+        Args:
+            content: str. The content.
+            tokenizers_wrapper: Optional[TokenizersWrapper]. If given, the content is
+                tokenized in the background, so the consumers don't tokenize it in their
+                critical path.
+            tokenizer_names: Optional[List[str]]. The tokenizers used in the background
+                tokenization, e.g. the tokenizers of the engines which may serve the
+                consumers. None or empty means no background tokenization.
+        """
 
         assert self._content is None, f"This semantic variable (id={self.id}) is filled"
         self._content = content
         self._ready_event.set()
 
+        if tokenizers_wrapper is not None and tokenizer_names:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # Not in the event loop. The consumers will tokenize it lazily.
+                return
+            self._tokenizing_names = list(tokenizer_names)
+            self._tokenize_task = create_task_in_loop(
+                self._eager_tokenize(tokenizers_wrapper, content), fail_fast=False
+            )
+
+    async def _eager_tokenize(
+        self, tokenizers_wrapper: "TokenizersWrapper", content: str
+    ) -> None:
+        # NOTE: Tokenized through atokenize, which registers the in-flight tokenizations
+        # in the wrapper. Consumers tokenizing the same SV concurrently reuse them.
+        results = await asyncio.gather(
+            *[
+                tokenizers_wrapper.atokenize(content, tokenizer_name, cache_key=self.id)
+                for tokenizer_name in self._tokenizing_names
+            ],
+            return_exceptions=True,
+        )
+        for tokenizer_name, result in zip(self._tokenizing_names, results):
+            if isinstance(result, Exception):
+                # Not fatal. The consumers will tokenize it again.
+                logger.warning(
+                    f"Eager tokenization of SV (id={self.id}) with tokenizer "
+                    f"{tokenizer_name} failed: {result}"
+                )
+            else:
+                self._token_ids[tokenizer_name] = result
+
+    def get_token_ids(self, tokenizer_name: str) -> Optional[List[int]]:
+        """Get the token ids of the content, if it's already tokenized by the tokenizer.
+
+        NOTE: The list is shared. Don't modify it.
+        """
+
+        return self._token_ids.get(tokenizer_name)
+
+    async def wait_tokenized(self, tokenizer_name: Optional[str] = None) -> None:
+        """Wait until the background tokenization (if any) is done.
+
+        Args:
+            tokenizer_name: Optional[str]. If given, only wait if the background
+                tokenization uses this tokenizer.
+        """
+
+        if tokenizer_name is not None and tokenizer_name not in self._tokenizing_names:
+            return
+        if self._tokenize_task is not None and not self._tokenize_task.done():
+            await asyncio.shield(self._tokenize_task)
+
     def get(self) -> str:
         """Get the content of the semantic variable."""
 
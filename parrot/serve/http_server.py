@@ -182,6 +182,7 @@ def start_server(
     # For real deployment, maybe we don't need to quit the backend when there is an error
     create_task_in_loop(pcore.serve_loop(), loop=loop, fail_fast=True)
     loop.run_until_complete(uvicorn_server.serve())
+    loop.run_until_complete(pcore.shutdown())
 
 
 if __name__ == "__main__":
@@ -1,26 +1,163 @@
 # Copyright (c) 2023 by Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import Dict
+import heapq
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from parrot.exceptions import parrot_assert
+from parrot.utils import time_counter_in_nanoseconds
+
+
+@dataclass
+class PrefixMatcherConfig:
+    # Estimated memory budget of the trie, in bytes.
+    memory_budget: int = 64 * 1024 * 1024
+    # Which entries to evict when the budget is exceeded. "lru" or "lfu".
+    eviction_policy: str = "lru"
+    # Half life (in seconds) of the hit counters. Non-positive means no decay.
+    decay_half_life: float = 600.0
+
+    def __post_init__(self):
+        parrot_assert(
+            self.eviction_policy in ["lru", "lfu"],
+            f"Unknown eviction policy: {self.eviction_policy}",
+        )
+
+
+class _TrieNode:
+    """A node in the compressed trie. The edge from its parent is labeled by `label`."""
+
+    __slots__ = ["label", "parent", "children", "hits", "last_access_time"]
+
+    def __init__(self, label: str, parent: Optional["_TrieNode"]):
+        self.label = label
+        self.parent = parent
+
+        # First character of the child's label -> child
+        self.children: Dict[str, "_TrieNode"] = {}
+
+        # Number of added strings passing through this edge (decayed), as of last_access_time.
+        self.hits: float = 0.0
+        self.last_access_time: int = 0
 
 
 class PrefixMatcher:
     """Prefix matcher uses a heuristic algorithm to find the most common prefix among a set of strings.
 
-    If there is a common prefix part between them, we will add the count of the common part.
-    If the count reaches a certain threshold, we will consider it as a GlobalPrefix.
+    All added strings are stored in a compressed character trie. Each edge records how many added
+    strings pass through it (its hit counter). If the counter of a prefix reaches a certain threshold,
+    we will consider it as a GlobalPrefix.
+
+    Hit counters decay exponentially over time, and the trie is kept under a memory budget by evicting
+    leaves in LRU/LFU order. Both adding and querying walk the trie once, so the cost is proportional
+    to the length of the string, not the number of stored strings.
     """
 
     _START_LEN = 40
     _GP_THRESHOLD = 3
 
-    def __init__(self):
-        # NOTE(chaofan): This table is two-level.
-        # The first level is the first _START_LEN characters of the prefix, to speed up the lookup.
-        # The second level is a list of prefix strings.
-        # TODO(chaofan): Advanced evict policy.
-
-        self._prefix_counter: Dict[str, Dict[str, int]] = {}
+    # Estimated memory overhead of a node (object, slots and dict entries), in bytes.
+    _NODE_OVERHEAD = 256
+    # When evicting, we evict down to this ratio of the budget to amortize the eviction cost.
+    _EVICT_WATERMARK = 0.9
+
+    def __init__(self, config: PrefixMatcherConfig = PrefixMatcherConfig()):
+        self.config = config
+
+        self._root = _TrieNode(label="", parent=None)
+        self._nodes_num = 0
+        self._memory_usage = 0
+
+        # Statistics
+        self.evicted_nodes_num = 0
+
+    # ---------- Internal methods ----------
+
+    def _decayed_hits(self, node: _TrieNode, now: int) -> float:
+        if self.config.decay_half_life <= 0:
+            return node.hits
+        elapsed = (now - node.last_access_time) / 1e9
+        return node.hits * 0.5 ** (elapsed / self.config.decay_half_life)
+
+    def _touch(self, node: _TrieNode, now: int) -> None:
+        node.hits = self._decayed_hits(node, now) + 1
+        node.last_access_time = now
+
+    def _new_node(self, label: str, parent: _TrieNode) -> _TrieNode:
+        node = _TrieNode(label=label, parent=parent)
+        parent.children[label[0]] = node
+        self._nodes_num += 1
+        self._memory_usage += len(label) + self._NODE_OVERHEAD
+        return node
+
+    def _split(self, node: _TrieNode, pos: int) -> _TrieNode:
+        """Split the edge of node at pos. Returns the new middle node."""
+
+        parent = node.parent
+        mid = _TrieNode(label=node.label[:pos], parent=parent)
+        mid.hits = node.hits
+        mid.last_access_time = node.last_access_time
+        parent.children[mid.label[0]] = mid
+
+        node.label = node.label[pos:]
+        node.parent = mid
+        mid.children[node.label[0]] = node
+
+        self._nodes_num += 1
+        self._memory_usage += self._NODE_OVERHEAD
+        return mid
+
+    def _remove_leaf(self, node: _TrieNode) -> None:
+        node.parent.children.pop(node.label[0])
+        self._nodes_num -= 1
+        self._memory_usage -= len(node.label) + self._NODE_OVERHEAD
+        self.evicted_nodes_num += 1
+
+    def _eviction_key(self, node: _TrieNode, now: int) -> Tuple:
+        if self.config.eviction_policy == "lru":
+            return (node.last_access_time,)
+        return (self._decayed_hits(node, now), node.last_access_time)
+
+    def _evict(self, now: int) -> None:
+        target = self.config.memory_budget * self._EVICT_WATERMARK
+
+        leaves: List[Tuple] = []
+        stack = list(self._root.children.values())
+        while len(stack) > 0:
+            node = stack.pop()
+            if len(node.children) == 0:
+                leaves.append((self._eviction_key(node, now), id(node), node))
+            else:
+                stack.extend(node.children.values())
+        heapq.heapify(leaves)
+
+        while self._memory_usage > target and len(leaves) > 0:
+            _, _, node = heapq.heappop(leaves)
+            parent = node.parent
+            self._remove_leaf(node)
+            if parent is not self._root and len(parent.children) == 0:
+                heapq.heappush(
+                    leaves, (self._eviction_key(parent, now), id(parent), parent)
+                )
+
+    @staticmethod
+    def _common_len(label: str, s: str, start: int) -> int:
+        i = 0
+        max_len = min(len(label), len(s) - start)
+        while i < max_len and label[i] == s[start + i]:
+            i += 1
+        return i
+
+    # ---------- Public methods ----------
+
+    @property
+    def nodes_num(self) -> int:
+        return self._nodes_num
+
+    @property
+    def memory_usage(self) -> int:
+        return self._memory_usage
 
     def add_prefix(self, prefix: str) -> None:
         """Add a prefix to the global prefix cache.
@@ -33,35 +170,29 @@ class PrefixMatcher:
         if len(prefix) <= self._START_LEN:
             return
 
-        lookup = prefix[: self._START_LEN]
-        if lookup not in self._prefix_counter:
-            self._prefix_counter[lookup] = {}
+        now = time_counter_in_nanoseconds()
+        node = self._root
+        i = 0
 
-        prefixes = list(self._prefix_counter[lookup].keys())
+        while i < len(prefix):
+            child = node.children.get(prefix[i])
+            if child is None:
+                # Add to table
+                child = self._new_node(label=prefix[i:], parent=node)
+                self._touch(child, now)
+                break
 
-        for k in prefixes:
-            # Matched
-            if k[self._START_LEN] == prefix[self._START_LEN]:
-                # Reduce to common prefix
-                i = self._START_LEN
-                while i < len(k) and i < len(prefix) and k[i] == prefix[i]:
-                    i += 1
+            matched_len = self._common_len(child.label, prefix, i)
+            if matched_len < len(child.label):
+                # Common prefix changes
+                child = self._split(child, matched_len)
 
-                new_k = k[:i]
+            self._touch(child, now)
+            i += matched_len
+            node = child
 
-                if i == len(k):
-                    # Common prefix is the same
-                    self._prefix_counter[lookup][k] += 1
-                else:
-                    # Common prefix changes
-                    self._prefix_counter[lookup][new_k] = (
-                        self._prefix_counter[lookup][k] + 1
-                    )
-                    self._prefix_counter[lookup].pop(k)
-                return
-
-        # Add to table
-        self._prefix_counter[lookup][prefix] = 1
+        if self._memory_usage > self.config.memory_budget:
+            self._evict(now)
 
     def query_prefix(self, prefix: str) -> int:
         """Query whether the prefix is a global prefix.
@@ -77,13 +208,27 @@ class PrefixMatcher:
         if len(prefix) <= self._START_LEN:
             return -1
 
-        lookup = prefix[: self._START_LEN]
+        now = time_counter_in_nanoseconds()
+        node = self._root
+        i = 0
+        ret = -1
 
-        if lookup not in self._prefix_counter:
-            return -1
+        while i < len(prefix):
+            child = node.children.get(prefix[i])
+            if child is None:
+                break
+
+            # NOTE: Hits are non-increasing along a path, so we can stop early.
+            if self._decayed_hits(child, now) <= self._GP_THRESHOLD:
+                break
+
+            matched_len = self._common_len(child.label, prefix, i)
+            i += matched_len
+            if i > self._START_LEN:
+                ret = i
 
-        for k, v in self._prefix_counter[lookup].items():
-            if v > self._GP_THRESHOLD and prefix.startswith(k):
-                return len(k)
+            if matched_len < len(child.label):
+                break
+            node = child
 
-        return -1
+        return ret
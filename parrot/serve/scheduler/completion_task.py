@@ -5,10 +5,11 @@
 from enum import Enum
 from typing import List, Dict, Optional
 from asyncio import Event
+import asyncio
 
 from parrot.exceptions import parrot_assert
 
-from parrot.utils import get_logger
+from parrot.utils import get_logger, time_counter_in_nanoseconds
 
 from parrot.serve.backend_repr import ExecutionEngine, Context
 from parrot.serve.graph import CompletionChain
@@ -40,7 +41,14 @@ class CompletionTask:
         # Tokenized result
         # Map from tokenizer name to tokenized result
         # A tokenized result is a List of token ids, i.e. List[List[int]]
-        self.tokenized_result: Optional[Dict[str, List[List[int]]]] = None
+        # NOTE: Tokenization is lazy. Token ids are only materialized for the
+        # tokenizers we actually need (i.e. the tokenizer of the scheduled engine).
+        self.tokenized_result: Dict[str, List[List[int]]] = {}
+        self.tokenizers_wrapper: Optional["TokenizersWrapper"] = None
+
+        # Memoized token numbers (Fill part + Gen part). Map from tokenizer name to the
+        # number of tokens.
+        self._token_nums: Dict[str, int] = {}
 
         # Context bound to the task
         # A list of contexts that are bound to the task
@@ -48,12 +56,28 @@ class CompletionTask:
 
         # Scheduling
         self._scheduled_event: Event = Event()
+        # Set when the task is removed from the scheduler without being scheduled.
+        self._aborted_event: Event = Event()
         self.schedule_annotation = schedule_annotation
         self.engine: Optional[ExecutionEngine] = None
+        self.create_time = time_counter_in_nanoseconds()
+        # Set by GlobalScheduler (in nanoseconds).
+        self.enqueue_time: Optional[int] = None
+        self.queue_wait_time: Optional[int] = None
+
+        # Failure recovery
+        # The exception of the last failed execution, and how many times the task is
+        # rescheduled after its engine failed.
+        self.exception: Optional[Exception] = None
+        self.num_retries = 0
+        self.first_failure_time: Optional[int] = None
 
     @property
     def is_tokenized(self) -> bool:
-        return self.tokenized_result is not None
+        return len(self.tokenized_result) > 0
+
+    def is_tokenized_by(self, tokenizer_name: str) -> bool:
+        return tokenizer_name in self.tokenized_result
 
     @property
     def context_bound(self) -> bool:
@@ -63,6 +87,15 @@ class CompletionTask:
     def is_scheduled(self) -> bool:
         return self._scheduled_event.is_set()
 
+    @property
+    def deadline(self) -> float:
+        """The absolute deadline (in nanoseconds) of the task. inf if it has no deadline."""
+
+        ddl_requirement = self.schedule_annotation.ddl_requirement
+        if ddl_requirement <= 0:
+            return float("inf")
+        return self.create_time + ddl_requirement * 1e9
+
     def schedule_to(
         self, engine: ExecutionEngine, update_engine_info: bool = True
     ) -> None:
@@ -75,40 +108,224 @@ class CompletionTask:
             self.engine.update_servelayer_runtime_info_add_task(self)
 
     async def wait_scheduled(self) -> None:
-        """Wait until the task is scheduled."""
+        """Wait until the task is scheduled.
 
-        await self._scheduled_event.wait()
+        Raises:
+            The exception of the task, if it's aborted before being scheduled.
+        """
+
+        if not self.is_scheduled and not self._aborted_event.is_set():
+            waiters = [
+                asyncio.ensure_future(self._scheduled_event.wait()),
+                asyncio.ensure_future(self._aborted_event.wait()),
+            ]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+        if not self.is_scheduled:
+            raise self.exception
+
+    def abort(self, exception: Exception) -> None:
+        """Abort a task waiting for being scheduled (e.g. its session is removed)."""
+
+        self.fail(exception)
+        self._aborted_event.set()
 
     def leave_scheduled(self) -> None:
         """Leave the scheduled status."""
 
-        self.engine.update_servelayer_runtime_info_remove_task(self)
+        if self.engine is not None:
+            self.engine.update_servelayer_runtime_info_remove_task(self)
+
+    def fail(self, exception: Exception) -> None:
+        """Mark the execution of the task as failed."""
+
+        self.status = TaskStatus.ERROR
+        self.exception = exception
+        if self.first_failure_time is None:
+            self.first_failure_time = time_counter_in_nanoseconds()
+
+    def reset_schedule(self) -> None:
+        """Reset a failed task so it can be submitted to the scheduler again.
+
+        The task keeps its id and tokenized results. Its contexts should be freed and it
+        should leave the scheduled status before resetting.
+        """
+
+        parrot_assert(
+            self.status == TaskStatus.ERROR, "Only failed tasks can be reset."
+        )
+
+        self.contexts = []
+        self.engine = None
+        self._scheduled_event.clear()
+        self._aborted_event.clear()
+        self.enqueue_time = None
+        self.status = TaskStatus.CREATED
+        self.num_retries += 1
+
+    def bind_tokenizers(self, tokenizers_wrapper: "TokenizersWrapper") -> None:
+        """Bind the tokenizers wrapper to the task, so token numbers can be computed lazily
+        when the scheduler asks for them."""
+
+        self.tokenizers_wrapper = tokenizers_wrapper
+
+    def _get_tokenizer_names(
+        self,
+        tokenizers_wrapper: "TokenizersWrapper",
+        tokenizer_names: Optional[List[str]],
+    ) -> List[str]:
+        if tokenizer_names is None:
+            tokenizer_names = list(tokenizers_wrapper.tokenizers.keys())
+        return [name for name in tokenizer_names if not self.is_tokenized_by(name)]
+
+    @staticmethod
+    def _tokenize_fill(
+        tokenizers_wrapper: "TokenizersWrapper", fill_node, tokenizer_name: str
+    ) -> List[int]:
+        # Use the result of the eager tokenization of the SV if it's available.
+        token_ids = fill_node.sv.get_token_ids(tokenizer_name)
+        if token_ids is None:
+            # NOTE: Use the SV id as the cache key, so shared SVs (e.g. constant
+            # prefixes) are only tokenized once.
+            token_ids = tokenizers_wrapper.tokenize(
+                fill_node.get(), tokenizer_name, cache_key=fill_node.var_id
+            )
+        return token_ids
+
+    @staticmethod
+    async def _atokenize_fill(
+        tokenizers_wrapper: "TokenizersWrapper", fill_node, tokenizer_name: str
+    ) -> List[int]:
+        await fill_node.sv.wait_tokenized(tokenizer_name)
+        token_ids = fill_node.sv.get_token_ids(tokenizer_name)
+        if token_ids is None:
+            token_ids = await tokenizers_wrapper.atokenize(
+                fill_node.get(), tokenizer_name, cache_key=fill_node.var_id
+            )
+        return token_ids
+
+    def _set_tokenized_result(
+        self, tokenizer_name: str, token_ids_list: List[List[int]]
+    ) -> None:
+        self.tokenized_result[tokenizer_name] = token_ids_list
+        if tokenizer_name not in self._token_nums:
+            self._token_nums[tokenizer_name] = (
+                sum(len(token_ids) for token_ids in token_ids_list)
+                + self._get_gen_tokens_num()
+            )
+
+    def _get_gen_tokens_num(self) -> int:
+        return self.chain.gen_node.sampling_config.max_gen_length
+
+    def tokenize_chain(
+        self,
+        tokenizers_wrapper: "TokenizersWrapper",
+        tokenizer_names: Optional[List[str]] = None,
+    ) -> None:
+        """Tokenize the chain using the tokenizers in the wrapper.
+
+        Args:
+            tokenizers_wrapper: The tokenizers wrapper.
+            tokenizer_names: Only tokenize with these tokenizers. None means all tokenizers
+                in the wrapper. Tokenizers that are already tokenized are skipped.
+        """
+
+        parrot_assert(self.chain.sv_created, "SVs are not created yet.")
+
+        self.bind_tokenizers(tokenizers_wrapper)
+        fill_nodes = list(self.chain.iter_fill())
+        for tokenizer_name in self._get_tokenizer_names(
+            tokenizers_wrapper, tokenizer_names
+        ):
+            self._set_tokenized_result(
+                tokenizer_name,
+                [
+                    self._tokenize_fill(tokenizers_wrapper, fill_node, tokenizer_name)
+                    for fill_node in fill_nodes
+                ],
+            )
+
+    async def atokenize_chain(
+        self,
+        tokenizers_wrapper: "TokenizersWrapper",
+        tokenizer_names: Optional[List[str]] = None,
+    ) -> None:
+        """Async version of tokenize_chain. Fill nodes are tokenized concurrently, off the
+        event loop."""
 
-    def tokenize_chain(self, tokenizers_wrapper: "TokenizersWrapper") -> None:
-        """Tokenize the chain using the tokenizers in the wrapper."""
+        parrot_assert(self.chain.sv_created, "SVs are not created yet.")
+
+        self.bind_tokenizers(tokenizers_wrapper)
+        fill_nodes = list(self.chain.iter_fill())
+        for tokenizer_name in self._get_tokenizer_names(
+            tokenizers_wrapper, tokenizer_names
+        ):
+            token_ids_list = await asyncio.gather(
+                *[
+                    self._atokenize_fill(tokenizers_wrapper, fill_node, tokenizer_name)
+                    for fill_node in fill_nodes
+                ]
+            )
+            self._set_tokenized_result(tokenizer_name, list(token_ids_list))
+
+    async def acompute_token_nums(
+        self,
+        tokenizers_wrapper: "TokenizersWrapper",
+        tokenizer_names: List[str],
+    ) -> None:
+        """Count the tokens of the task under the tokenizers, off the event loop.
+
+        The numbers are memoized, so they're stable during the lifetime of the task.
+        Counting tokens doesn't materialize the token ids in the task (they stay in the
+        tokenization cache of the wrapper).
+        """
 
-        parrot_assert(not self.is_tokenized, "Tokenized result is already available.")
         parrot_assert(self.chain.sv_created, "SVs are not created yet.")
 
-        self.tokenized_result = {}
-        for fill_node in self.chain.iter_fill():
-            tokenized_result: Dict = tokenizers_wrapper.tokenize_all(fill_node.get())
-            for key, value in tokenized_result.items():
-                if key not in self.tokenized_result:
-                    self.tokenized_result[key] = []
-                self.tokenized_result[key].append(value)
+        self.bind_tokenizers(tokenizers_wrapper)
+        fill_nodes = list(self.chain.iter_fill())
+        for tokenizer_name in tokenizer_names:
+            if tokenizer_name in self._token_nums:
+                continue
+
+            token_ids_list = await asyncio.gather(
+                *[
+                    self._atokenize_fill(tokenizers_wrapper, fill_node, tokenizer_name)
+                    for fill_node in fill_nodes
+                ]
+            )
+            # Add the number of tokens in Fill part and Gen part.
+            self._token_nums.setdefault(
+                tokenizer_name,
+                sum(len(token_ids) for token_ids in token_ids_list)
+                + self._get_gen_tokens_num(),
+            )
+
+    def has_token_nums(self, tokenizer_name: str) -> bool:
+        return tokenizer_name in self._token_nums
 
     def get_token_nums(self, tokenizer_name: str) -> int:
-        """Get the number of tokens in the tokenized result."""
-
-        parrot_assert(self.is_tokenized, "Tokenized result is not available.")
-        tokens_num = 0
-        # Add the number of tokens in Fill part.
-        for token_ids in self.tokenized_result[tokenizer_name]:
-            tokens_num += len(token_ids)
-        # Add the number of tokens in Gen part.
-        tokens_num += self.chain.gen_node.sampling_config.max_gen_length
-        return tokens_num
+        """Get the number of tokens of the task under a tokenizer.
+
+        NOTE: This never tokenizes, since it's called in the scheduling loop. The number
+        must be computed before, by acompute_token_nums or tokenize_chain.
+        """
+
+        parrot_assert(
+            tokenizer_name in self._token_nums,
+            f"Token numbers of the task are not computed (tokenizer={tokenizer_name}).",
+        )
+        return self._token_nums[tokenizer_name]
+
+    def get_max_token_nums(self) -> int:
+        """The largest number of tokens of the task among the tokenizers counted so far
+        (0 if none), as a tokenizer-agnostic estimation of its token demand."""
+
+        return max(self._token_nums.values(), default=0)
 
     def __str__(self):
         return f"CompletionTask(chain={self.chain})"
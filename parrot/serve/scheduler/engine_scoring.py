@@ -0,0 +1,79 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+"""Scoring functions used by GlobalScheduler to rank the candidate engines of a task group.
+
+A scorer takes an engine and the group of tasks to be dispatched, and returns a score.
+The engine with the lowest score is selected.
+
+Scorers blend two views of an engine:
+- Serve-layer info: Tasks/tokens reserved by ServeCore. Updated instantly when a task is
+  scheduled, but it knows nothing about how fast the engine actually runs.
+- Real-time info: Reported by the engine in heartbeats (e.g. the number of jobs, the recent
+  iteration latency and the number of cached tokens). Accurate but slightly outdated.
+"""
+
+
+from typing import Callable, Dict, List
+
+from parrot.exceptions import parrot_assert
+from parrot.serve.backend_repr import ExecutionEngine
+from parrot.serve.backend_repr.model import ModelType
+
+from .completion_task import CompletionTask
+
+
+EngineScorer = Callable[[ExecutionEngine, List[CompletionTask]], float]
+
+
+# Iteration latency (ns) assumed for engines which haven't reported their latency yet.
+DEFAULT_ITERATION_LATENCY = 20 * 1_000_000
+
+
+def _pending_jobs_num(engine: ExecutionEngine) -> int:
+    # NOTE: Tasks scheduled since the last heartbeat are not counted in the
+    # real-time info yet, while tasks submitted to the engine may issue several jobs. So we
+    # take the larger one of the two views.
+    return max(engine.get_num_total_jobs(), engine.get_num_tasks())
+
+
+def queueing_delay_score(engine: ExecutionEngine, tasks: List[CompletionTask]) -> float:
+    """Predicted queueing delay (in ns) of the tasks if they are dispatched to the engine.
+
+    If the engine hasn't reported its latency yet (e.g. it's newly registered),
+    DEFAULT_ITERATION_LATENCY is assumed, so all engines are scored in the same unit.
+    """
+
+    pending_jobs_num = _pending_jobs_num(engine) + len(tasks)
+    latency = engine.get_recent_average_latency()
+    if latency <= 0:
+        latency = DEFAULT_ITERATION_LATENCY
+    return pending_jobs_num * latency
+
+
+def kv_free_score(engine: ExecutionEngine, tasks: List[CompletionTask]) -> float:
+    """Negative number of free KV cache tokens after the tasks are dispatched to the engine.
+
+    The used tokens are the larger one of the reserved tokens (serve layer) and the cached
+    tokens reported by the engine.
+    """
+
+    used_tokens_num = max(engine.get_tokens_num(), engine.get_num_cached_tokens())
+    if engine.model_type == ModelType.TOKEN_ID:
+        tokenizer_name = engine.tokenizer_name
+        for task in tasks:
+            used_tokens_num += task.get_token_nums(tokenizer_name)
+    return -(engine.config.tokens_capacity - used_tokens_num)
+
+
+# Name -> scorer. "default" is not here: it's the original comparison in GlobalScheduler.
+ENGINE_SCORERS: Dict[str, EngineScorer] = {
+    "queueing_delay": queueing_delay_score,
+    "kv_free": kv_free_score,
+}
+
+
+def get_engine_scorer(name: str) -> EngineScorer:
+    parrot_assert(name in ENGINE_SCORERS, f"Unknown engine scorer: {name}")
+    return ENGINE_SCORERS[name]
@@ -2,19 +2,36 @@
 # Licensed under the MIT license.
 
 
-from typing import Optional, List, Set
+from typing import Optional, List, Dict, Set, Tuple, Iterator
 from dataclasses import dataclass
-
-from parrot.exceptions import ParrotCoreUserError
-from parrot.utils import get_logger, RecyclePool
-
-from parrot.serve.graph import RequestChain
+from asyncio import Event
+import heapq
+
+from parrot.exceptions import ParrotCoreUserError, parrot_assert
+from parrot.utils import (
+    get_logger,
+    RecyclePool,
+    time_counter_in_nanoseconds,
+    create_task_in_loop,
+)
+
+from parrot.serve.graph import RequestChain, CompChainGroup
 from parrot.serve.backend_repr import ExecutionEngine
 from parrot.serve.backend_repr.model import get_model_type, ModelType
 
 from ..engine_manager import EngineManager
 from ..context_manager import ServeCoreContextManager
 from .completion_task import CompletionTask, TaskStatus
+from .engine_scoring import ENGINE_SCORERS
+from .policies import (
+    OrderingPolicy,
+    GroupingPolicy,
+    PlacementPolicy,
+    ORDERING_POLICIES,
+    GROUPING_POLICIES,
+    PLACEMENT_POLICIES,
+    create_policy,
+)
 
 
 logger = get_logger("GlobalScheduler")
@@ -28,6 +45,54 @@ class GlobalSchedulerConfig:
     ctx_aware: bool = False
     max_queue_size: int = 1024
 
+    # How to rank the candidate engines. "default" minimizes the decrease of the
+    # tasks_num_upperbound, then the remaining tokens capacity. Other choices are the
+    # scorers in engine_scoring.py, which also use the real-time runtime info of engines.
+    engine_scoring: str = "default"
+
+    # Policies of the three stages of scheduling. See policies.py. The default "fifo"
+    # ordering serves tasks in their arrival order (deeper chains first with app_fifo);
+    # "edf" orders them by (virtual) deadlines instead.
+    ordering_policy: str = "fifo"
+    grouping_policy: str = "default"
+    placement_policy: str = "default"
+
+    # The slacks below are only used by the "edf" ordering policy. Tasks without a
+    # TTFT/TPOT deadline get a virtual deadline this many seconds after they are
+    # created, by their criteria. So waiting throughput tasks are aged, and go ahead of
+    # newer latency tasks eventually.
+    latency_slack: float = 1.0
+    throughput_slack: float = 10.0
+    # With app_fifo, the deadline is moved earlier by this many seconds per depth level of
+    # the chain, so deeper chains go first.
+    depth_slack: float = 1.0
+    # The deadline is moved earlier by this many seconds per token of the remaining
+    # critical-path work of the chain, so chains on the critical path go first. This is
+    # opt-in: 0 (the default) disables it. E.g. 0.001 makes a chain with 1000 more
+    # tokens of remaining work as urgent as a chain created 1 second earlier.
+    critical_path_slack: float = 0.0
+
+    # Weighted fair sharing across sessions. Each session gets a virtual time, which grows
+    # by 1/weight for every task of it scheduled. The next task is taken from the session
+    # with the smallest virtual time, i.e. the session furthest behind its share.
+    fair_share: bool = False
+
+    # If no engine can hold a whole group, split the group across engines (bin packing)
+    # instead of waiting until an engine can.
+    split_groups: bool = True
+
+    def __post_init__(self):
+        parrot_assert(
+            self.engine_scoring == "default" or self.engine_scoring in ENGINE_SCORERS,
+            f"Unknown engine scoring: {self.engine_scoring}",
+        )
+        for name, registry in [
+            (self.ordering_policy, ORDERING_POLICIES),
+            (self.grouping_policy, GROUPING_POLICIES),
+            (self.placement_policy, PLACEMENT_POLICIES),
+        ]:
+            parrot_assert(name in registry, f"Unknown scheduler policy: {name}")
+
 
 class GlobalScheduler:
     """GlobalScheduler (GS) solves the task scheduling problem in the global scope."""
@@ -44,30 +109,79 @@ class GlobalScheduler:
         self.context_mgr = context_mgr
 
         # ---------- Task Queue ----------
-        self.task_queue: List[CompletionTask] = []
+        # A heap of (deadline, seq, task).
+        self._task_heap: List[Tuple[float, int, CompletionTask]] = []
+        self._task_seq = 0
+        # task_id -> (deadline, seq), i.e. the position of the task in the queue.
+        self._queue_positions: Dict[int, Tuple[float, int]] = {}
+        # task_id -> queued task whose key is stale, i.e. the remaining work of its
+        # chain changed after it's queued. They are re-keyed in a batch before the queue
+        # is read.
+        self._stale_key_tasks: Dict[int, CompletionTask] = {}
+
+        # ---------- Fair Sharing ----------
+        # session_id -> weight. Sessions not registered have weight 1.
+        self._session_weights: Dict[int, float] = {}
+        # session_id -> virtual time
+        self._session_vtimes: Dict[int, float] = {}
+        # session_id -> heap of the queued tasks of the session. Same entries as the
+        # global heap. Only maintained when fair_share is enabled.
+        self._session_heaps: Dict[int, List[Tuple[float, int, CompletionTask]]] = {}
+        # Virtual time of the system, i.e. the virtual time of the session last served.
+        # A session becoming backlogged starts from here, so idle sessions can't bank
+        # their shares.
+        self._virtual_time: float = 0.0
+
+        # ---------- Token Counting ----------
+        # (task, tokenizer_name) whose token numbers are being computed in the background.
+        self._pending_token_nums: Set[Tuple[CompletionTask, str]] = set()
+
+        # ---------- Instrumentation ----------
+        # Time (ns) tasks waited in the queue before they are scheduled.
+        self.num_dequeued_tasks = 0
+        self.total_queue_wait_time = 0
+        self.max_queue_wait_time = 0
+
+        # ---------- Policies ----------
+        self.ordering_policy: OrderingPolicy = create_policy(
+            ORDERING_POLICIES, config.ordering_policy, self
+        )
+        self.grouping_policy: GroupingPolicy = create_policy(
+            GROUPING_POLICIES, config.grouping_policy, self
+        )
+        self.placement_policy: PlacementPolicy = create_policy(
+            PLACEMENT_POLICIES, config.placement_policy, self
+        )
+
+        # ---------- Wakeup ----------
+        # Set when something that may change the scheduling result happens, e.g. a new task
+        # is submitted, a task finishes or an engine's capacity changes.
+        self._wakeup_event: Event = Event()
+
+    # ---------- Grouping ----------
+
+    def _group_tasks(
+        self, task: CompletionTask, queue_positions: Dict[int, Tuple[float, int]]
+    ) -> List[CompletionTask]:
+        return self.grouping_policy.group_tasks(task, queue_positions)
+
+    # ---------- Placement ----------
 
     def _get_engine_list(
         self,
         tasks: List[CompletionTask],
         tasks_num_upperbound: int,
     ) -> List[ExecutionEngine]:
-        engine_list = self.engine_mgr.get_live_engines()
-
         # NOTE(chaofan): Suppose all tasks noted the same "models" arg.
         models = tasks[0].chain.metadata.models
         model_type_str = tasks[0].chain.metadata.model_type
         model_type = get_model_type(model_type_str)
         # TODO(chaofan): Throughput/latency criteria
 
-        def check_engine_available(engine: ExecutionEngine):
-            # Check whether the mode type matches
-            if model_type != engine.model.model_type:
-                return False
-
-            # Check whether the model matches
-            if len(models) > 0 and engine.model_name not in models:
-                return False
+        # Live engines whose model type and model match, from the indexes.
+        engine_list = self.engine_mgr.get_live_engines_by_model(model_type, models)
 
+        def check_engine_available(engine: ExecutionEngine):
             # Check whether it violates the tasks_num_upperbound of the tasks.
             # NOTE(chaofan): For TaskGroup (i.e. tasks passed to this function),
             # the whole group is considered as a single task.
@@ -82,90 +196,424 @@ class GlobalScheduler:
             if len(tasks) > engine.get_remain_tasks_capacity():
                 return False
 
-            if model_type == ModelType.TOKEN_ID:
+            return True
+
+        engine_list = [
+            engine for engine in engine_list if check_engine_available(engine)
+        ]
+
+        if model_type == ModelType.TOKEN_ID:
+            # Check whether the engine has enough token capacity.
+            # NOTE: Token numbers are only used for the tokenizers of the candidate
+            # engines. Engines that can fit the tokens are found by a range query.
+            fit_engine_ids = set()
+            for tokenizer_name in dict.fromkeys(
+                engine.tokenizer_name for engine in engine_list
+            ):
+                # The scheduler never tokenizes. If the tokens are not counted yet (e.g.
+                # the engine is registered after the task is submitted), skip the
+                # engines of the tokenizer until they're counted in the background.
+                if not all(task.has_token_nums(tokenizer_name) for task in tasks):
+                    self._compute_token_nums(tasks, tokenizer_name)
+                    continue
+
                 total_tokens_num = 0
                 for task in tasks:
-                    total_tokens_num += task.get_token_nums(engine.model.tokenizer_name)
+                    total_tokens_num += task.get_token_nums(tokenizer_name)
 
-                # Check whether the engine has enough token capacity.
-                if total_tokens_num > engine.get_remain_tokens_capacity():
-                    return False
+                fit_engine_ids.update(
+                    engine.engine_id
+                    for engine in self.engine_mgr.get_live_engines_by_tokens_capacity(
+                        tokenizer_name, total_tokens_num
+                    )
+                )
+            engine_list = [
+                engine for engine in engine_list if engine.engine_id in fit_engine_ids
+            ]
 
-            return True
+        return engine_list
 
-        return [engine for engine in engine_list if check_engine_available(engine)]
+    def _compute_token_nums(
+        self, tasks: List[CompletionTask], tokenizer_name: str
+    ) -> None:
+        """Count the tokens of the tasks under the tokenizer in the background."""
 
-    def _find_engine(self, tasks: List[CompletionTask]) -> None:
-        """Find the best engine for a group of tasks."""
+        for task in tasks:
+            key = (task, tokenizer_name)
+            if task.has_token_nums(tokenizer_name) or key in self._pending_token_nums:
+                continue
 
+            parrot_assert(
+                task.tokenizers_wrapper is not None,
+                "Tokenizers are not bound to the task.",
+            )
+            self._pending_token_nums.add(key)
+            create_task_in_loop(self._acompute_token_nums(task, tokenizer_name))
+
+    async def _acompute_token_nums(
+        self, task: CompletionTask, tokenizer_name: str
+    ) -> None:
+        try:
+            await task.acompute_token_nums(task.tokenizers_wrapper, [tokenizer_name])
+        finally:
+            self._pending_token_nums.discard((task, tokenizer_name))
+
+        # The engines of the tokenizer can be evaluated now.
+        self.wakeup()
+
+    @staticmethod
+    def _get_tasks_num_upperbound(tasks: List[CompletionTask]) -> int:
         tasks_num_upperbound = 999999999
         for task in tasks:
             tasks_num_upperbound = min(
                 tasks_num_upperbound, task.schedule_annotation.tasks_num_upperbound
             )
+        return tasks_num_upperbound
+
+    def _place_tasks(self, tasks: List[CompletionTask]) -> bool:
+        """Dispatch a group of tasks to one engine, if any engine can hold them.
+
+        Returns:
+            Whether the tasks are dispatched.
+        """
 
         # Get the engine list
-        engine_list = self._get_engine_list(tasks, tasks_num_upperbound)
+        engine_list = self._get_engine_list(
+            tasks, self._get_tasks_num_upperbound(tasks)
+        )
 
         if len(engine_list) == 0:
-            return
+            return False
 
-        # if len(engine_list) == 0:
-        #     if len(tasks) == 1:
-        #         return
-        #     else:
-        #         # Split the group
-        #         for task in tasks:
-        #             self._find_engine([task])
-        #         return
-
-        # Get the engines with Context
-        # We use the first task's context to find the engines with the same context
-        if self.config.ctx_aware:
-            engine_ids_with_prefixes = self.context_mgr.query_prefixes_in_engines(
-                tasks[0]
-            )
-            # print(engine_ids_with_prefixes)
-
-        best_engine = None
-        for engine in engine_list:
-            if best_engine is None:
-                best_engine = engine
-            elif (
-                self.config.ctx_aware
-                and engine.engine_id in engine_ids_with_prefixes
-                and best_engine.engine_id not in engine_ids_with_prefixes
-            ):
-                # Context-aware engine is preferred
-                best_engine = engine
-            else:
-                # Select the best engine (minimizing the negative impacts, i.e. minimizing the decreasing of upperbound)
-                # If the upperbound is not affected, select the engine with the most capacity.
-                if (
-                    engine.get_tasks_num_upperbound()
-                    < best_engine.get_tasks_num_upperbound()
-                ):
-                    best_engine = engine
-                elif (
-                    engine.get_remain_tokens_capacity()
-                    < best_engine.get_remain_tokens_capacity()
-                ):
-                    best_engine = engine
+        best_engine = self.placement_policy.select_engine(tasks, engine_list)
 
         # Dispatch the tasks to the engine
         assert best_engine is not None
         for task in tasks:
             task.schedule_to(best_engine)
+        return True
+
+    def _max_placeable_num(self, tasks: List[CompletionTask]) -> int:
+        """The largest k such that some engine can hold the first k tasks as a whole.
+
+        The engine_list checks are monotonic in the tasks (fewer tasks never need more
+        task or token capacity), so it's a binary search.
+        """
+
+        lo, hi = 0, len(tasks)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            head = tasks[:mid]
+            if len(self._get_engine_list(head, self._get_tasks_num_upperbound(head))):
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _split_group(self, tasks: List[CompletionTask]) -> None:
+        """Split a group which no engine can hold as a whole across engines.
+
+        It's a first-fit-decreasing bin packing: Tasks sharing the first SemanticVariable
+        (i.e. the prefix context) are kept together as an item if possible. Items are
+        placed from the largest one (by token demand, then by the number of tasks),
+        each to an engine with enough task and token capacity (the engine_list checks),
+        chosen by the placement policy. An item no engine can hold is packed onto as few
+        engines as possible: As many of its tasks as fit go to one engine, then the rest
+        spill over. Tasks that still don't fit stay in the queue.
+        """
+
+        items: Dict[str, List[CompletionTask]] = {}
+        for task in tasks:
+            items.setdefault(task.chain.first_node.var_id, []).append(task)
+
+        def item_size(item: List[CompletionTask]) -> Tuple[int, int]:
+            return sum(task.get_max_token_nums() for task in item), len(item)
+
+        # NOTE: sorted() is stable, so items of the same size keep the queue
+        # order.
+        for item in sorted(items.values(), key=item_size, reverse=True):
+            rest = item
+            while len(rest) > 0:
+                num = self._max_placeable_num(rest)
+                if num == 0:
+                    # The head task fits nowhere. Try the others.
+                    rest = rest[1:]
+                    continue
+                self._place_tasks(rest[:num])
+                rest = rest[num:]
+
+    def _find_engine(self, tasks: List[CompletionTask]) -> None:
+        """Find the best engine for a group of tasks."""
+
+        if self._place_tasks(tasks):
+            return
+
+        if len(tasks) > 1 and self.config.split_groups:
+            self._split_group(tasks)
+
+    # ---------- Queue ----------
+
+    def _get_queue_key(self, task: CompletionTask) -> float:
+        return self.ordering_policy.get_queue_key(task)
+
+    def _mark_key_stale(self, task: CompletionTask) -> None:
+        self._stale_key_tasks[task.task_id] = task
+
+    def _refresh_queue_keys(self) -> None:
+        """Re-key the tasks whose keys are stale, and restore the heaps.
+
+        The seq of a task is kept, so ties are still broken by the submission order.
+        """
+
+        if len(self._stale_key_tasks) == 0:
+            return
+
+        stale_tasks = self._stale_key_tasks
+        self._stale_key_tasks = {}
+
+        changed = False
+        for task in stale_tasks.values():
+            _, seq = self._queue_positions[task.task_id]
+            key = (self._get_queue_key(task), seq)
+            if key != self._queue_positions[task.task_id]:
+                self._queue_positions[task.task_id] = key
+                changed = True
+        if not changed:
+            return
+
+        def rekey(heap: List[Tuple[float, int, CompletionTask]]) -> None:
+            for i, entry in enumerate(heap):
+                if entry[2].task_id in stale_tasks:
+                    heap[i] = self._queue_positions[entry[2].task_id] + (entry[2],)
+            heapq.heapify(heap)
+
+        rekey(self._task_heap)
+        if self.config.fair_share:
+            for session_id in set(
+                task.chain.session_id for task in stale_tasks.values()
+            ):
+                rekey(self._session_heaps[session_id])
+
+    @staticmethod
+    def _iter_heap(
+        heap: List[Tuple[float, int, CompletionTask]]
+    ) -> Iterator[CompletionTask]:
+        """Iterate the tasks in a heap in the order of their keys, without popping them.
+
+        Visiting the first k tasks costs O(k log k), so a tick that stops early doesn't pay
+        for the whole queue.
+        """
+
+        if len(heap) == 0:
+            return
+
+        # Entries are unique (by seq), so the index is never compared.
+        frontier = [(heap[0], 0)]
+        while len(frontier) > 0:
+            entry, idx = heapq.heappop(frontier)
+            yield entry[2]
+            for child in (2 * idx + 1, 2 * idx + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def _iter_queue(self) -> Iterator[CompletionTask]:
+        """Iterate the queued tasks in the scheduling order."""
+
+        if not self.config.fair_share:
+            yield from self._iter_heap(self._task_heap)
+            return
+
+        # Merge the queues of sessions: Always take the next task from the session with
+        # the smallest virtual time. Ties are broken by the queue order.
+        # NOTE: Scheduling a group charges every session in it (by schedule(), before
+        # we resume from yield), so the key of an entry may be stale when it's popped.
+        # Virtual times only grow, so a stale entry is re-pushed with its current key.
+        session_iters: Dict[int, Iterator[CompletionTask]] = {}
+        frontier = []
+        for session_id, heap in self._session_heaps.items():
+            session_iters[session_id] = self._iter_heap(heap)
+            task = next(session_iters[session_id])
+            frontier.append(
+                (
+                    self._session_vtimes[session_id],
+                    self._queue_positions[task.task_id],
+                    session_id,
+                    task,
+                )
+            )
+        heapq.heapify(frontier)
+
+        while len(frontier) > 0:
+            vtime, queue_position, session_id, task = heapq.heappop(frontier)
+            cur_vtime = self._session_vtimes[session_id]
+            if vtime != cur_vtime:
+                heapq.heappush(frontier, (cur_vtime, queue_position, session_id, task))
+                continue
+
+            yield task
+            task = next(session_iters[session_id], None)
+            if task is not None:
+                heapq.heappush(
+                    frontier,
+                    (
+                        self._session_vtimes[session_id],
+                        self._queue_positions[task.task_id],
+                        session_id,
+                        task,
+                    ),
+                )
+
+    def _charge_sessions(self, tasks: List[CompletionTask]) -> None:
+        """Advance the virtual times of the sessions of the scheduled tasks."""
+
+        for task in tasks:
+            session_id = task.chain.session_id
+            vtime = self._session_vtimes[session_id]
+            self._virtual_time = max(self._virtual_time, vtime)
+            weight = self._session_weights.get(session_id, 1.0)
+            self._session_vtimes[session_id] = vtime + 1.0 / weight
+
+    def _has_free_engine(self) -> bool:
+        return any(
+            engine.get_remain_tasks_capacity() > 0
+            for engine in self.engine_mgr.get_live_engines()
+        )
+
+    def _remove_from_queue(self, tasks: List[CompletionTask]) -> None:
+        """Remove the tasks from the heaps and the indexes of the queue."""
+
+        removed_tasks = set(tasks)
+        self._task_heap = [
+            entry for entry in self._task_heap if entry[2] not in removed_tasks
+        ]
+        heapq.heapify(self._task_heap)
+
+        if self.config.fair_share:
+            for session_id in set(task.chain.session_id for task in tasks):
+                session_heap = [
+                    entry
+                    for entry in self._session_heaps.get(session_id, [])
+                    if entry[2] not in removed_tasks
+                ]
+                if len(session_heap) == 0:
+                    self._session_heaps.pop(session_id, None)
+                else:
+                    heapq.heapify(session_heap)
+                    self._session_heaps[session_id] = session_heap
+
+        for task in tasks:
+            self.grouping_policy.on_task_dequeued(task)
+            self._queue_positions.pop(task.task_id)
+            self._stale_key_tasks.pop(task.task_id, None)
+            task.chain.set_remaining_work_listener(None)
+
+    def _dequeue_scheduled_tasks(self) -> List[CompletionTask]:
+        scheduled_tasks = [
+            entry[2] for entry in self._task_heap if entry[2].is_scheduled
+        ]
+        if len(scheduled_tasks) == 0:
+            return scheduled_tasks
+
+        self._remove_from_queue(scheduled_tasks)
+
+        cur_time = time_counter_in_nanoseconds()
+        for task in scheduled_tasks:
+            task.queue_wait_time = cur_time - task.enqueue_time
+            self.num_dequeued_tasks += 1
+            self.total_queue_wait_time += task.queue_wait_time
+            self.max_queue_wait_time = max(
+                self.max_queue_wait_time, task.queue_wait_time
+            )
+
+        return scheduled_tasks
 
     # ---------- Public Methods ----------
 
+    @property
+    def num_queued_tasks(self) -> int:
+        return len(self._task_heap)
+
+    @property
+    def task_queue(self) -> List[CompletionTask]:
+        """The queued tasks, in the scheduling order."""
+
+        self._refresh_queue_keys()
+        return [entry[2] for entry in sorted(self._task_heap)]
+
+    @property
+    def average_queue_wait_time(self) -> float:
+        """Average time (ns) the scheduled tasks waited in the queue."""
+
+        if self.num_dequeued_tasks == 0:
+            return 0.0
+        return self.total_queue_wait_time / self.num_dequeued_tasks
+
+    def register_session(self, session_id: int, weight: float = 1.0) -> None:
+        """Register a session with its weight in fair sharing."""
+
+        parrot_assert(weight > 0, f"Session weight must be positive, got {weight}.")
+        self._session_weights[session_id] = weight
+
+    def remove_session(self, session_id: int) -> None:
+        """Remove the fair sharing states of a session, and abort its queued tasks.
+
+        NOTE: Session ids are recycled, so nothing of the session is kept. Otherwise a
+        new session with the same id would inherit its virtual time and queue.
+        """
+
+        self._session_weights.pop(session_id, None)
+        self._session_vtimes.pop(session_id, None)
+
+        queued_tasks = [
+            entry[2]
+            for entry in self._task_heap
+            if entry[2].chain.session_id == session_id
+        ]
+        if len(queued_tasks) == 0:
+            return
+
+        self._remove_from_queue(queued_tasks)
+        for task in queued_tasks:
+            task.abort(
+                ParrotCoreUserError(
+                    RuntimeError(f"Session (session_id={session_id}) is removed.")
+                )
+            )
+        logger.debug(
+            f"{len(queued_tasks)} queued tasks of Session (session_id={session_id}) "
+            "are aborted."
+        )
+
+    def remove_task(self, task: CompletionTask) -> bool:
+        """Remove a queued task which is not scheduled yet.
+
+        Returns:
+            Whether the task was in the queue.
+        """
+
+        if task.is_scheduled or task.task_id not in self._queue_positions:
+            return False
+        self._remove_from_queue([task])
+        return True
+
+    def wakeup(self) -> None:
+        """Notify the scheduler that it's worth running schedule() again."""
+
+        self._wakeup_event.set()
+
+    async def wait_wakeup(self) -> None:
+        """Wait until the scheduler is woken up."""
+
+        await self._wakeup_event.wait()
+        self._wakeup_event.clear()
+
     def submit_task(self, task: CompletionTask) -> None:
         """Submit a task to the scheduler's queue."""
 
-        if len(self.task_queue) >= self.config.max_queue_size:
+        if len(self._task_heap) >= self.config.max_queue_size:
             raise ParrotCoreUserError(
                 RuntimeError(
-                    f"Task queue is full. Current size: {len(self.task_queue)}. "
+                    f"Task queue is full. Current size: {len(self._task_heap)}. "
                     f"Hence the incoming task is rejected."
                 )
             )
@@ -175,63 +623,62 @@ class GlobalScheduler:
             " to GlobalScheduler."
         )
 
-        self.task_queue.append(task)
+        key = (self._get_queue_key(task), self._task_seq)
+        self._task_seq += 1
+        heapq.heappush(self._task_heap, key + (task,))
+        if self.config.fair_share:
+            session_id = task.chain.session_id
+            if session_id not in self._session_heaps:
+                # The session becomes backlogged.
+                self._session_heaps[session_id] = []
+                self._session_vtimes[session_id] = max(
+                    self._session_vtimes.get(session_id, 0.0), self._virtual_time
+                )
+            heapq.heappush(self._session_heaps[session_id], key + (task,))
+        self._queue_positions[task.task_id] = key
+        self.grouping_policy.on_task_queued(task)
+        # The key depends on the remaining work of the chain, which may change while the
+        # task is queued.
+        task.chain.set_remaining_work_listener(
+            lambda chain: self._mark_key_stale(task)
+        )
+        task.enqueue_time = time_counter_in_nanoseconds()
         task.status = TaskStatus.INQUEUE
+        self.wakeup()
         return
 
     def schedule(self) -> None:
         """Try to schedule all tasks in scheduler's queue."""
 
-        if self.config.app_fifo:
-            # Sort the tasks by the order of depth
-            # The deeper the chain, the higher the priority
-            self.task_queue.sort(key=lambda x: -x.chain.depth)
+        self._refresh_queue_keys()
+        self.grouping_policy.on_schedule_begin([entry[2] for entry in self._task_heap])
+
+        # NOTE: Tasks are visited in the order of their deadlines (merged across
+        # sessions by their virtual times, if fair_share is enabled). Stop when no engine
+        # can take more tasks.
+        has_free_engine = self._has_free_engine()
+        for task in self._iter_queue():
+            if not has_free_engine:
+                break
 
-        # NOTE(chaofan): The tasks are sorted by priority, by default.
-        for i, task in enumerate(self.task_queue):
             if task.is_scheduled:
                 continue
 
             # Group tasks in rest queue
-            cur_group: List[CompletionTask] = [task]
-            chain_groups = set(task.chain.chain_groups)
-
-            # Only allow one type of grouping at a time
-            graph_group_enabled = self.config.graph_group
-            ctx_group_enabled = self.config.ctx_group
-
-            if graph_group_enabled or ctx_group_enabled:
-                for j in range(i + 1, len(self.task_queue)):
-                    task_j = self.task_queue[j]
-
-                    # TODO(chaofan): Models match check
-                    models_i = task.chain.metadata.models
-                    models_j = task_j.chain.metadata.models
-
-                    # TODO(chaofan): Criteria match check. Only group tasks with the same criteria.
-
-                    # Graph group check
-                    if graph_group_enabled:
-                        chain_groups_j = set(task_j.chain.chain_groups)
-                        common_groups = chain_groups.intersection(chain_groups_j)
-                        if len(common_groups) > 0:
-                            cur_group.append(task_j)
-                            chain_groups = common_groups
-                            ctx_group_enabled = False  # Use graph group this round
-
-                    # Context group check
-                    if ctx_group_enabled:
-                        if task.chain.first_node.sv == task_j.chain.first_node.sv:
-                            cur_group.append(task_j)
-                            graph_group_enabled = False  # Use context group this round
+            cur_group = self._group_tasks(task, self._queue_positions)
 
             # Try to find engines for the group
             self._find_engine(cur_group)
 
+            # NOTE: The group may be split, with only some tasks scheduled.
+            scheduled_group = [task_j for task_j in cur_group if task_j.is_scheduled]
+            if len(scheduled_group) > 0:
+                if self.config.fair_share:
+                    self._charge_sessions(scheduled_group)
+                has_free_engine = self._has_free_engine()
+
         # Update the task queue
-        prev_task_queue = self.task_queue
-        scheduled_task = [task for task in prev_task_queue if task.is_scheduled]
-        self.task_queue = [task for task in prev_task_queue if not task.is_scheduled]
+        scheduled_task = self._dequeue_scheduled_tasks()
 
         # Display the scheduled results.
         # NOTE(chaofan): Only display >0 case to reduce the log size.
@@ -0,0 +1,364 @@
+# Copyright (c) 2023 by Microsoft Corporation.
+# Licensed under the MIT license.
+
+
+"""Policies of GlobalScheduler.
+
+Scheduling a round is split into three stages, each with a pluggable policy:
+- Ordering: The key of a task in the queue. Tasks with smaller keys are scheduled first.
+- Grouping: Which queued tasks are scheduled together with a task (to the same engine).
+- Placement: Which engine a group of tasks is dispatched to, among the engines that can
+  hold them.
+
+Policies are selected by name in GlobalSchedulerConfig. To add a policy, subclass the
+stage's base class and register it in the stage's dict.
+"""
+
+
+from typing import Dict, List, Tuple, Type, TYPE_CHECKING
+
+from parrot.exceptions import parrot_assert
+from parrot.serve.graph import CompChainGroup, PerformanceCriteria
+from parrot.serve.backend_repr import ExecutionEngine
+
+from .completion_task import CompletionTask
+from .engine_scoring import get_engine_scorer
+
+if TYPE_CHECKING:
+    from .global_scheduler import GlobalScheduler
+
+
+class SchedulerPolicy:
+    """Base class of policies. A policy instance belongs to one GlobalScheduler."""
+
+    def __init__(self, scheduler: "GlobalScheduler"):
+        self.scheduler = scheduler
+        self.config = scheduler.config
+
+
+# ---------- Ordering ----------
+
+
+class OrderingPolicy(SchedulerPolicy):
+    def get_queue_key(self, task: CompletionTask) -> float:
+        """The key of the task in the queue. Called when the task is submitted, and
+        again when the remaining work of its chain changes while it's queued."""
+
+        raise NotImplementedError
+
+
+class EDFOrderingPolicy(OrderingPolicy):
+    """Earliest (virtual) deadline first, with aging. See GlobalSchedulerConfig."""
+
+    def get_queue_key(self, task: CompletionTask) -> float:
+        deadline = task.deadline
+        if deadline == float("inf"):
+            if task.chain.criteria == PerformanceCriteria.THROUGHPUT:
+                slack = self.config.throughput_slack
+            else:
+                slack = self.config.latency_slack
+            deadline = task.create_time + slack * 1e9
+
+        if self.config.app_fifo:
+            # The deeper the chain, the higher the priority
+            deadline -= task.chain.depth * self.config.depth_slack * 1e9
+
+        # NOTE: The remaining work may change while the task is queued (e.g. a new
+        # consumer of the chain is activated). The scheduler re-keys the task then.
+        deadline -= task.chain.remaining_work * self.config.critical_path_slack * 1e9
+
+        return deadline
+
+
+class FIFOOrderingPolicy(OrderingPolicy):
+    """First come, first served. With app_fifo, deeper chains go first."""
+
+    def get_queue_key(self, task: CompletionTask) -> float:
+        # Ties are broken by the submission order.
+        if self.config.app_fifo:
+            return -task.chain.depth
+        return 0.0
+
+
+# ---------- Grouping ----------
+
+
+class GroupingPolicy(SchedulerPolicy):
+    def on_task_queued(self, task: CompletionTask) -> None:
+        pass
+
+    def on_task_dequeued(self, task: CompletionTask) -> None:
+        pass
+
+    def on_schedule_begin(self, tasks: List[CompletionTask]) -> None:
+        """Called with all queued tasks before each scheduling round."""
+
+        pass
+
+    def group_tasks(
+        self, task: CompletionTask, queue_positions: Dict[int, Tuple[float, int]]
+    ) -> List[CompletionTask]:
+        """Group the task with the unscheduled tasks behind it in the queue.
+
+        Args:
+            task: The leading task of the group.
+            queue_positions: task_id -> position (i.e. the heap key) of the task in the
+                queue.
+
+        Returns:
+            The group of tasks, led by the given task.
+        """
+
+        raise NotImplementedError
+
+
+class NoGroupingPolicy(GroupingPolicy):
+    """Every task is scheduled alone."""
+
+    def group_tasks(
+        self, task: CompletionTask, queue_positions: Dict[int, Tuple[float, int]]
+    ) -> List[CompletionTask]:
+        return [task]
+
+
+class DefaultGroupingPolicy(GroupingPolicy):
+    """Group tasks by CompChainGroup (graph_group) or by the first SemanticVariable
+    (ctx_group), as configured."""
+
+    def __init__(self, scheduler: "GlobalScheduler"):
+        super().__init__(scheduler)
+
+        # Incremental indexes over the queued tasks, to avoid the O(n^2) pairwise scan when
+        # grouping tasks. Inner dicts map task_id -> task.
+
+        # CompChainGroup -> queued tasks whose chain belongs to the group.
+        self._chain_group_index: Dict[CompChainGroup, Dict[int, CompletionTask]] = {}
+        # SemanticVariable id of the first node -> queued tasks.
+        self._first_sv_index: Dict[str, Dict[int, CompletionTask]] = {}
+        # task_id -> number of chain groups already indexed.
+        # NOTE: chain.chain_groups is append-only, but it may grow after the task is
+        # queued (when a later request consumes the output of the chain). We index the new
+        # groups lazily before each scheduling round.
+        self._indexed_chain_groups_num: Dict[int, int] = {}
+
+    def on_schedule_begin(self, tasks: List[CompletionTask]) -> None:
+        for task in tasks:
+            self._update_chain_group_index(task)
+
+    def on_task_queued(self, task: CompletionTask) -> None:
+        sv_id = task.chain.first_node.var_id
+        if sv_id not in self._first_sv_index:
+            self._first_sv_index[sv_id] = {}
+        self._first_sv_index[sv_id][task.task_id] = task
+
+        self._indexed_chain_groups_num[task.task_id] = 0
+        self._update_chain_group_index(task)
+
+    def _update_chain_group_index(self, task: CompletionTask) -> None:
+        chain_groups = task.chain.chain_groups
+        indexed_num = self._indexed_chain_groups_num[task.task_id]
+        for chain_group in chain_groups[indexed_num:]:
+            if chain_group not in self._chain_group_index:
+                self._chain_group_index[chain_group] = {}
+            self._chain_group_index[chain_group][task.task_id] = task
+        self._indexed_chain_groups_num[task.task_id] = len(chain_groups)
+
+    def on_task_dequeued(self, task: CompletionTask) -> None:
+        sv_id = task.chain.first_node.var_id
+        sv_tasks = self._first_sv_index[sv_id]
+        sv_tasks.pop(task.task_id)
+        if len(sv_tasks) == 0:
+            self._first_sv_index.pop(sv_id)
+
+        indexed_num = self._indexed_chain_groups_num.pop(task.task_id)
+        for chain_group in task.chain.chain_groups[:indexed_num]:
+            group_tasks = self._chain_group_index[chain_group]
+            group_tasks.pop(task.task_id, None)
+            if len(group_tasks) == 0:
+                self._chain_group_index.pop(chain_group)
+
+    def group_tasks(
+        self, task: CompletionTask, queue_positions: Dict[int, Tuple[float, int]]
+    ) -> List[CompletionTask]:
+        """Group the task with the unscheduled tasks behind it in the queue.
+
+        Only tasks sharing a CompChainGroup or the first SemanticVariable with the task
+        can be grouped with it, so we only check these candidates (found by the indexes)
+        instead of the whole rest queue. The candidates are checked in the queue order.
+
+        Args:
+            task: The leading task of the group.
+            queue_positions: task_id -> position (i.e. the heap key) of the task in the
+                queue.
+
+        Returns:
+            The group of tasks, led by the given task.
+        """
+
+        cur_group: List[CompletionTask] = [task]
+
+        # Only allow one type of grouping at a time
+        graph_group_enabled = self.config.graph_group
+        ctx_group_enabled = self.config.ctx_group
+
+        if not graph_group_enabled and not ctx_group_enabled:
+            return cur_group
+
+        chain_groups = set(task.chain.chain_groups)
+        first_sv_id = task.chain.first_node.var_id
+
+        candidates: Dict[int, CompletionTask] = {}
+        if graph_group_enabled:
+            for chain_group in chain_groups:
+                candidates.update(self._chain_group_index.get(chain_group, {}))
+        if ctx_group_enabled:
+            candidates.update(self._first_sv_index.get(first_sv_id, {}))
+
+        task_pos = queue_positions[task.task_id]
+        sorted_candidates = sorted(
+            [
+                task_j
+                for task_j in candidates.values()
+                if queue_positions[task_j.task_id] > task_pos
+                and not task_j.is_scheduled
+            ],
+            key=lambda x: queue_positions[x.task_id],
+        )
+
+        for task_j in sorted_candidates:
+            # TODO(chaofan): Models match check
+            # TODO(chaofan): Criteria match check. Only group tasks with the same criteria.
+
+            # Graph group check
+            if graph_group_enabled:
+                common_groups = chain_groups.intersection(task_j.chain.chain_groups)
+                if len(common_groups) > 0:
+                    cur_group.append(task_j)
+                    chain_groups = common_groups
+                    ctx_group_enabled = False  # Use graph group this round
+
+            # Context group check
+            if ctx_group_enabled:
+                if first_sv_id == task_j.chain.first_node.var_id:
+                    cur_group.append(task_j)
+                    graph_group_enabled = False  # Use context group this round
+
+        return cur_group
+
+
+# ---------- Placement ----------
+
+
+class PlacementPolicy(SchedulerPolicy):
+    def select_engine(
+        self, tasks: List[CompletionTask], engine_list: List[ExecutionEngine]
+    ) -> ExecutionEngine:
+        """Select the engine for a group of tasks.
+
+        Args:
+            tasks: The group of tasks.
+            engine_list: Engines that can hold the tasks. Not empty.
+        """
+
+        raise NotImplementedError
+
+    def _get_engine_ids_with_prefixes(self, tasks: List[CompletionTask]):
+        # We use the first task's context to find the engines with the same context
+        return self.scheduler.context_mgr.query_prefixes_in_engines(tasks[0])
+
+
+class DefaultPlacementPolicy(PlacementPolicy):
+    """Prefer engines with the context (ctx_aware). Then rank the engines by the
+    engine_scoring, or minimize the decrease of the tasks_num_upperbound by default."""
+
+    def select_engine(
+        self, tasks: List[CompletionTask], engine_list: List[ExecutionEngine]
+    ) -> ExecutionEngine:
+        # Get the engines with Context
+        if self.config.ctx_aware:
+            engine_ids_with_prefixes = self._get_engine_ids_with_prefixes(tasks)
+
+        if self.config.engine_scoring != "default":
+            scorer = get_engine_scorer(self.config.engine_scoring)
+
+            def engine_key(engine: ExecutionEngine):
+                # Context-aware engines are preferred.
+                no_prefix = (
+                    self.config.ctx_aware
+                    and engine.engine_id not in engine_ids_with_prefixes
+                )
+                return (no_prefix, scorer(engine, tasks))
+
+            return min(engine_list, key=engine_key)
+
+        best_engine = None
+        for engine in engine_list:
+            if best_engine is None:
+                best_engine = engine
+            elif (
+                self.config.ctx_aware
+                and engine.engine_id in engine_ids_with_prefixes
+                and best_engine.engine_id not in engine_ids_with_prefixes
+            ):
+                # Context-aware engine is preferred
+                best_engine = engine
+            else:
+                # Select the best engine (minimizing the negative impacts, i.e. minimizing the decreasing of upperbound)
+                # If the upperbound is not affected, select the engine with the most capacity.
+                if (
+                    engine.get_tasks_num_upperbound()
+                    < best_engine.get_tasks_num_upperbound()
+                ):
+                    best_engine = engine
+                elif (
+                    engine.get_remain_tokens_capacity()
+                    < best_engine.get_remain_tokens_capacity()
+                ):
+                    best_engine = engine
+
+        return best_engine
+
+
+class LeastTasksPlacementPolicy(PlacementPolicy):
+    """Spread tasks: Select the engine with the fewest tasks. Engines with the context are
+    preferred if ctx_aware is enabled."""
+
+    def select_engine(
+        self, tasks: List[CompletionTask], engine_list: List[ExecutionEngine]
+    ) -> ExecutionEngine:
+        engine_ids_with_prefixes = set()
+        if self.config.ctx_aware:
+            engine_ids_with_prefixes = self._get_engine_ids_with_prefixes(tasks)
+
+        return min(
+            engine_list,
+            key=lambda engine: (
+                engine.engine_id not in engine_ids_with_prefixes,
+                engine.get_num_tasks(),
+            ),
+        )
+
+
+# ---------- Registries ----------
+
+ORDERING_POLICIES: Dict[str, Type[OrderingPolicy]] = {
+    "edf": EDFOrderingPolicy,
+    "fifo": FIFOOrderingPolicy,
+}
+
+GROUPING_POLICIES: Dict[str, Type[GroupingPolicy]] = {
+    "default": DefaultGroupingPolicy,
+    "none": NoGroupingPolicy,
+}
+
+PLACEMENT_POLICIES: Dict[str, Type[PlacementPolicy]] = {
+    "default": DefaultPlacementPolicy,
+    "least_tasks": LeastTasksPlacementPolicy,
+}
+
+
+def create_policy(
+    registry: Dict[str, Type[SchedulerPolicy]], name: str, scheduler: "GlobalScheduler"
+) -> SchedulerPolicy:
+    parrot_assert(name in registry, f"Unknown scheduler policy: {name}")
+    return registry[name](scheduler)
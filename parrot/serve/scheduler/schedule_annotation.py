@@ -5,6 +5,8 @@
 
 from dataclasses import dataclass
 
+from parrot.constants import JOB_PRIORITY_NORMAL
+
 
 @dataclass
 class ScheduleAnnotation:
@@ -18,5 +20,10 @@ class ScheduleAnnotation:
     # with more than this number of tokens.
     tokens_num_upperbound: int = 2048
 
-    # Unimplemented
+    # Deadline requirement of the task, in seconds after the task is created. For TTFT,
+    # it's the deadline of the first token. Otherwise, it's the deadline of the whole task.
+    # Non-positive means no deadline.
     ddl_requirement: float = 0.0
+
+    # Priority of the task's jobs in the engine. See JOB_PRIORITY_* in constants.
+    engine_priority: int = JOB_PRIORITY_NORMAL
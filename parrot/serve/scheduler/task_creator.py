@@ -6,6 +6,7 @@ from typing import Dict
 
 from parrot.exceptions import parrot_assert
 from parrot.utils import get_logger, RecyclePool
+from parrot.constants import JOB_PRIORITY_PACED, JOB_PRIORITY_FIRST_TOKEN
 
 from parrot.serve.graph import CompletionChain, PerformanceCriteria
 
@@ -19,10 +20,15 @@ logger = get_logger("TaskCreator")
 class TaskCreator:
     """TaskCreator creates a CompletionTask object for the CompletionChain."""
 
+    # Default service level objectives (in seconds) of TTFT/TPOT criteria.
+    _TTFT_SLO = 1.0
+    _TPOT_SLO = 0.1
+
     def __init__(self) -> None:
         self._task_id_pool = RecyclePool("TaskIDPool", debug_mode=True)
 
-    def _lower_criteria(self, criteria: PerformanceCriteria) -> ScheduleAnnotation:
+    def _lower_criteria(self, completion_chain: CompletionChain) -> ScheduleAnnotation:
+        criteria = completion_chain.criteria
         if criteria == PerformanceCriteria.LATENCY:
             return ScheduleAnnotation(
                 tasks_num_upperbound=4,
@@ -33,6 +39,25 @@ class TaskCreator:
                 tasks_num_upperbound=99999,
                 tokens_num_upperbound=9999999999999,
             )
+        elif criteria == PerformanceCriteria.TTFT:
+            # Dispatch it as soon as possible and let its Fill/first Generate jump the
+            # queue in the engine. The decoding afterwards can be batched freely.
+            return ScheduleAnnotation(
+                tasks_num_upperbound=99999,
+                tokens_num_upperbound=9999999999999,
+                ddl_requirement=self._TTFT_SLO,
+                engine_priority=JOB_PRIORITY_FIRST_TOKEN,
+            )
+        elif criteria == PerformanceCriteria.TPOT:
+            # The iteration latency grows with the batch size, so limit the number of tasks
+            # in the engine. Its jobs are preempted last to keep the pace.
+            max_gen_length = completion_chain.gen_node.sampling_config.max_gen_length
+            return ScheduleAnnotation(
+                tasks_num_upperbound=32,
+                tokens_num_upperbound=9999999999999,
+                ddl_requirement=self._TPOT_SLO * max_gen_length,
+                engine_priority=JOB_PRIORITY_PACED,
+            )
         else:
             raise NotImplementedError(
                 f"PerformanceCriteria {criteria} is not supported."
@@ -52,7 +77,7 @@ class TaskCreator:
 
         # Create a new Task
         task_id = self._task_id_pool.allocate()
-        schedule_annotation = self._lower_criteria(completion_chain.criteria)
+        schedule_annotation = self._lower_criteria(completion_chain)
 
         logger.debug(
             f"Create Task(task_id={task_id}) for CompletionChain(request_id={completion_chain.request_id},"
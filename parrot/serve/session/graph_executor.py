@@ -1,10 +1,17 @@
 # Copyright (c) 2023 by Microsoft Corporation.
 # Licensed under the MIT license.
 
-from typing import Optional, Dict
+from typing import Optional, Dict, Union
+import asyncio
 
-from parrot.utils import get_logger, create_task_in_loop
-from parrot.exceptions import parrot_assert
+import aiohttp
+
+from parrot.utils import (
+    get_logger,
+    create_task_in_loop,
+    time_counter_in_nanoseconds,
+)
+from parrot.exceptions import parrot_assert, ParrotCoreInternalError
 from parrot.protocol.internal.primitive_request import Primitive, Fill, Generate
 from parrot.protocol.internal.layer_apis import FillResponse, GenerateResponse
 
@@ -12,6 +19,7 @@ from parrot.serve.graph import (
     ComputeGraph,
     RequestChain,
     CompletionChain,
+    finish_completion_chain,
 )
 from parrot.serve.scheduler import (
     CompletionTask,
@@ -19,7 +27,8 @@ from parrot.serve.scheduler import (
     GlobalScheduler,
     TaskStatus,
 )
-from parrot.serve.backend_repr import ModelType
+from parrot.serve.backend_repr import ModelType, ExecutionEngine
+from parrot.serve.backend_repr.model import get_model_type
 
 from ..context_manager import ServeCoreContextManager
 from ..engine_manager import EngineManager
@@ -43,6 +52,9 @@ class GraphExecutor:
         engine_mgr: EngineManager,
         context_mgr: ServeCoreContextManager,
         tokenizers_wrapper: TokenizersWrapper,
+        eager_tokenization: bool = True,
+        task_max_retries: int = 2,
+        task_retry_timeout: float = 60.0,
     ):
         # ---------- Basic Info ----------
         self.session_id = session_id
@@ -55,12 +67,97 @@ class GraphExecutor:
         self.context_mgr = context_mgr
         self.tokenizers_wrapper = tokenizers_wrapper
 
+        # ---------- Config ----------
+        # Whether generated contents are tokenized in the background once they are set.
+        self.eager_tokenization = eager_tokenization
+        # How many times a task is rescheduled when its engine fails, and the time
+        # window (in seconds, since the first failure) in which it's rescheduled.
+        self.task_max_retries = task_max_retries
+        self.task_retry_timeout = task_retry_timeout
+
         # ---------- Runtime ----------
         self.bad_exception: Optional[Exception] = None
 
+    async def _schedule_task(self, task: CompletionTask) -> None:
+        """Submit the task to the scheduler and wait for the task to be scheduled."""
+
+        # Count the tokens of the task for the tokenizers of the candidate engines, off
+        # the event loop. The scheduler never tokenizes.
+        metadata = task.chain.metadata
+        await task.acompute_token_nums(
+            self.tokenizers_wrapper,
+            self.engine_mgr.get_live_tokenizer_names_by_model(
+                get_model_type(metadata.model_type), metadata.models
+            ),
+        )
+
+        self.scheduler.submit_task(task)
+        await task.wait_scheduled()
+
+        # Materialize the token ids for the tokenizer of the scheduled engine.
+        if task.engine.model_type == ModelType.TOKEN_ID:
+            await task.atokenize_chain(
+                self.tokenizers_wrapper, [task.engine.tokenizer_name]
+            )
+
+    def _get_retry_time_left(self, task: CompletionTask) -> float:
+        """Time (in seconds) left in the retry window of a failed task."""
+
+        elapsed = time_counter_in_nanoseconds() - task.first_failure_time
+        return self.task_retry_timeout - elapsed / 1_000_000_000
+
+    def _can_retry(self, task: CompletionTask) -> bool:
+        """Whether a failed task can be rescheduled."""
+
+        # NOTE: Only failures of the engine (i.e. it stops running) are recovered by
+        # rescheduling. If the engine is still running, the task itself is at fault.
+        if task.engine is not None and task.engine.is_running:
+            return False
+        if task.num_retries >= self.task_max_retries:
+            return False
+        return self._get_retry_time_left(task) >= 0
+
+    @staticmethod
+    def _is_engine_unreachable(exception: Exception) -> bool:
+        return isinstance(
+            exception, (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        )
+
+    @staticmethod
+    async def _post_primitive(
+        primitive: Union[Fill, Generate],
+        engine: ExecutionEngine,
+        client_session: aiohttp.ClientSession,
+    ) -> Union[FillResponse, GenerateResponse]:
+        """Post the primitive to the engine.
+
+        The request is cancelled once the engine stops running (e.g. its heartbeats
+        expire), instead of hanging until the HTTP timeout.
+        """
+
+        post = asyncio.ensure_future(
+            primitive.apost(engine.http_address, client_session)
+        )
+        stopped = asyncio.ensure_future(engine.wait_stopped())
+        try:
+            await asyncio.wait([post, stopped], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopped.cancel()
+
+        if not post.done():
+            post.cancel()
+            raise ParrotCoreInternalError(
+                RuntimeError(
+                    f"Engine (engine_id={engine.engine_id}) stopped running before "
+                    "the primitive finished."
+                )
+            )
+        return post.result()
+
     async def _execute_coroutine(self, completion_chain: CompletionChain) -> None:
         """Coroutine for executing a CompletionChain."""
 
+        task: Optional[CompletionTask] = None
         try:
             # Block until it's activated by a GET.
             await completion_chain.wait_activated()
@@ -72,30 +169,80 @@ class GraphExecutor:
             for node in completion_chain.iter_fill():
                 await node.wait_ready()
 
-            # Tokenize the task.
-            task.tokenize_chain(self.tokenizers_wrapper)
-
             # Submit the task to the scheduler and wait for the task to be scheduled.
-            self.scheduler.submit_task(task)
-            await task.wait_scheduled()
+            await self._schedule_task(task)
         except Exception as e:
             logger.error(
                 f"Error when scheduling chain. (session_id={self.session_id}): {e}"
             )
             self.exception_interrupt(e)
+            if task is not None:
+                self.task_creator.free_task(task)
             return
 
-        # The task is scheduled. Assign contexts to the task.
-        self.context_mgr.set_task_contexts(task)
+        while True:
+            # The task is scheduled. Assign contexts to the task.
+            self.context_mgr.set_task_contexts(task)
+
+            # Execute the task.
+            await self.execute(task)
+            if task.status == TaskStatus.FINISHED:
+                finish_completion_chain(completion_chain)
+                break
+
+            if not self._can_retry(task):
+                self.exception_interrupt(task.exception)
+                break
+
+            # NOTE: The engine of the task failed. The task is rescheduled
+            # (with the same task id) to a healthy engine, and all its nodes are executed
+            # again in fresh contexts there.
+            logger.warning(
+                f"Task (task_id={task.task_id}, session_id={self.session_id}) failed "
+                f"in Engine (engine_id={task.engine.engine_id}). Rescheduling it "
+                f"(retry {task.num_retries + 1}/{self.task_max_retries})."
+            )
+            self.context_mgr.free_task_contexts(task)
+            task.leave_scheduled()
+            task.reset_schedule()
+            self.scheduler.wakeup()
 
-        # Execute the task.
-        await self.execute(task)
+            # The task must be rescheduled in the rest of the retry window.
+            try:
+                await asyncio.wait_for(
+                    self._schedule_task(task),
+                    timeout=max(self._get_retry_time_left(task), 0),
+                )
+            except asyncio.TimeoutError:
+                self.scheduler.remove_task(task)
+                logger.error(
+                    f"Task (task_id={task.task_id}, session_id={self.session_id}) is "
+                    f"not rescheduled in the retry window ({self.task_retry_timeout}s)."
+                )
+                self.exception_interrupt(
+                    ParrotCoreInternalError(
+                        RuntimeError(
+                            f"Task (task_id={task.task_id}) is not rescheduled in "
+                            f"{self.task_retry_timeout}s after its engine failed."
+                        )
+                    )
+                )
+                break
+            except Exception as e:
+                logger.error(
+                    f"Error when rescheduling task. (session_id={self.session_id}): {e}"
+                )
+                self.exception_interrupt(e)
+                break
 
         # Free the task resources.
         # TODO(chaofan): Current implementation has BUGS in stateful generation cases.
         self.task_creator.free_task(task)
         self.context_mgr.free_task_contexts(task)
 
+        # The engine capacity is released. Queued tasks may be schedulable now.
+        self.scheduler.wakeup()
+
     def exception_interrupt(self, exception: BaseException):
         self.bad_exception = exception
 
@@ -121,11 +268,13 @@ class GraphExecutor:
         completion_task.status = TaskStatus.EXECUTING
 
         type_token_id_flag = completion_task.engine.model_type == ModelType.TOKEN_ID
+        engine_priority = completion_task.schedule_annotation.engine_priority
         if type_token_id_flag:
+            tokenizer_name = completion_task.engine.tokenizer_name
             parrot_assert(
-                completion_task.is_tokenized, "Tokenized result is not available."
+                completion_task.is_tokenized_by(tokenizer_name),
+                "Tokenized result is not available.",
             )
-            tokenizer_name = completion_task.engine.tokenizer_name
             eos_token_id = self.tokenizers_wrapper.get_tokenizer(
                 tokenizer_name
             ).eos_token_id
@@ -133,25 +282,47 @@ class GraphExecutor:
         for i, node in enumerate(completion_task.chain.iter()):
             context = completion_task.contexts[i]
             engine = context.engine
-
-            # Skip the node if the context is ready.
-            if context.ready_event.is_set():
-                continue
+            client_session = self.engine_mgr.get_client_session(engine)
 
             # Wait for the context to be ready if the Context is started.
             if context.start_event.is_set():
                 await context.ready_event.wait()
+
+            # Skip the node if the context is ready.
+            if context.ready_event.is_set():
+                if context.failed:
+                    completion_task.fail(
+                        ParrotCoreInternalError(
+                            RuntimeError(
+                                f"Context (context_id={context.context_id}) failed to "
+                                f"be filled in Engine (engine_id={engine.engine_id})."
+                            )
+                        )
+                    )
+                    break
                 continue
 
             # Set the start event to indicate the context is started.
             context.start_event.set()
 
             try:
+                # Don't send primitives to an engine which is known to be dead.
+                if not engine.is_running:
+                    raise ParrotCoreInternalError(
+                        RuntimeError(
+                            f"Engine (engine_id={engine.engine_id}) is not running."
+                        )
+                    )
+
                 if node.is_gen:
                     # TODO(chaofan): Add streaming generation support.
                     if type_token_id_flag:
                         # If not ignore_tokenizer_eos, we should add eos_token_id to stop_token_ids
-                        if not node.sampling_config.ignore_tokenizer_eos:
+                        # NOTE: Check it first, since the task may be retried.
+                        if (
+                            not node.sampling_config.ignore_tokenizer_eos
+                            and eos_token_id not in node.sampling_config.stop_token_ids
+                        ):
                             node.sampling_config.stop_token_ids.append(eos_token_id)
 
                     primitive = Generate(
@@ -161,6 +332,7 @@ class GraphExecutor:
                         parent_context_id=context.parent_context_id,
                         end_flag=False,
                         sampling_config=node.sampling_config,
+                        priority=engine_priority,
                     )
 
                     logger.debug(
@@ -168,7 +340,9 @@ class GraphExecutor:
                         f"submit Generate primitive. (sampling_config={node.sampling_config})"
                     )
 
-                    resp = await primitive.apost(engine.http_address)
+                    resp = await self._post_primitive(
+                        primitive, engine, client_session
+                    )
 
                     if type_token_id_flag:
                         generated_ids = resp.generated_ids
@@ -177,9 +351,11 @@ class GraphExecutor:
                             f"receive Generate primitive's result. (generated_tokens_num={len(generated_ids)})"
                         )
 
-                        generated_text = self.tokenizers_wrapper.detokenize(
-                            token_ids=generated_ids,
-                            tokenizer_name=tokenizer_name,
+                        generated_text = (
+                            await self.tokenizers_wrapper.adetokenize(
+                                token_ids=generated_ids,
+                                tokenizer_name=tokenizer_name,
+                            )
                         )
                     else:
                         generated_text = resp.generated_text
@@ -190,7 +366,18 @@ class GraphExecutor:
                         )
 
                     # Set the content of the node.
-                    node.sv.set(content=generated_text)
+                    if self.eager_tokenization:
+                        node.sv.set(
+                            content=generated_text,
+                            tokenizers_wrapper=self.tokenizers_wrapper,
+                            tokenizer_names=(
+                                self.engine_mgr.get_live_tokenizer_names_by_consumers(
+                                    node.sv
+                                )
+                            ),
+                        )
+                    else:
+                        node.sv.set(content=generated_text)
                 else:
                     if type_token_id_flag:
                         token_ids = completion_task.tokenized_result[tokenizer_name][
@@ -217,12 +404,15 @@ class GraphExecutor:
                             parent_context_id=context.parent_context_id,
                             end_flag=False,
                             token_ids=token_ids,
+                            priority=engine_priority,
                         )
                         logger.debug(
                             f"Task (task_id={completion_task.task_id}, session_id={self.session_id}) "
                             f"submit Fill primitive. (tokens_num={len(token_ids)})"
                         )
-                        resp = await primitive.apost(engine.http_address)
+                        resp = await self._post_primitive(
+                            primitive, engine, client_session
+                        )
                     else:
                         text = node.get()
                         primitive = Fill(
@@ -232,12 +422,15 @@ class GraphExecutor:
                             parent_context_id=context.parent_context_id,
                             end_flag=False,
                             text=text,
+                            priority=engine_priority,
                         )
                         logger.debug(
                             f"Task (task={completion_task.task_id}, session_id={self.session_id}) "
                             f"submit Fill primitive. (text_len={len(text)})"
                         )
-                        resp = await primitive.apost(engine.http_address)
+                        resp = await self._post_primitive(
+                            primitive, engine, client_session
+                        )
 
                 context.ready_event.set()
                 logger.debug(f"Context (context_id={context.context_id}) is ready.")
@@ -247,7 +440,15 @@ class GraphExecutor:
                 logger.error(
                     f"Error when executing node {node}. (session_id={self.session_id}): {e}"
                 )
-                self.engine_mgr.raise_exception(engine_id=engine.engine_id, exception=e)
-                self.exception_interrupt(e)
-                completion_task.status = TaskStatus.ERROR
+                # NOTE: Only an unreachable engine is marked bad, so its tasks fail over
+                # to other engines. Other errors only fail the task.
+                if engine.is_running and self._is_engine_unreachable(e):
+                    self.engine_mgr.raise_exception(
+                        engine_id=engine.engine_id, exception=e
+                    )
+
+                # Wake up the tasks waiting for the context, and stop reusing it.
+                self.context_mgr.fail_context(context)
+
+                completion_task.fail(e)
                 break
@@ -16,6 +16,7 @@ from parrot.serve.graph import (
     get_performance_criteria,
     activate_completion_chain,
 )
+from parrot.serve.graph.request import TextChunk
 
 from parrot.serve.backend_repr import Context
 from parrot.serve.scheduler import TaskCreator, GlobalScheduler
@@ -56,6 +57,9 @@ class Session:
         engine_mgr: EngineManager,
         context_mgr: ServeCoreContextManager,
         tokenizers_wrapper: TokenizersWrapper,
+        eager_tokenization: bool = True,
+        task_max_retries: int = 2,
+        task_retry_timeout: float = 60.0,
     ):
         # ---------- Basic Info ----------
         self.session_id = session_id
@@ -74,6 +78,9 @@ class Session:
             engine_mgr=engine_mgr,
             context_mgr=context_mgr,
             tokenizers_wrapper=tokenizers_wrapper,
+            eager_tokenization=eager_tokenization,
+            task_max_retries=task_max_retries,
+            task_retry_timeout=task_retry_timeout,
         )
 
         # ---------- Runtime Status ----------
@@ -88,6 +95,32 @@ class Session:
 
     # ---------- Internal methods ----------
 
+    def _match_and_split_prefix(
+        self, chunked_request: ChunkedSemanticCallRequest
+    ) -> None:
+        """Split the leading TextChunk at the boundary of the global prefix it matches.
+
+        The shared part becomes a standalone constant prefix, so requests whose prompts only
+        differ in the suffix can share the contexts of the common part.
+        """
+
+        if len(chunked_request.body) == 0 or not isinstance(
+            chunked_request.body[0], TextChunk
+        ):
+            return
+
+        prefix_text = chunked_request.body[0].text
+        self.prefix_matcher.add_prefix(prefix_text)
+        split_pos = self.prefix_matcher.query_prefix(prefix_text)
+
+        # NOTE: If the whole text chunk is the global prefix, no need to split.
+        if 0 < split_pos < len(prefix_text):
+            chunked_request.split_prefix_chunk(split_pos)
+            logger.debug(
+                f"Request(request_id={chunked_request.request_id}) prefix split at "
+                f"position {split_pos}."
+            )
+
     # ---------- Status Methods ----------
 
     @property
@@ -119,6 +152,8 @@ class Session:
         )
 
         # Prefix matching and splitting.
+        if chunked_request.metadata.prefix_match:
+            self._match_and_split_prefix(chunked_request)
 
         # Convert the ChunkedRequest to a RequestChain.
         request_chain = RequestChain.from_chunked_request(chunked_request)
@@ -35,24 +35,34 @@ class SessionManager:
 
         # ---------- Arguments for Creating Session ----------
         self._session_create_kwargs = session_create_kwargs
+        self._scheduler: GlobalScheduler = session_create_kwargs["scheduler"]
 
     def _remove_session(self, session_id: int) -> None:
         session = self.sessions.pop(session_id)
         self._session_last_access_time.pop(session_id)
         session.free_session_resources()
+        self._scheduler.remove_session(session_id)
         self._session_id_pool.free(session_id)
 
         logger.debug(f"Session (session_id={session_id}) is removed.")
 
     # ---------- Methods for Core ----------
 
-    def register_session(self) -> int:
+    def register_session(self, weight: float = 1.0) -> int:
         """Create a new session.
 
+        Args:
+            weight: float. The weight of the session in fair sharing.
+
         Returns:
             int: The session ID.
         """
 
+        if weight <= 0:
+            raise ParrotCoreUserError(
+                ValueError(f"Session weight must be positive, got {weight}.")
+            )
+
         # Create session object
         session_id = self._session_id_pool.allocate()
         session = Session(session_id=session_id, **self._session_create_kwargs)
@@ -60,6 +70,7 @@ class SessionManager:
         # Maintain session info
         self.sessions[session_id] = session
         self._session_last_access_time[session_id] = time_counter_in_nanoseconds()
+        self._scheduler.register_session(session_id, weight)
 
         logger.debug(f"Session (session_id={session_id}) registered.")
         return session_id
@@ -2,7 +2,10 @@
 # Licensed under the MIT license.
 
 
-from typing import Dict, List, Union
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 from transformers import AutoTokenizer, PreTrainedTokenizer, PreTrainedTokenizerFast
 
 from parrot.exceptions import parrot_assert
@@ -11,17 +14,157 @@ from parrot.exceptions import parrot_assert
 HFTokenizer = Union[PreTrainedTokenizer, PreTrainedTokenizerFast]
 
 
+# NOTE(chaofan): Ignore special tokens because we chunk the inputs.
+
+
+def _encode(tokenizer: HFTokenizer, text: str) -> List[int]:
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+def _decode(tokenizer: HFTokenizer, token_ids: List[int]) -> str:
+    return tokenizer.decode(
+        token_ids,
+        skip_special_tokens=True,
+        spaces_between_special_tokens=False,
+        clean_up_tokenization_spaces=False,
+    )
+
+
+# Tokenizers loaded in a worker process. Tokenizer name -> tokenizer.
+_worker_tokenizers: Dict[str, HFTokenizer] = {}
+
+
+def _get_worker_tokenizer(tokenizer_name: str) -> HFTokenizer:
+    if tokenizer_name not in _worker_tokenizers:
+        _worker_tokenizers[tokenizer_name] = AutoTokenizer.from_pretrained(
+            tokenizer_name
+        )
+    return _worker_tokenizers[tokenizer_name]
+
+
+def _encode_in_worker(tokenizer_name: str, text: str) -> List[int]:
+    return _encode(_get_worker_tokenizer(tokenizer_name), text)
+
+
+def _decode_in_worker(tokenizer_name: str, token_ids: List[int]) -> str:
+    return _decode(_get_worker_tokenizer(tokenizer_name), token_ids)
+
+
+class TokenizationCache:
+    """LRU cache of tokenized results of a tokenizer, under a memory budget.
+
+    The key is the id of a SemanticVariable. Constant SVs are content-hashed, so the same
+    prompt (e.g. a shared system prompt) in different requests hits the same entry.
+
+    NOTE: SV ids can be recycled, so an entry also keeps the text and is only hit
+    when the text matches.
+    """
+
+    # Estimated memory of a token id in a Python list (pointer + int object), in bytes.
+    _BYTES_PER_TOKEN_ID = 36
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+
+        # key -> (text, token_ids)
+        self._entries: OrderedDict[str, Tuple[str, List[int]]] = OrderedDict()
+        self._memory_usage = 0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_size(self, text: str, token_ids: List[int]) -> int:
+        return len(text) + len(token_ids) * self._BYTES_PER_TOKEN_ID
+
+    @property
+    def memory_usage(self) -> int:
+        return self._memory_usage
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, text: str) -> Optional[List[int]]:
+        """Get the cached token ids. None if not cached."""
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != text:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, text: str, token_ids: List[int]) -> None:
+        """Cache the token ids, evicting the least recently used entries if necessary."""
+
+        size = self._entry_size(text, token_ids)
+        if size > self.memory_budget:
+            return
+
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self._memory_usage -= self._entry_size(*old_entry)
+
+        self._entries[key] = (text, token_ids)
+        self._memory_usage += size
+
+        while self._memory_usage > self.memory_budget:
+            _, evicted_entry = self._entries.popitem(last=False)
+            self._memory_usage -= self._entry_size(*evicted_entry)
+
+
 class TokenizersWrapper:
     """TokenizersWrapper wraps a unified interface to tokenize/detokenize text.
 
     Different engines in OS may use different tokenizers, which are stored as a
     dictionary in this manager.
+
+    Each tokenizer has a TokenizationCache, so texts with a cache key (i.e. the SV id) are
+    only tokenized once.
+
+    The async APIs (atokenize, adetokenize, ...) run large inputs in an executor, so they don't
+    block the event loop:
+    - "thread": A thread pool. Fast tokenizers release the GIL, so threads run in parallel.
+    - "process": A process pool. Each worker process loads its own tokenizers.
+    - "none": Run in the event loop.
     """
 
-    def __init__(self):
+    _DEFAULT_CACHE_BUDGET = 256 * 1024 * 1024
+
+    # Inputs shorter than this (in chars / token ids) are processed in the event loop
+    # directly, because the overhead of the executor is larger than the work.
+    _OFFLOAD_MIN_TEXT_LEN = 2048
+    _OFFLOAD_MIN_TOKENS_NUM = 512
+
+    def __init__(
+        self,
+        cache_budget: int = _DEFAULT_CACHE_BUDGET,
+        executor_type: str = "thread",
+        num_workers: int = 4,
+    ):
         # Map from tokenizer name to tokenizer object
         self.tokenizers: Dict[str, HFTokenizer] = {}
 
+        # Map from tokenizer name to its tokenization cache
+        self.cache_budget = cache_budget
+        self.caches: Dict[str, TokenizationCache] = {}
+
+        parrot_assert(
+            executor_type in ["thread", "process", "none"],
+            f"Unknown tokenizer executor type: {executor_type}",
+        )
+        self.executor_type = executor_type
+        self.num_workers = num_workers
+        self._executor: Optional[Executor] = None  # Created lazily.
+
+        # (tokenizer_name, cache_key) -> in-flight tokenization, so concurrent requests of the
+        # same SV are tokenized once.
+        self._pending_tokenizations: Dict[
+            Tuple[str, str], Tuple[str, asyncio.Future]
+        ] = {}
+
     def register_tokenizer(self, tokenizer_name: str):
         """Register a new tokenizer in the server."""
 
@@ -29,6 +172,7 @@ class TokenizersWrapper:
             self.tokenizers[tokenizer_name] = AutoTokenizer.from_pretrained(
                 tokenizer_name
             )
+            self.caches[tokenizer_name] = TokenizationCache(self.cache_budget)
 
     def remove_tokenizer(self, tokenizer_name: str):
         """Remove a tokenizer from the server."""
@@ -38,6 +182,7 @@ class TokenizersWrapper:
             f"Tokenizer {tokenizer_name} does not exist.",
         )
         self.tokenizers.pop(tokenizer_name)
+        self.caches.pop(tokenizer_name, None)
 
     def get_tokenizer(self, tokenizer_name: str):
         parrot_assert(
@@ -47,15 +192,32 @@ class TokenizersWrapper:
 
         return self.tokenizers[tokenizer_name]
 
-    # NOTE(chaofan): Ignore special tokens because we chunk the inputs.
+    def tokenize(
+        self, text: str, tokenizer_name: str, cache_key: Optional[str] = None
+    ) -> List[int]:
+        """Tokenize a text using a specific tokenizer.
 
-    def tokenize(self, text: str, tokenizer_name: str) -> List[int]:
-        """Tokenize a text using a specific tokenizer."""
+        Args:
+            text: str. The text to be tokenized.
+            tokenizer_name: str. The name of the tokenizer.
+            cache_key: Optional[str]. If given (e.g. the SV id), the result is cached.
+                NOTE: The cached list is shared. Don't modify it.
+        """
 
         tokenizer = self.get_tokenizer(tokenizer_name)
-        return tokenizer.encode(text, add_special_tokens=False)
+        if cache_key is None:
+            return _encode(tokenizer, text)
+
+        cache = self.caches[tokenizer_name]
+        token_ids = cache.get(cache_key, text)
+        if token_ids is None:
+            token_ids = _encode(tokenizer, text)
+            cache.put(cache_key, text, token_ids)
+        return token_ids
 
-    def tokenize_all(self, text: str) -> Dict[str, List[int]]:
+    def tokenize_all(
+        self, text: str, cache_key: Optional[str] = None
+    ) -> Dict[str, List[int]]:
         """Tokenize a text using all tokenizers.
 
         Returns:
@@ -64,18 +226,125 @@ class TokenizersWrapper:
 
         result = {}
         for tokenizer_name in self.tokenizers:
-            result[tokenizer_name] = self.tokenize(text, tokenizer_name)
+            result[tokenizer_name] = self.tokenize(text, tokenizer_name, cache_key)
         return result
 
+    def get_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the statistics (hits, misses, memory usage) of the tokenization caches."""
+
+        return {
+            tokenizer_name: {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "entries_num": len(cache),
+                "memory_usage": cache.memory_usage,
+            }
+            for tokenizer_name, cache in self.caches.items()
+        }
+
     def detokenize(
         self,
         token_ids: List[int],
         tokenizer_name: str,
     ) -> str:
         tokenizer = self.get_tokenizer(tokenizer_name)
-        return tokenizer.decode(
-            token_ids,
-            skip_special_tokens=True,
-            spaces_between_special_tokens=False,
-            clean_up_tokenization_spaces=False,
+        return _decode(tokenizer, token_ids)
+
+    # ---------- Async APIs ----------
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == "thread":
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.num_workers, thread_name_prefix="Tokenizer"
+                )
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        return self._executor
+
+    async def _run_in_executor(self, func, tokenizer_name: str, data):
+        loop = asyncio.get_running_loop()
+        if self.executor_type == "process":
+            worker_func = _encode_in_worker if func is _encode else _decode_in_worker
+            return await loop.run_in_executor(
+                self._get_executor(), worker_func, tokenizer_name, data
+            )
+        return await loop.run_in_executor(
+            self._get_executor(), func, self.get_tokenizer(tokenizer_name), data
         )
+
+    async def atokenize(
+        self, text: str, tokenizer_name: str, cache_key: Optional[str] = None
+    ) -> List[int]:
+        """Async version of tokenize. Large texts are tokenized in the executor."""
+
+        if self.executor_type == "none" or len(text) < self._OFFLOAD_MIN_TEXT_LEN:
+            return self.tokenize(text, tokenizer_name, cache_key)
+
+        self.get_tokenizer(tokenizer_name)  # Check existence.
+        if cache_key is None:
+            return await self._run_in_executor(_encode, tokenizer_name, text)
+
+        cache = self.caches[tokenizer_name]
+        token_ids = cache.get(cache_key, text)
+        if token_ids is not None:
+            return token_ids
+
+        pending_key = (tokenizer_name, cache_key)
+        pending_text, pending = self._pending_tokenizations.get(
+            pending_key, (None, None)
+        )
+        # NOTE: The pending one may be for a different text with a recycled SV id.
+        if pending is not None and pending_text == text:
+            return await asyncio.shield(pending)
+
+        pending = asyncio.ensure_future(
+            self._run_in_executor(_encode, tokenizer_name, text)
+        )
+        self._pending_tokenizations[pending_key] = (text, pending)
+        try:
+            token_ids = await asyncio.shield(pending)
+        finally:
+            if self._pending_tokenizations.get(pending_key, (None, None))[1] is pending:
+                self._pending_tokenizations.pop(pending_key)
+
+        # NOTE: The cache is only accessed in the event loop thread.
+        cache.put(cache_key, text, token_ids)
+        return token_ids
+
+    async def atokenize_all(
+        self, text: str, cache_key: Optional[str] = None
+    ) -> Dict[str, List[int]]:
+        """Async version of tokenize_all. Tokenizers run concurrently."""
+
+        tokenizer_names = list(self.tokenizers.keys())
+        results = await asyncio.gather(
+            *[
+                self.atokenize(text, tokenizer_name, cache_key)
+                for tokenizer_name in tokenizer_names
+            ]
+        )
+        return dict(zip(tokenizer_names, results))
+
+    async def adetokenize(
+        self,
+        token_ids: List[int],
+        tokenizer_name: str,
+    ) -> str:
+        """Async version of detokenize. Long token ids are detokenized in the executor."""
+
+        if (
+            self.executor_type == "none"
+            or len(token_ids) < self._OFFLOAD_MIN_TOKENS_NUM
+        ):
+            return self.detokenize(token_ids, tokenizer_name)
+
+        self.get_tokenizer(tokenizer_name)  # Check existence.
+        return await self._run_in_executor(_decode, tokenizer_name, token_ids)
+
+    def shutdown(self) -> None:
+        """Shutdown the executor."""
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -191,6 +191,24 @@ async def free_context(request: Request):
     }
 
 
+@app.post("/free_contexts")
+async def free_contexts(request: Request):
+    global num_cached_tokens
+
+    payload = await request.json()
+
+    context_lens = []
+    for context_id in payload["context_ids"]:
+        context_len = context_len_map.pop(context_id, 0)
+        num_cached_tokens -= context_len
+        context_lens.append(context_len)
+
+    return {
+        "context_lens": context_lens,
+        "freed": [True] * len(context_lens),
+    }
+
+
 @app.post("/ping")
 async def ping(request: Request):
     global num_running_jobs
@@ -67,18 +67,18 @@ def fake_core_server():
     time.sleep(0.1)
 
 
-def _launch_fake_engine():
+def _launch_fake_engine(port: int):
     uvicorn.run(
         FakeEngineApp,
         host=DEFAULT_SERVER_HOST,
-        port=DEFAULT_ENGINE_SERVER_PORT,
+        port=port,
         log_level="info",
     )
 
 
 @contextlib.contextmanager
-def fake_engine_server():
-    p = StdProcess(target=_launch_fake_engine, daemon=True)
+def fake_engine_server(port: int = DEFAULT_ENGINE_SERVER_PORT):
+    p = StdProcess(target=_launch_fake_engine, args=(port,), daemon=True)
     p.start()
     time.sleep(0.1)
 
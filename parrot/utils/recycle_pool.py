@@ -2,7 +2,7 @@
 # Licensed under the MIT license.
 
 
-from typing import List, Optional
+from typing import Iterable, List, Optional
 from collections import deque
 
 from parrot.exceptions import ParrotError
@@ -27,33 +27,92 @@ class RecyclePool:
         self.history_max = 0
         self.debug_mode = debug_mode
 
+        # Bitmap of allocated ids (indexed by id), for O(1) double-free detection.
+        self._allocated_flags = bytearray()
+
+    def _check_capacity(self, num: int) -> None:
+        if self.pool_size is None:
+            return
+        num_new_ids = num if self.debug_mode else max(0, num - len(self.free_ids))
+        if self.cur_max_id + num_new_ids > self.pool_size:
+            raise ParrotError(
+                f"No free ids in Pool: {self.pool_name} (pool_size={self.pool_size})."
+            )
+
+    def _on_allocated(self, num: int) -> None:
+        self.allocated_num += num
+        self.history_max = max(self.history_max, self.allocated_num)
+
+    def _check_free(self, id: int) -> None:
+        if id < 0 or id >= self.cur_max_id or not self._allocated_flags[id]:
+            raise ValueError(f"The id {id} is already free.")
+
     def allocate(self) -> int:
         """Fetch an id."""
 
-        self.allocated_num += 1
+        self._check_capacity(1)
 
         if len(self.free_ids) == 0 or self.debug_mode:
+            allocated_id = self.cur_max_id
             self.cur_max_id += 1
-            if self.pool_size is not None and self.cur_max_id >= self.pool_size:
-                raise ParrotError(
-                    f"No free ids in Pool: {self.pool_name} (pool_size={self.pool_size})."
-                )
-            return self.cur_max_id - 1
-
-        allocated_id = self.free_ids.popleft()  # Pop from left
-        self.history_max = max(self.history_max, self.get_allocated_num())
+            self._allocated_flags.append(1)
+        else:
+            allocated_id = self.free_ids.popleft()  # Pop from left
+            self._allocated_flags[allocated_id] = 1
+
+        self._on_allocated(1)
         return allocated_id
 
+    def allocate_many(self, num: int) -> List[int]:
+        """Fetch a batch of ids."""
+
+        self._check_capacity(num)
+
+        allocated_ids: List[int] = []
+        if not self.debug_mode:
+            num_reused = min(num, len(self.free_ids))
+            allocated_ids.extend(self.free_ids.popleft() for _ in range(num_reused))
+            for allocated_id in allocated_ids:
+                self._allocated_flags[allocated_id] = 1
+
+        num_new_ids = num - len(allocated_ids)
+        if num_new_ids > 0:
+            allocated_ids.extend(range(self.cur_max_id, self.cur_max_id + num_new_ids))
+            self.cur_max_id += num_new_ids
+            self._allocated_flags.extend(b"\x01" * num_new_ids)
+
+        self._on_allocated(num)
+        return allocated_ids
+
     def free(self, id: int) -> int:
         """Free an id."""
 
-        self.allocated_num -= 1
-
-        if id in self.free_ids:
-            raise ValueError("The id is already free.")
+        self._check_free(id)
 
+        self._allocated_flags[id] = 0
+        self.allocated_num -= 1
         self.free_ids.append(id)  # Append to right
 
+    def free_many(self, ids: Iterable[int]) -> None:
+        """Free a batch of ids."""
+
+        ids = list(ids)
+        num_marked = 0
+        try:
+            for id in ids:
+                self._check_free(id)
+                # Mark it in the first pass, so duplicated ids are detected.
+                self._allocated_flags[id] = 0
+                num_marked += 1
+        except ValueError:
+            # Roll back. Nothing is freed.
+            for id in ids[:num_marked]:
+                self._allocated_flags[id] = 1
+            raise
+
+        self.allocated_num -= len(ids)
+        self.free_ids.extend(ids)  # Append to right
+
     def get_allocated_num(self) -> int:
         """Get the number of allocated ids."""
 
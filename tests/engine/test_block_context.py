@@ -0,0 +1,75 @@
+from parrot.utils import RecyclePool
+from parrot.engine.context.block_context import BlockContext
+
+
+def _new_context(context_id, parent, pool, block_size):
+    return BlockContext(
+        context_id=context_id,
+        parent_context=parent,
+        kv_cache_manager=pool,
+        block_size=block_size,
+    )
+
+
+def _token_level_ids(context: BlockContext):
+    """Per-token block ids and slot ids, computed by walking the blocks one by one."""
+
+    block_ids, slot_ids = [], []
+    chain = []
+    while context is not None:
+        chain.append(context)
+        context = context.parent_context
+    for ctx in reversed(chain):
+        for i in range(ctx.get_this_context_len()):
+            block_id = ctx.block_table[i // ctx.block_size]
+            block_ids.append(block_id)
+            slot_ids.append(block_id * ctx.block_size + i % ctx.block_size)
+    return block_ids, slot_ids
+
+
+def test_block_context():
+    block_size = 16
+    pool = RecyclePool("KVCache pool", pool_size=1024)
+
+    root = _new_context(0, None, pool, block_size)
+    root.allocate(100)
+    assert len(root.block_table) == 7
+
+    # Fork: the parent is padded to a multiple of block size.
+    child1 = _new_context(1, root, pool, block_size)
+    child2 = _new_context(2, root, pool, block_size)
+    assert root.get_this_context_len() == 112 and root.padded_len == 12
+
+    child1.allocate(20)
+    for _ in range(30):
+        child1.allocate(1)
+    child2.allocate(3)
+    grandchild = _new_context(3, child1, pool, block_size)
+    grandchild.allocate(40)
+
+    for ctx in [root, child1, child2, grandchild]:
+        block_ids, slot_ids = _token_level_ids(ctx)
+        assert ctx.get_context_block_ids() == block_ids
+        assert ctx.get_context_slot_ids() == slot_ids
+        assert ctx.get_last_slot_ids(5) == slot_ids[-5:]
+        assert list(ctx.get_context_block_table()) == block_ids[::block_size]
+
+    # The cached table is reused, and updated after the context appends blocks.
+    table = grandchild.get_context_block_table()
+    assert grandchild.get_context_block_table() is table
+    grandchild.allocate(block_size)
+    assert len(grandchild.get_context_block_table()) == len(table)
+    assert grandchild.get_context_slot_ids() == _token_level_ids(grandchild)[1]
+
+    # Rebuilt after an ancestor appends blocks.
+    child1.allocate(block_size)
+    assert grandchild.get_context_slot_ids() == _token_level_ids(grandchild)[1]
+
+    # All blocks are freed on destruction.
+    for ctx in [grandchild, child2, child1, root]:
+        ctx.destruction()
+    assert pool.get_allocated_num() == 0
+
+
+if __name__ == "__main__":
+    test_block_context()
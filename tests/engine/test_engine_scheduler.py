@@ -0,0 +1,253 @@
+from typing import Dict, List
+
+from parrot.engine.config import SchedulerConfig
+from parrot.engine.engine_scheduler import EngineScheduler
+from parrot.engine.primitive_job import Fill, Generate
+from parrot.engine.context.text_context import TextContext
+from parrot.sampling_config import SamplingConfig
+from parrot.constants import (
+    JOB_PRIORITY_NORMAL,
+    JOB_PRIORITY_PACED,
+    JOB_PRIORITY_FIRST_TOKEN,
+)
+
+
+def _make_job(
+    task_id: int,
+    context_id: int,
+    is_gen: bool,
+    context_len: int = 1,
+    priority: int = JOB_PRIORITY_NORMAL,
+):
+    if is_gen:
+        job = Generate(
+            session_id=0,
+            task_id=task_id,
+            context_id=context_id,
+            parent_context_id=-1,
+            sampling_config=SamplingConfig(),
+            end_flag=True,
+            priority=priority,
+        )
+    else:
+        job = Fill(
+            session_id=0,
+            task_id=task_id,
+            context_id=context_id,
+            parent_context_id=-1,
+            token_ids=[1] * context_len,
+            priority=priority,
+        )
+    job.context = TextContext(context_id=context_id, parent_context=None)
+    job.context.append_text("x" * context_len, role_is_user=True)
+    return job
+
+
+def test_schedule_order():
+    scheduler = EngineScheduler(
+        SchedulerConfig(
+            max_batch_size=2, max_num_batched_tokens=100, max_total_tokens=1000
+        )
+    )
+
+    # Task 0 arrives first, then its Generate job arrives after task 1's Fill.
+    fill_0 = _make_job(task_id=0, context_id=0, is_gen=False)
+    fill_1 = _make_job(task_id=1, context_id=1, is_gen=False)
+    scheduler.add_job(fill_0)
+    scheduler.add_job(fill_1)
+    gen_0 = _make_job(task_id=0, context_id=2, is_gen=True)
+    scheduler.add_job(gen_0)
+
+    assert scheduler.waiting_jobs == [fill_0, gen_0, fill_1]
+    assert scheduler.num_total_jobs == 3
+
+    jobs = scheduler.schedule()
+    assert jobs == [fill_0, gen_0]
+    assert scheduler.is_running(0) and not scheduler.is_running(1)
+    assert scheduler.get_job(2) is gen_0
+
+    fill_0.finish_event.set()
+    scheduler.finish()
+    assert scheduler.get_job(0) is None
+    assert scheduler.schedule() == [gen_0, fill_1]
+
+
+def test_schedule_preempt():
+    scheduler = EngineScheduler(
+        SchedulerConfig(
+            max_batch_size=10, max_num_batched_tokens=100, max_total_tokens=25
+        )
+    )
+
+    jobs = [
+        _make_job(task_id=i, context_id=i, is_gen=True, context_len=10)
+        for i in range(3)
+    ]
+    for job in jobs:
+        scheduler.add_job(job)
+
+    # Only 2 jobs fit in max_total_tokens. The latest one is preempted.
+    assert scheduler.schedule() == jobs[:2]
+    assert scheduler.waiting_jobs == [jobs[2]]
+    assert not scheduler.is_running(2)
+
+    jobs[0].finish_event.set()
+    scheduler.finish()
+    assert scheduler.schedule() == jobs[1:]
+
+
+def test_schedule_tgi():
+    scheduler = EngineScheduler(
+        SchedulerConfig(
+            max_batch_size=10,
+            max_num_batched_tokens=20,
+            max_total_tokens=1000,
+            policy="tgi",
+        )
+    )
+
+    gen = _make_job(task_id=0, context_id=0, is_gen=True)
+    scheduler.add_job(gen)
+    assert scheduler.schedule() == [gen]
+
+    # Fill jobs preempt the running Generate jobs.
+    fills = [
+        _make_job(task_id=i, context_id=i, is_gen=False, context_len=10)
+        for i in range(1, 4)
+    ]
+    for fill in fills:
+        scheduler.add_job(fill)
+    assert scheduler.schedule() == fills[:2]
+    assert scheduler.waiting_jobs == [gen, fills[2]]
+
+
+def test_schedule_chunked_fill():
+    scheduler = EngineScheduler(
+        SchedulerConfig(
+            max_batch_size=10, max_num_batched_tokens=20, max_total_tokens=1000
+        ),
+        fill_chunk_size=16,
+    )
+
+    gen = _make_job(task_id=0, context_id=0, is_gen=True)
+    scheduler.add_job(gen)
+    assert scheduler.schedule() == [gen]
+
+    fill = _make_job(task_id=1, context_id=1, is_gen=False, context_len=50)
+    scheduler.add_job(fill)
+
+    # The long Fill is co-scheduled with the running Generate job in chunks.
+    chunk_lens = []
+    while not fill.finish_event.is_set():
+        jobs = scheduler.schedule()
+        assert gen in jobs and fill in jobs
+        assert fill.chunk_len + 1 <= 20
+        chunk_lens.append(fill.chunk_len)
+        # Simulate the runner.
+        if fill.finish_chunk():
+            fill.finish_event.set()
+        scheduler.finish()
+
+    assert chunk_lens == [16, 16, 16, 2]
+    assert fill.filled_len == 50
+    assert scheduler.get_job(1) is None
+
+    # A chunk shrinks to fit the budget left by Generate jobs.
+    gens = [_make_job(task_id=i, context_id=i, is_gen=True) for i in range(2, 10)]
+    for job in gens:
+        scheduler.add_job(job)
+    fill = _make_job(task_id=10, context_id=10, is_gen=False, context_len=50)
+    scheduler.add_job(fill)
+    jobs = scheduler.schedule()
+    assert fill in jobs and fill.chunk_len == 20 - 9
+
+
+def _simulate(
+    scheduler: EngineScheduler, arrivals: Dict[int, List], gen_len: int
+) -> Dict[int, List[int]]:
+    """Simulate the engine loop. Each running Generate job generates a token per iteration.
+
+    Args:
+        arrivals: iteration -> jobs arriving at the iteration.
+
+    Returns:
+        context_id -> iterations in which the job generated tokens.
+    """
+
+    token_iters: Dict[int, List[int]] = {}
+    last_arrival = max(arrivals.keys())
+    it = 0
+    while it <= last_arrival or not scheduler.is_empty:
+        for job in arrivals.get(it, []):
+            scheduler.add_job(job)
+        for job in scheduler.schedule():
+            if isinstance(job, Generate):
+                job.gen_length += 1
+                token_iters.setdefault(job.context_id, []).append(it)
+                if job.gen_length >= gen_len:
+                    job.finish_event.set()
+            else:
+                job.finish_event.set()
+        scheduler.finish()
+        it += 1
+    return token_iters
+
+
+def test_schedule_ttft_priority():
+    def run(priority: int) -> int:
+        scheduler = EngineScheduler(
+            SchedulerConfig(
+                max_batch_size=2, max_num_batched_tokens=100, max_total_tokens=1000
+            )
+        )
+        # A backlog of normal jobs, then a latency-sensitive job arrives.
+        backlog = [_make_job(task_id=i, context_id=i, is_gen=True) for i in range(6)]
+        job = _make_job(task_id=6, context_id=6, is_gen=True, priority=priority)
+        token_iters = _simulate(scheduler, {0: backlog, 1: [job]}, gen_len=4)
+        return token_iters[6][0] - 1  # Time to first token, in iterations.
+
+    ttft_normal = run(JOB_PRIORITY_NORMAL)
+    ttft_priority = run(JOB_PRIORITY_FIRST_TOKEN)
+    print(f"TTFT: normal={ttft_normal}, first_token_priority={ttft_priority}")
+    assert ttft_priority < ttft_normal
+
+
+def test_schedule_tpot_priority():
+    def run(priority: int) -> float:
+        scheduler = EngineScheduler(
+            SchedulerConfig(
+                max_batch_size=10, max_num_batched_tokens=100, max_total_tokens=25
+            )
+        )
+        # Tasks 0 and 1 arrived earlier (Fill). Task 2 starts decoding, then the
+        # Generate jobs of tasks 0 and 1 arrive. Only 2 jobs fit in max_total_tokens.
+        fills = [
+            _make_job(task_id=i, context_id=i, is_gen=False, context_len=10)
+            for i in range(2)
+        ]
+        job = _make_job(
+            task_id=2, context_id=2, is_gen=True, context_len=10, priority=priority
+        )
+        gens = [
+            _make_job(task_id=i, context_id=10 + i, is_gen=True, context_len=10)
+            for i in range(2)
+        ]
+        gen_len = 8
+        token_iters = _simulate(scheduler, {0: fills, 1: [job], 3: gens}, gen_len)
+        # Time per output token, in iterations.
+        return (token_iters[2][-1] - token_iters[2][0]) / (gen_len - 1)
+
+    tpot_normal = run(JOB_PRIORITY_NORMAL)
+    tpot_priority = run(JOB_PRIORITY_PACED)
+    print(f"TPOT: normal={tpot_normal:.2f}, paced_priority={tpot_priority:.2f}")
+    assert tpot_priority == 1.0
+    assert tpot_priority < tpot_normal
+
+
+if __name__ == "__main__":
+    test_schedule_order()
+    test_schedule_preempt()
+    test_schedule_tgi()
+    test_schedule_chunked_fill()
+    test_schedule_ttft_priority()
+    test_schedule_tpot_priority()
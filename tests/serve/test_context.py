@@ -1,12 +1,17 @@
 import json
+import asyncio
+from aiohttp import web
 
 from parrot.serve.backend_repr import Context, ExecutionEngine, LanguageModel
 from parrot.engine.config import EngineConfig
 from parrot.testing.get_configs import get_sample_engine_config_path
+from parrot.testing.localhost_server_daemon import fake_engine_server
+from parrot.testing.fake_engine_server import engine_config as fake_engine_config
 
 from parrot.serve.variable_manager import SemanticVariableManager
 from parrot.serve.scheduler import CompletionTask
 from parrot.serve.context_manager import PrefixCache, ServeCoreContextManager
+from parrot.protocol.client_session_pool import ClientSessionPool
 from parrot.sampling_config import SamplingConfig
 from parrot.serve.graph import (
     RequestChain,
@@ -20,11 +25,29 @@ from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
 def test_prefix_cache():
     svs = ["sv0", "sv1", "sv2"]
     prefix_cache = PrefixCache()
-    prefix_hash = ""
-    for context_id, sv in enumerate(svs):
-        prefix_hash += ServeCoreContextManager._hash_var_id(sv)
-        prefix_cache.cache_prefix_context(prefix_hash, context_id)
-    print(prefix_cache._prefix_ctx_map)
+    prefix_cache.register_engine(0)
+    prefix_cache.register_engine(1)
+
+    prefix_cache.cache_prefix_contexts(0, svs, [0, 1, 2])
+    prefix_cache.cache_prefix_contexts(0, ["sv0", "sv1", "sv3"], [0, 1, 3])
+    prefix_cache.cache_prefix_contexts(1, ["sv0"], [4])
+
+    assert prefix_cache.get_cached_prefix_contexts(0, svs + ["sv4"]) == [0, 1, 2]
+    assert prefix_cache.get_cached_prefix_contexts(1, svs) == [4]
+    assert prefix_cache.query_engines(svs) == {0: 3, 1: 1}
+
+    # Remove a context in the middle. Succeeding prefixes are not reachable anymore.
+    prefix_cache.remove_context_id(1)
+    assert prefix_cache.get_cached_prefix_contexts(0, svs) == [0]
+    assert prefix_cache.query_engines(svs) == {0: 1, 1: 1}
+
+    prefix_cache.remove_engine(1)
+    assert prefix_cache.query_engines(svs) == {0: 1}
+
+    # Empty nodes are pruned.
+    for context_id in [0, 2, 3]:
+        prefix_cache.remove_context_id(context_id)
+    assert len(prefix_cache._root.children) == 0
 
 
 def test_context_manager():
@@ -67,9 +90,149 @@ def test_context_manager():
     context_mgr.set_task_contexts(task)
 
     print(context_mgr._context_ref_counter)
-    print(context_mgr.prefix_caches[engine.engine_id]._prefix_ctx_map)
+    var_ids = [node.var_id for node in request_chain.comp_chains[0].iter()]
+    print(context_mgr.prefix_cache.get_cached_prefix_contexts(engine.engine_id, var_ids))
+
+    # The second task with the same prefix reuses the cached contexts.
+    task2 = CompletionTask(task_id=1, chain=request_chain.comp_chains[0])
+    task2.schedule_to(engine, update_engine_info=False)
+    context_mgr.set_task_contexts(task2)
+    assert task2.contexts[:3] == task.contexts[:3]
+    assert task2.contexts[3] != task.contexts[3]
+    assert context_mgr.query_prefixes_in_engines(
+        CompletionTask(task_id=2, chain=request_chain.comp_chains[0])
+    ) == [engine.engine_id]
+
+
+def test_context_manager_batched_free():
+    session_id = 0
+    var_mgr = SemanticVariableManager(666)
+    var_mgr.register_local_var_space(session_id=0)
+
+    engine = ExecutionEngine.from_engine_config(0, fake_engine_config)
+    context_mgr = ServeCoreContextManager()
+    context_mgr.register_engine_prefix_cache(engine.engine_id)
+
+    # Not constant prefixes, so no extra ref_counter on the Fill contexts.
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"cache_prefix": False})
+    )
+
+    tasks = []
+    for i in range(8):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"Test{i}"),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(
+                        name="a", is_output=True, sampling_config=SamplingConfig()
+                    )
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        task = CompletionTask(task_id=i, chain=request_chain.comp_chains[0])
+        task.schedule_to(engine, update_engine_info=False)
+        context_mgr.set_task_contexts(task)
+        tasks.append(task)
+
+    # Freeing doesn't send any request. Contexts are queued.
+    for task in tasks:
+        context_mgr.free_task_contexts(task)
+    assert context_mgr.num_pending_free_contexts == 16
+    assert len(context_mgr.contexts) == 0
+
+    # All contexts are freed in one batched request.
+    with fake_engine_server():
+        asyncio.run(context_mgr.flush_free_contexts())
+
+    assert context_mgr.num_pending_free_contexts == 0
+    # The ids are recycled.
+    assert context_mgr._context_id_pool.allocate() in range(16)
+
+
+def test_context_manager_partial_free():
+    session_id = 0
+    var_mgr = SemanticVariableManager(666)
+    var_mgr.register_local_var_space(session_id=0)
+
+    engine = ExecutionEngine.from_engine_config(0, fake_engine_config)
+    context_mgr = ServeCoreContextManager()
+    context_mgr.register_engine_prefix_cache(engine.engine_id)
+
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"cache_prefix": False})
+    )
+
+    contexts = []
+    for i in range(4):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"Test{i}"),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(
+                        name="a", is_output=True, sampling_config=SamplingConfig()
+                    )
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        task = CompletionTask(task_id=i, chain=request_chain.comp_chains[0])
+        task.schedule_to(engine, update_engine_info=False)
+        context_mgr.set_task_contexts(task)
+        contexts.extend(task.contexts)
+        context_mgr.free_task_contexts(task)
+
+    # The engine can't free the contexts which are still running.
+    running_ids = set(context.context_id for context in contexts[::2])
+
+    async def free_contexts(request: web.Request) -> web.Response:
+        context_ids = (await request.json())["context_ids"]
+        return web.json_response(
+            {
+                "context_lens": [0] * len(context_ids),
+                "freed": [context_id not in running_ids for context_id in context_ids],
+            }
+        )
+
+    app = web.Application()
+    app.add_routes([web.post("/free_contexts", free_contexts)])
+
+    def is_recycled(context: Context) -> bool:
+        return context_mgr._context_id_pool._allocated_flags[context.context_id] == 0
+
+    async def main():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, fake_engine_config.host, fake_engine_config.port)
+        await site.start()
+
+        # Requests are sent by the pooled ClientSession of the engine.
+        client_session_pool = ClientSessionPool(limit_per_host=4, keepalive_timeout=5)
+
+        # Only the freed contexts are recycled. The others are queued again.
+        await context_mgr.flush_free_contexts(client_session_pool)
+        assert engine.http_address in client_session_pool._sessions
+        assert context_mgr.num_pending_free_contexts == len(running_ids)
+        for context in contexts:
+            assert is_recycled(context) == (context.context_id not in running_ids)
+
+        # They are freed once they finish running.
+        running_ids.clear()
+        await context_mgr.flush_free_contexts(client_session_pool)
+        assert context_mgr.num_pending_free_contexts == 0
+        assert all(is_recycled(context) for context in contexts)
+
+        await client_session_pool.close_all()
+        await runner.cleanup()
+
+    asyncio.run(main())
 
 
 if __name__ == "__main__":
     test_prefix_cache()
     test_context_manager()
+    test_context_manager_batched_free()
+    test_context_manager_partial_free()
@@ -1,4 +1,17 @@
+import asyncio
+from dataclasses import asdict
+
 from parrot.serve.core import create_serve_core
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.serve.graph import (
+    RequestChain,
+    ConstantFill,
+    PlaceholderGen,
+    PerformanceCriteria,
+    activate_completion_chain,
+)
+from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
 
 from parrot.testing.get_configs import get_sample_core_config_path
 
@@ -15,6 +28,70 @@ def test_core_register_session():
     core.register_session({})
 
 
+def test_core_event_driven_loop():
+    config_path = get_sample_core_config_path("localhost_serve_core.json")
+    core = create_serve_core(config_path, override_args={"event_driven_loop": True})
+
+    # Text engine: no tokenizer is needed.
+    engine_config = EngineConfig(engine_type=ENGINE_TYPE_OPENAI)
+    core.register_engine({"engine_config": asdict(engine_config)})
+
+    session_id = 0
+    core.var_mgr.register_local_var_space(session_id)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+
+    async def main():
+        loop_task = asyncio.create_task(core.serve_loop())
+
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        core.var_mgr.create_vars_for_request(session_id, request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.LATENCY)
+        task = core.task_creator.create_task(comp_chain)
+
+        # The loop is idle until the task is submitted.
+        await asyncio.sleep(0.1)
+        assert not task.is_scheduled
+
+        core.global_scheduler.submit_task(task)
+        await asyncio.wait_for(task.wait_scheduled(), timeout=1)
+        assert core.global_scheduler.num_queued_tasks == 0
+
+        loop_task.cancel()
+
+    asyncio.run(main())
+
+
+def test_core_shutdown():
+    config_path = get_sample_core_config_path("localhost_serve_core.json")
+    core = create_serve_core(config_path)
+
+    engine_config = EngineConfig(engine_type=ENGINE_TYPE_OPENAI)
+    engine_id = core.register_engine({"engine_config": asdict(engine_config)})[
+        "engine_id"
+    ]
+    engine = core.engine_mgr.get_engine(engine_id)
+
+    async def main():
+        client_session = core.engine_mgr.get_client_session(engine)
+        await core.shutdown()
+        assert client_session.closed
+
+    asyncio.run(main())
+
+
 if __name__ == "__main__":
     test_launch_core()
     test_core_register_session()
+    test_core_event_driven_loop()
+    test_core_shutdown()
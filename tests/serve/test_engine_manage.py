@@ -3,6 +3,8 @@ import time
 
 
 from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
+from parrot.serve.backend_repr import ModelType
 from parrot.serve.context_manager import ServeCoreContextManager
 from parrot.serve.tokenizer_wrapper import TokenizersWrapper
 from parrot.serve.engine_manager import EngineManager
@@ -37,5 +39,72 @@ def test_engine_manager():
     print(engine_mgr.engines, engine_mgr.models)
 
 
+def test_engine_indexes():
+    context_mgr = ServeCoreContextManager()
+    tokenizers_wrapper = TokenizersWrapper()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    text_engine_ids = [
+        engine_mgr.register_engine(
+            EngineConfig(model=model, engine_type=ENGINE_TYPE_OPENAI)
+        )
+        for model in ["gpt-a", "gpt-b", "gpt-a"]
+    ]
+    token_engine_ids = [
+        engine_mgr.register_engine(
+            EngineConfig(
+                model="llama", tokenizer=tokenizer_name, tokens_capacity=capacity
+            )
+        )
+        for capacity in [100, 300, 200]
+    ]
+
+    def ids(engines):
+        return [engine.engine_id for engine in engines]
+
+    # Model indexes keep the registration order.
+    assert ids(engine_mgr.get_live_engines_by_model(ModelType.TEXT)) == text_engine_ids
+    assert ids(engine_mgr.get_live_engines_by_model(ModelType.TEXT, ["gpt-a"])) == [
+        text_engine_ids[0],
+        text_engine_ids[2],
+    ]
+    assert (
+        ids(engine_mgr.get_live_engines_by_model(ModelType.TEXT, ["gpt-b", "gpt-a"]))
+        == text_engine_ids
+    )
+    assert (
+        ids(engine_mgr.get_live_engines_by_tokenizer(tokenizer_name))
+        == token_engine_ids
+    )
+
+    # Range query on the remaining tokens capacity.
+    assert ids(
+        engine_mgr.get_live_engines_by_tokens_capacity(tokenizer_name, 150)
+    ) == [token_engine_ids[2], token_engine_ids[1]]
+
+    # Bad/dead engines are removed from the indexes.
+    engine_mgr.raise_exception(token_engine_ids[1], Exception("test"))
+    engine_mgr.get_engine(text_engine_ids[0]).mark_dead()
+    assert ids(
+        engine_mgr.get_live_engines_by_tokens_capacity(tokenizer_name, 150)
+    ) == [token_engine_ids[2]]
+    assert ids(engine_mgr.get_live_engines_by_model(ModelType.TEXT, ["gpt-a"])) == [
+        text_engine_ids[2]
+    ]
+
+    engine_mgr.sweep_not_running_engines()
+    assert len(engine_mgr.engines) == 4
+    assert ids(engine_mgr.get_live_engines_by_model(ModelType.TOKEN_ID)) == [
+        token_engine_ids[0],
+        token_engine_ids[2],
+    ]
+
+
 if __name__ == "__main__":
     test_engine_manager()
+    test_engine_indexes()
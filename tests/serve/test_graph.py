@@ -8,6 +8,7 @@ from parrot.serve.graph import (
     PlaceholderGen,
     PerformanceCriteria,
     activate_completion_chain,
+    finish_completion_chain,
 )
 from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
 from parrot.serve.graph.visualize_utils import view_graph
@@ -220,6 +221,112 @@ def test_graph_traverse():
         print(req.comp_chains[0].depth)
 
 
+def test_graph_traverse_ttft_tpot():
+    # A -> B, for each criteria.
+    for criteria, expected_prev_criteria in [
+        (PerformanceCriteria.TTFT, PerformanceCriteria.LATENCY),
+        (PerformanceCriteria.TPOT, PerformanceCriteria.THROUGHPUT),
+    ]:
+        graph = ComputeGraph()
+
+        var_mgr = SemanticVariableManager(666)
+        session_id = 0
+        var_mgr.register_local_var_space(session_id)
+
+        request1 = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ]
+        )
+        var_mgr.create_vars_for_request(session_id, request1)
+        graph.insert_and_update_request_chain(request1)
+        out_var0 = request1.comp_chains[0].gen_node.sv
+
+        request2 = RequestChain.from_nodes(
+            nodes=[
+                PlaceholderFill(
+                    placeholder=RequestPlaceholder(
+                        name="a", var_id=out_var0.id, is_output=False
+                    )
+                ),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="b", is_output=True)
+                ),
+            ]
+        )
+        var_mgr.create_vars_for_request(session_id, request2)
+        graph.insert_and_update_request_chain(request2)
+
+        activate_completion_chain(request2.comp_chains[0], criteria)
+
+        assert request2.comp_chains[0].criteria == criteria
+        assert request1.comp_chains[0].is_activated
+        assert request1.comp_chains[0].criteria == expected_prev_criteria
+
+
+def test_critical_path():
+    graph = ComputeGraph()
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    def add_chain(inputs, text: str, max_gen_length: int):
+        nodes = [
+            PlaceholderFill(
+                placeholder=RequestPlaceholder(
+                    name=f"in_{i}", var_id=sv.id, is_output=False
+                )
+            )
+            for i, sv in enumerate(inputs)
+        ]
+        if text:
+            nodes.insert(0, ConstantFill(text))
+        nodes.append(
+            PlaceholderGen(
+                placeholder=RequestPlaceholder(
+                    name="out",
+                    is_output=True,
+                    sampling_config={"max_gen_length": max_gen_length},
+                )
+            )
+        )
+        request_chain = RequestChain.from_nodes(nodes=nodes)
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        return request_chain.comp_chains[0]
+
+    # A -> C, B -> D -> C. 40 characters are estimated as 10 tokens.
+    chain_a = add_chain([], "A" * 40, 10)
+    chain_b = add_chain([], "B" * 40, 100)
+    chain_d = add_chain([chain_b.gen_node.sv], "", 200)
+    chain_c = add_chain([chain_a.gen_node.sv, chain_d.gen_node.sv], "", 50)
+
+    activate_completion_chain(chain_c, PerformanceCriteria.LATENCY)
+    assert chain_c.remaining_work == 10 + 200 + 50
+    assert chain_d.remaining_work == 100 + 200 + chain_c.remaining_work
+    assert chain_b.remaining_work == 10 + 100 + chain_d.remaining_work
+    assert chain_a.remaining_work == 10 + 10 + chain_c.remaining_work
+    # B is on the critical path.
+    assert chain_b.remaining_work > chain_a.remaining_work
+
+    # A finishes with a short output. The estimation of C (and D, B) is updated.
+    chain_a.gen_node.sv.set("a" * 4)
+    finish_completion_chain(chain_a)
+    assert chain_a.remaining_work == 0
+    assert chain_c.remaining_work == 1 + 200 + 50
+    assert chain_b.remaining_work == 10 + 100 + 100 + 200 + 1 + 200 + 50
+
+    # A new consumer makes the path through D longer.
+    chain_e = add_chain([chain_d.gen_node.sv], "", 1000)
+    activate_completion_chain(chain_e, PerformanceCriteria.LATENCY)
+    assert chain_d.remaining_work == 100 + 200 + 200 + 1000
+    assert chain_b.remaining_work == 10 + 100 + chain_d.remaining_work
+
+
 if __name__ == "__main__":
     # test_request_parse()
     # test_request_chain_print()
@@ -227,3 +334,5 @@ if __name__ == "__main__":
     # test_graph_remove()
     # test_view_graph()
     test_graph_traverse()
+    test_graph_traverse_ttft_tpot()
+    test_critical_path()
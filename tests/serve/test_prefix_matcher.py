@@ -1,4 +1,6 @@
-from parrot.serve.prefix_matcher import PrefixMatcher
+import time
+
+from parrot.serve.prefix_matcher import PrefixMatcher, PrefixMatcherConfig
 
 
 def test_prefix_matcher():
@@ -11,13 +13,76 @@ def test_prefix_matcher():
     for i in range(PrefixMatcher._GP_THRESHOLD + 1):
         prefix_matcher.add_prefix("A" * PrefixMatcher._START_LEN + "BBB" + str(i))
 
-    print(prefix_matcher._prefix_counter)
+    print(prefix_matcher.nodes_num, prefix_matcher.memory_usage)
 
     query_str = "A" * PrefixMatcher._START_LEN + "BBB" + "XXX"
     pos = prefix_matcher.query_prefix(query_str)
-    assert pos != -1
+    assert pos == PrefixMatcher._START_LEN + 3
     print("prefix: " + query_str[:pos], "suffix: " + query_str[pos:])
 
 
+def test_prefix_matcher_branches():
+    prefix_matcher = PrefixMatcher()
+
+    system_prompt = "S" * PrefixMatcher._START_LEN
+    app_a = system_prompt + "You are app A."
+    app_b = system_prompt + "You are app B."
+
+    for _ in range(PrefixMatcher._GP_THRESHOLD + 1):
+        prefix_matcher.add_prefix(app_a)
+    prefix_matcher.add_prefix(app_b)
+
+    # The whole prompt of app A is popular.
+    assert prefix_matcher.query_prefix(app_a) == len(app_a)
+    # Only the common part is popular for app B.
+    assert prefix_matcher.query_prefix(app_b) == len(system_prompt + "You are app ")
+    # Unknown prefix.
+    assert prefix_matcher.query_prefix("X" * 100) == -1
+
+
+def test_prefix_matcher_decay():
+    prefix_matcher = PrefixMatcher(PrefixMatcherConfig(decay_half_life=0.5))
+
+    prompt = "A" * PrefixMatcher._START_LEN + "BBB"
+    for _ in range(PrefixMatcher._GP_THRESHOLD + 1):
+        prefix_matcher.add_prefix(prompt)
+    assert prefix_matcher.query_prefix(prompt) == len(prompt)
+
+    # After a half life, hits drop below the threshold.
+    time.sleep(0.5)
+    assert prefix_matcher.query_prefix(prompt) == -1
+
+
+def test_prefix_matcher_eviction():
+    for policy in ["lru", "lfu"]:
+        prompt_len = PrefixMatcher._START_LEN * 2
+        node_size = prompt_len + PrefixMatcher._NODE_OVERHEAD
+        prefix_matcher = PrefixMatcher(
+            PrefixMatcherConfig(memory_budget=node_size * 10, eviction_policy=policy)
+        )
+
+        hot_prompt = "H" * prompt_len
+        for _ in range(PrefixMatcher._GP_THRESHOLD + 1):
+            prefix_matcher.add_prefix(hot_prompt)
+
+        # Many distinct prompts with different first characters (one node each).
+        for i in range(100):
+            prefix_matcher.add_prefix(chr(ord("a") + i % 26) * prompt_len + str(i))
+            if policy == "lru":
+                prefix_matcher.add_prefix(hot_prompt)
+
+        assert prefix_matcher.memory_usage <= node_size * 10
+        assert prefix_matcher.evicted_nodes_num > 0
+        # The hot prompt survives.
+        assert prefix_matcher.query_prefix(hot_prompt) == prompt_len
+        print(
+            f"policy={policy}, nodes_num={prefix_matcher.nodes_num}, "
+            f"evicted_nodes_num={prefix_matcher.evicted_nodes_num}"
+        )
+
+
 if __name__ == "__main__":
     test_prefix_matcher()
+    test_prefix_matcher_branches()
+    test_prefix_matcher_decay()
+    test_prefix_matcher_eviction()
@@ -1,10 +1,16 @@
+import random
+import asyncio
+import pytest
 from typing import List, Optional
+from parrot.exceptions import ParrotCoreUserError
 from parrot.serve.scheduler import (
     CompletionTask,
+    TaskStatus,
     TaskCreator,
     GlobalScheduler,
     GlobalSchedulerConfig,
 )
+from parrot.serve.scheduler.engine_scoring import queueing_delay_score
 from parrot.serve.tokenizer_wrapper import TokenizersWrapper
 from parrot.serve.context_manager import ServeCoreContextManager
 from parrot.serve.variable_manager import SemanticVariableManager
@@ -21,7 +27,9 @@ from parrot.serve.graph import (
 )
 from parrot.serve.graph.request import SemanticCallMetadata, RequestPlaceholder
 from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI
 from parrot.serve.engine_manager import EngineManager
+from parrot.protocol.internal.runtime_info import EngineRuntimeInfo
 from parrot.serve.graph.visualize_utils import view_graph
 
 
@@ -448,19 +456,977 @@ def test_ctx_aware():
 
     # Assign context in a round-robin manner (hacky)
     for i in range(4):
-        prefix_cache = context_mgr.prefix_caches[i]
-        prefix_hash = context_mgr._hash_var_id(first_vars[i].id)
-        prefix_cache.cache_prefix_context(prefix_hash=prefix_hash, context_id=i)
+        context_mgr.prefix_cache.cache_prefix_contexts(
+            engine_id=i, var_ids=[first_vars[i].id], context_ids=[i]
+        )
 
     scheduler.schedule()
 
     # Expected results: 0, 4, 8, 12 tasks go to engine 0, 1, 2, 3 respectively.
 
 
+class _RecordGroupsScheduler(GlobalScheduler):
+    """Records the groups passed to _find_engine."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recorded_groups: List[List[int]] = []
+
+    def _find_engine(self, tasks: List[CompletionTask]) -> None:
+        self.recorded_groups.append([task.task_id for task in tasks])
+        super()._find_engine(tasks)
+
+
+class _ScanGroupingScheduler(_RecordGroupsScheduler):
+    """Groups tasks by scanning the rest queue pairwise (the old O(n^2) path)."""
+
+    def _group_tasks(self, task, queue_positions):
+        task_queue = self.task_queue
+        i = task_queue.index(task)
+        cur_group: List[CompletionTask] = [task]
+        chain_groups = set(task.chain.chain_groups)
+
+        graph_group_enabled = self.config.graph_group
+        ctx_group_enabled = self.config.ctx_group
+
+        if graph_group_enabled or ctx_group_enabled:
+            for j in range(i + 1, len(task_queue)):
+                task_j = task_queue[j]
+                if task_j.is_scheduled:
+                    continue
+
+                if graph_group_enabled:
+                    chain_groups_j = set(task_j.chain.chain_groups)
+                    common_groups = chain_groups.intersection(chain_groups_j)
+                    if len(common_groups) > 0:
+                        cur_group.append(task_j)
+                        chain_groups = common_groups
+                        ctx_group_enabled = False
+
+                if ctx_group_enabled:
+                    if task.chain.first_node.sv == task_j.chain.first_node.sv:
+                        cur_group.append(task_j)
+                        graph_group_enabled = False
+
+        return cur_group
+
+
+def _run_grouping_workload(
+    scheduler_cls, scheduler_cfg: GlobalSchedulerConfig, seed: int
+) -> List[List[int]]:
+    """Map-reduce style workload on text engines. Returns the recorded groups."""
+
+    rng = random.Random(seed)
+
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = scheduler_cls(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    for _ in range(2):
+        engine_mgr.register_engine(
+            EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=24)
+        )
+
+    graph = ComputeGraph()
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+
+    # Mappers share a few prefixes. Reducers consume random subsets of the mappers, so a
+    # mapper may belong to several chain groups, some of them added after it is queued.
+    prompts = [f"Map prompt {i} " for i in range(5)]
+    mappers: List[CompletionChain] = []
+    for _ in range(60):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(rng.choice(prompts)),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        mappers.append(request_chain.comp_chains[0])
+
+    submitted = set()
+    tasks: List[CompletionTask] = []
+    finished = set()
+    for round_idx in range(6):
+        for _ in range(3):
+            inputs = rng.sample(mappers, rng.randint(1, 8))
+            request_chain = RequestChain.from_nodes(
+                nodes=[
+                    PlaceholderFill(
+                        placeholder=RequestPlaceholder(
+                            name=f"in_{k}", var_id=chain.gen_node.sv.id, is_output=False
+                        )
+                    )
+                    for k, chain in enumerate(inputs)
+                ]
+                + [
+                    PlaceholderGen(
+                        placeholder=RequestPlaceholder(name="b", is_output=True)
+                    )
+                ],
+                metadata=metadata,
+            )
+            var_mgr.create_vars_for_request(session_id, request_chain)
+            graph.insert_and_update_request_chain(request_chain)
+            activate_completion_chain(
+                request_chain.comp_chains[0],
+                rng.choice([PerformanceCriteria.LATENCY, PerformanceCriteria.THROUGHPUT]),
+            )
+
+        for chain in mappers:
+            if chain.is_activated and id(chain) not in submitted:
+                submitted.add(id(chain))
+                task = task_creator.create_task(chain)
+                tasks.append(task)
+                scheduler.submit_task(task)
+
+        scheduler.schedule()
+
+        # Finish the scheduled tasks every two rounds to release capacity.
+        if round_idx % 2 == 1:
+            for task in tasks:
+                if task.is_scheduled and task.task_id not in finished:
+                    finished.add(task.task_id)
+                    task.leave_scheduled()
+
+    return scheduler.recorded_groups
+
+
+def test_grouping_index_differential():
+    for graph_group, ctx_group, app_fifo in [
+        (True, False, False),
+        (False, True, False),
+        (True, True, False),
+        (True, True, True),
+    ]:
+        scheduler_cfg = GlobalSchedulerConfig(
+            app_fifo=app_fifo,
+            graph_group=graph_group,
+            ctx_group=ctx_group,
+            ctx_aware=False,
+            max_queue_size=1024,
+        )
+        for seed in range(5):
+            groups_index = _run_grouping_workload(
+                _RecordGroupsScheduler, scheduler_cfg, seed
+            )
+            groups_scan = _run_grouping_workload(
+                _ScanGroupingScheduler, scheduler_cfg, seed
+            )
+            assert groups_index == groups_scan, (graph_group, ctx_group, seed)
+
+        print(
+            f"graph_group={graph_group}, ctx_group={ctx_group}, app_fifo={app_fifo}: "
+            f"{len(groups_index)} groups identical."
+        )
+
+
+def test_token_nums_bookkeeping():
+    scheduler_cfg = GlobalSchedulerConfig(
+        app_fifo=False,
+        graph_group=False,
+        ctx_group=False,
+        ctx_aware=False,
+        max_queue_size=1024,
+    )
+
+    graph = ComputeGraph()
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    engine_config = EngineConfig(tokenizer="hf-internal-testing/llama-tokenizer")
+    engine_id = engine_mgr.register_engine(engine_config)
+    engine = engine_mgr.get_engine(engine_id)
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill("This is a test "),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+        ]
+    )
+    var_mgr.create_vars_for_request(session_id, request_chain)
+    graph.insert_and_update_request_chain(request_chain)
+    comp_chain = request_chain.comp_chains[0]
+    activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+    task = task_creator.create_task(comp_chain)
+    task.bind_tokenizers(tokenizers_wrapper)
+
+    async def main():
+        # The tokens are not counted yet. The scheduler doesn't tokenize: it skips the
+        # engine and counts the tokens in the background.
+        scheduler.submit_task(task)
+        await scheduler.wait_wakeup()
+        scheduler.schedule()
+        assert not task.is_scheduled
+
+        # Woken up once the tokens are counted.
+        await scheduler.wait_wakeup()
+        scheduler.schedule()
+
+    asyncio.run(main())
+
+    assert task.is_scheduled
+    tokens_num = task.get_token_nums(engine.tokenizer_name)
+    assert engine.get_tokens_num() == tokens_num
+
+    # Token numbers are memoized. Changing the sampling config doesn't affect them.
+    comp_chain.gen_node.sampling_config.max_gen_length += 100
+    assert task.get_token_nums(engine.tokenizer_name) == tokens_num
+
+    # The engine gets back exactly what the task added.
+    task.leave_scheduled()
+    assert engine.get_tokens_num() == 0
+
+
+def test_criteria_deadline():
+    scheduler_cfg = GlobalSchedulerConfig(
+        app_fifo=False,
+        graph_group=False,
+        ctx_group=False,
+        ctx_aware=False,
+        max_queue_size=1024,
+        ordering_policy="edf",
+    )
+
+    graph = ComputeGraph()
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    # An engine which can only hold 1 task.
+    engine_config = EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=1)
+    engine_mgr.register_engine(engine_config)
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+
+    tasks = []
+    for criteria in [
+        PerformanceCriteria.THROUGHPUT,
+        PerformanceCriteria.TPOT,
+        PerformanceCriteria.TTFT,
+    ]:
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, criteria)
+        task = task_creator.create_task(comp_chain)
+        tasks.append(task)
+        scheduler.submit_task(task)
+
+    # TTFT/TPOT criteria are lowered to deadlines.
+    assert tasks[0].deadline == float("inf")
+    assert tasks[2].deadline < tasks[1].deadline < float("inf")
+
+    # The task with the earliest deadline (TTFT) is scheduled first.
+    scheduler.schedule()
+    assert tasks[2].is_scheduled
+    assert not tasks[0].is_scheduled and not tasks[1].is_scheduled
+
+
+def test_edf_aging():
+    def first_scheduled(throughput_waited: float) -> PerformanceCriteria:
+        scheduler_cfg = GlobalSchedulerConfig(
+            ordering_policy="edf", latency_slack=1.0, throughput_slack=10.0
+        )
+
+        graph = ComputeGraph()
+        context_mgr = ServeCoreContextManager()
+        engine_mgr = EngineManager(
+            tokenizers_wrapper=TokenizersWrapper(),
+            context_mgr=context_mgr,
+            engine_heartbeat_timeout=666,
+        )
+        scheduler = GlobalScheduler(
+            config=scheduler_cfg,
+            engine_mgr=engine_mgr,
+            context_mgr=context_mgr,
+        )
+        task_creator = TaskCreator()
+
+        # An engine which can only hold 1 task.
+        engine_mgr.register_engine(
+            EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=1)
+        )
+
+        var_mgr = SemanticVariableManager(666)
+        session_id = 0
+        var_mgr.register_local_var_space(session_id)
+        metadata = SemanticCallMetadata(
+            **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+        )
+
+        tasks = []
+        for criteria in [PerformanceCriteria.THROUGHPUT, PerformanceCriteria.LATENCY]:
+            request_chain = RequestChain.from_nodes(
+                nodes=[
+                    ConstantFill("This is a test "),
+                    PlaceholderGen(
+                        placeholder=RequestPlaceholder(name="a", is_output=True)
+                    ),
+                ],
+                metadata=metadata,
+            )
+            var_mgr.create_vars_for_request(session_id, request_chain)
+            graph.insert_and_update_request_chain(request_chain)
+            comp_chain = request_chain.comp_chains[0]
+            activate_completion_chain(comp_chain, criteria)
+            task = task_creator.create_task(comp_chain)
+            if criteria == PerformanceCriteria.THROUGHPUT:
+                # Pretend the task was created a while ago.
+                task.create_time -= int(throughput_waited * 1e9)
+            tasks.append(task)
+            scheduler.submit_task(task)
+
+        scheduler.schedule()
+        scheduled = [task for task in tasks if task.is_scheduled]
+        assert len(scheduled) == 1 and scheduler.num_queued_tasks == 1
+
+        # Queue wait time is recorded for the scheduled task.
+        assert scheduler.num_dequeued_tasks == 1
+        assert scheduled[0].queue_wait_time >= 0
+        assert scheduler.max_queue_wait_time == scheduler.total_queue_wait_time
+
+        return scheduled[0].chain.criteria
+
+    # A new throughput task yields to the latency task.
+    assert first_scheduled(0.0) == PerformanceCriteria.LATENCY
+    # But it doesn't starve: after waiting long enough, it goes first.
+    assert first_scheduled(20.0) == PerformanceCriteria.THROUGHPUT
+
+
+def test_critical_path_rekey():
+    scheduler_cfg = GlobalSchedulerConfig(
+        ordering_policy="edf", critical_path_slack=1.0
+    )
+
+    graph = ComputeGraph()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    # An engine which can only hold 1 task.
+    engine_mgr.register_engine(
+        EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=1)
+    )
+
+    var_mgr = SemanticVariableManager(666)
+    session_id = 0
+    var_mgr.register_local_var_space(session_id)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+
+    def add_chain(inputs: List[SemanticVariable], max_gen_length: int):
+        nodes = [
+            PlaceholderFill(
+                placeholder=RequestPlaceholder(
+                    name=f"in_{i}", var_id=sv.id, is_output=False
+                )
+            )
+            for i, sv in enumerate(inputs)
+        ]
+        nodes.insert(0, ConstantFill("This is a test "))
+        nodes.append(
+            PlaceholderGen(
+                placeholder=RequestPlaceholder(
+                    name="out",
+                    is_output=True,
+                    sampling_config={"max_gen_length": max_gen_length},
+                )
+            )
+        )
+        request_chain = RequestChain.from_nodes(nodes=nodes, metadata=metadata)
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        return request_chain.comp_chains[0]
+
+    chain_a = add_chain([], 10)
+    chain_b = add_chain([], 10)
+    tasks = []
+    for chain in [chain_a, chain_b]:
+        activate_completion_chain(chain, PerformanceCriteria.LATENCY)
+        task = task_creator.create_task(chain)
+        tasks.append(task)
+        scheduler.submit_task(task)
+    task_a, task_b = tasks
+    assert scheduler.task_queue == [task_a, task_b]
+
+    # A long consumer of B is activated after B is queued. B is on the critical path
+    # now, and goes first.
+    chain_c = add_chain([chain_b.gen_node.sv], 1000)
+    activate_completion_chain(chain_c, PerformanceCriteria.LATENCY)
+    assert chain_b.remaining_work > chain_a.remaining_work
+    assert scheduler.task_queue == [task_b, task_a]
+
+    scheduler.schedule()
+    assert task_b.is_scheduled and not task_a.is_scheduled
+    assert scheduler.task_queue == [task_a]
+
+    # The scheduled task is not re-keyed anymore.
+    chain_d = add_chain([chain_b.gen_node.sv], 2000)
+    activate_completion_chain(chain_d, PerformanceCriteria.LATENCY)
+    assert task_b.task_id not in scheduler._stale_key_tasks
+
+
+def test_fair_share():
+    scheduler_cfg = GlobalSchedulerConfig(fair_share=True)
+
+    graph = ComputeGraph()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    engine_mgr.register_engine(
+        EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=3)
+    )
+
+    var_mgr = SemanticVariableManager(666)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+
+    def submit(session_id: int) -> CompletionTask:
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"This is session {session_id} "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        request_chain.session_id = session_id
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+        task = task_creator.create_task(comp_chain)
+        scheduler.submit_task(task)
+        return task
+
+    # Session 0 (weight 2) and session 1 (weight 1) are both backlogged.
+    for session_id, weight in [(0, 2.0), (1, 1.0)]:
+        var_mgr.register_local_var_space(session_id)
+        scheduler.register_session(session_id, weight)
+    tasks = [submit(0) for _ in range(10)] + [submit(1) for _ in range(10)]
+
+    scheduler.schedule()
+    scheduled = [task for task in tasks if task.is_scheduled]
+    assert [task.chain.session_id for task in scheduled].count(0) == 2
+    assert [task.chain.session_id for task in scheduled].count(1) == 1
+
+    for task in scheduled:
+        task.leave_scheduled()
+
+    # A new session arrives. It doesn't wait for the backlog of the others.
+    var_mgr.register_local_var_space(2)
+    scheduler.register_session(2)
+    new_task = submit(2)
+    scheduler.schedule()
+    assert new_task.is_scheduled
+    new_task.leave_scheduled()
+
+    # Session 1 is removed with queued tasks. They are aborted, and nothing of the
+    # session is kept for a new session with the recycled id.
+    aborted_tasks = [
+        task for task in scheduler.task_queue if task.chain.session_id == 1
+    ]
+    assert len(aborted_tasks) > 0
+    scheduler.remove_session(1)
+    assert all(task.chain.session_id != 1 for task in scheduler.task_queue)
+    assert all(task.status == TaskStatus.ERROR for task in aborted_tasks)
+    with pytest.raises(ParrotCoreUserError):
+        asyncio.run(aborted_tasks[0].wait_scheduled())
+    assert 1 not in scheduler._session_vtimes
+
+    scheduler.register_session(1)
+    submit(1)
+    assert scheduler._session_vtimes[1] == scheduler._virtual_time
+
+
+def test_fair_share_cross_session_charge():
+    scheduler_cfg = GlobalSchedulerConfig(fair_share=True)
+
+    graph = ComputeGraph()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    scheduler = GlobalScheduler(
+        config=scheduler_cfg,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+    )
+    task_creator = TaskCreator()
+
+    var_mgr = SemanticVariableManager(666)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+
+    tasks = {}
+    for session_id in range(3):
+        var_mgr.register_local_var_space(session_id)
+        scheduler.register_session(session_id)
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(f"This is session {session_id} "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        request_chain.session_id = session_id
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.THROUGHPUT)
+        tasks[session_id] = task_creator.create_task(comp_chain)
+        scheduler.submit_task(tasks[session_id])
+
+    # The group of the first task also holds the task of session 1, so both sessions
+    # are charged. Session 1 must not keep its old place in the merged order.
+    queue_iter = scheduler._iter_queue()
+    assert next(queue_iter) is tasks[0]
+    scheduler._charge_sessions([tasks[0], tasks[1]])
+    assert list(queue_iter) == [tasks[2], tasks[1]]
+
+
+def test_scheduler_policies():
+    def run(criteria_list, num_engines: int, tasks_capacity: int, **config):
+        scheduler_cfg = GlobalSchedulerConfig(**config)
+
+        graph = ComputeGraph()
+        context_mgr = ServeCoreContextManager()
+        engine_mgr = EngineManager(
+            tokenizers_wrapper=TokenizersWrapper(),
+            context_mgr=context_mgr,
+            engine_heartbeat_timeout=666,
+        )
+        scheduler = GlobalScheduler(
+            config=scheduler_cfg,
+            engine_mgr=engine_mgr,
+            context_mgr=context_mgr,
+        )
+        task_creator = TaskCreator()
+        for _ in range(num_engines):
+            engine_mgr.register_engine(
+                EngineConfig(
+                    engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=tasks_capacity
+                )
+            )
+
+        var_mgr = SemanticVariableManager(666)
+        session_id = 0
+        var_mgr.register_local_var_space(session_id)
+        metadata = SemanticCallMetadata(
+            **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+        )
+
+        tasks = []
+        for criteria in criteria_list:
+            request_chain = RequestChain.from_nodes(
+                nodes=[
+                    ConstantFill("This is a test "),
+                    PlaceholderGen(
+                        placeholder=RequestPlaceholder(name="a", is_output=True)
+                    ),
+                ],
+                metadata=metadata,
+            )
+            var_mgr.create_vars_for_request(session_id, request_chain)
+            graph.insert_and_update_request_chain(request_chain)
+            comp_chain = request_chain.comp_chains[0]
+            activate_completion_chain(comp_chain, criteria)
+            task = task_creator.create_task(comp_chain)
+            tasks.append(task)
+            scheduler.submit_task(task)
+
+        scheduler.schedule()
+        return tasks
+
+    # Ordering: The latency task goes first with "edf", but not with "fifo".
+    criteria_list = [PerformanceCriteria.THROUGHPUT, PerformanceCriteria.LATENCY]
+    tasks = run(criteria_list, 1, 1, ordering_policy="edf")
+    assert tasks[1].is_scheduled and not tasks[0].is_scheduled
+    tasks = run(criteria_list, 1, 1, ordering_policy="fifo")
+    assert tasks[0].is_scheduled and not tasks[1].is_scheduled
+
+    # "fifo" honors app_fifo: The deeper chain goes first, though it's queued later.
+    def run_app_fifo(app_fifo: bool) -> List[CompletionTask]:
+        scheduler_cfg = GlobalSchedulerConfig(ordering_policy="fifo", app_fifo=app_fifo)
+
+        graph = ComputeGraph()
+        context_mgr = ServeCoreContextManager()
+        engine_mgr = EngineManager(
+            tokenizers_wrapper=TokenizersWrapper(),
+            context_mgr=context_mgr,
+            engine_heartbeat_timeout=666,
+        )
+        scheduler = GlobalScheduler(
+            config=scheduler_cfg,
+            engine_mgr=engine_mgr,
+            context_mgr=context_mgr,
+        )
+        task_creator = TaskCreator()
+        engine_mgr.register_engine(
+            EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=1)
+        )
+
+        var_mgr = SemanticVariableManager(666)
+        session_id = 0
+        var_mgr.register_local_var_space(session_id)
+        metadata = SemanticCallMetadata(
+            **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+        )
+
+        # A -> B. A (depth 0) is queued before B (depth 1).
+        request_chain_a = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain_a)
+        graph.insert_and_update_request_chain(request_chain_a)
+        chain_a = request_chain_a.comp_chains[0]
+
+        request_chain_b = RequestChain.from_nodes(
+            nodes=[
+                PlaceholderFill(
+                    placeholder=RequestPlaceholder(
+                        name="a", var_id=chain_a.gen_node.sv.id, is_output=False
+                    )
+                ),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="b", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain_b)
+        graph.insert_and_update_request_chain(request_chain_b)
+        chain_b = request_chain_b.comp_chains[0]
+        activate_completion_chain(chain_b, PerformanceCriteria.LATENCY)
+
+        tasks = [task_creator.create_task(chain) for chain in [chain_a, chain_b]]
+        for task in tasks:
+            scheduler.submit_task(task)
+        scheduler.schedule()
+        return tasks
+
+    task_a, task_b = run_app_fifo(app_fifo=False)
+    assert task_a.is_scheduled and not task_b.is_scheduled
+    task_a, task_b = run_app_fifo(app_fifo=True)
+    assert task_b.is_scheduled and not task_a.is_scheduled
+
+    # Grouping: Tasks with the same prefix go to the same engine with the default
+    # grouping (ctx_group), and are spread by "least_tasks" without grouping.
+    criteria_list = [PerformanceCriteria.THROUGHPUT] * 4
+    tasks = run(criteria_list, 2, 4, ctx_group=True)
+    assert len(set(task.engine.engine_id for task in tasks)) == 1
+    tasks = run(
+        criteria_list,
+        2,
+        4,
+        ctx_group=True,
+        grouping_policy="none",
+        placement_policy="least_tasks",
+    )
+    assert [task.engine.engine_id for task in tasks].count(0) == 2
+
+
+def test_split_group():
+    def run(
+        split_groups: bool, num_prefixes: int = 2, **config
+    ) -> List[CompletionTask]:
+        scheduler_cfg = GlobalSchedulerConfig(
+            graph_group=True, split_groups=split_groups, **config
+        )
+
+        graph = ComputeGraph()
+        context_mgr = ServeCoreContextManager()
+        engine_mgr = EngineManager(
+            tokenizers_wrapper=TokenizersWrapper(),
+            context_mgr=context_mgr,
+            engine_heartbeat_timeout=666,
+        )
+        scheduler = GlobalScheduler(
+            config=scheduler_cfg,
+            engine_mgr=engine_mgr,
+            context_mgr=context_mgr,
+        )
+        task_creator = TaskCreator()
+
+        # No engine can hold the whole group of 6 tasks.
+        for _ in range(2):
+            engine_mgr.register_engine(
+                EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tasks_capacity=4)
+            )
+
+        var_mgr = SemanticVariableManager(666)
+        session_id = 0
+        var_mgr.register_local_var_space(session_id)
+        metadata = SemanticCallMetadata(
+            **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+        )
+
+        # 6 mappers with num_prefixes prefixes, and a reducer consuming all of them.
+        mappers: List[CompletionChain] = []
+        for i in range(6):
+            request_chain = RequestChain.from_nodes(
+                nodes=[
+                    ConstantFill(f"Prefix {i % num_prefixes} "),
+                    PlaceholderGen(
+                        placeholder=RequestPlaceholder(name="a", is_output=True)
+                    ),
+                ],
+                metadata=metadata,
+            )
+            var_mgr.create_vars_for_request(session_id, request_chain)
+            graph.insert_and_update_request_chain(request_chain)
+            mappers.append(request_chain.comp_chains[0])
+
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                PlaceholderFill(
+                    placeholder=RequestPlaceholder(
+                        name=f"in_{i}", var_id=chain.gen_node.sv.id, is_output=False
+                    )
+                )
+                for i, chain in enumerate(mappers)
+            ]
+            + [PlaceholderGen(placeholder=RequestPlaceholder(name="b", is_output=True))],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        activate_completion_chain(
+            request_chain.comp_chains[0], PerformanceCriteria.THROUGHPUT
+        )
+
+        tasks = []
+        for chain in mappers:
+            task = task_creator.create_task(chain)
+            tasks.append(task)
+            scheduler.submit_task(task)
+
+        scheduler.schedule()
+        return tasks
+
+    # The head of the queue stalls without splitting (only a tail of the group fits).
+    tasks = run(split_groups=False)
+    assert not tasks[0].is_scheduled
+
+    # Split across engines. Tasks with the same prefix are co-located.
+    tasks = run(split_groups=True)
+    assert all(task.is_scheduled for task in tasks)
+    for prefix in range(2):
+        engine_ids = set(task.engine.engine_id for task in tasks[prefix::2])
+        assert len(engine_ids) == 1
+    assert tasks[0].engine.engine_id != tasks[1].engine.engine_id
+
+    # All tasks share a prefix, but no engine can hold them. As many as fit are packed
+    # onto one engine before the rest spill over, instead of being spread one by one.
+    tasks = run(split_groups=True, num_prefixes=1, placement_policy="least_tasks")
+    assert all(task.is_scheduled for task in tasks)
+    engine_ids = [task.engine.engine_id for task in tasks]
+    assert sorted(engine_ids.count(engine_id) for engine_id in set(engine_ids)) == [
+        2,
+        4,
+    ]
+
+
+def test_engine_scoring():
+    def scheduled_to_idle_engine(engine_scoring: str) -> bool:
+        scheduler_cfg = GlobalSchedulerConfig(engine_scoring=engine_scoring)
+
+        graph = ComputeGraph()
+        tokenizers_wrapper = TokenizersWrapper()
+        context_mgr = ServeCoreContextManager()
+        engine_mgr = EngineManager(
+            tokenizers_wrapper=tokenizers_wrapper,
+            context_mgr=context_mgr,
+            engine_heartbeat_timeout=666,
+        )
+
+        scheduler = GlobalScheduler(
+            config=scheduler_cfg,
+            engine_mgr=engine_mgr,
+            context_mgr=context_mgr,
+        )
+        task_creator = TaskCreator()
+
+        # Engine 0 is busy and slow; engine 1 is idle.
+        busy_engine_id = engine_mgr.register_engine(
+            EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tokens_capacity=1000)
+        )
+        idle_engine_id = engine_mgr.register_engine(
+            EngineConfig(engine_type=ENGINE_TYPE_OPENAI, tokens_capacity=1000)
+        )
+        engine_mgr.engine_heartbeat(
+            busy_engine_id,
+            EngineRuntimeInfo(
+                num_total_jobs=32, num_cached_tokens=900, recent_average_latency=5e7
+            ),
+        )
+        engine_mgr.engine_heartbeat(
+            idle_engine_id, EngineRuntimeInfo(recent_average_latency=2e7)
+        )
+
+        var_mgr = SemanticVariableManager(666)
+        session_id = 0
+        var_mgr.register_local_var_space(session_id)
+        metadata = SemanticCallMetadata(
+            **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+        )
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("This is a test "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        graph.insert_and_update_request_chain(request_chain)
+        comp_chain = request_chain.comp_chains[0]
+        activate_completion_chain(comp_chain, PerformanceCriteria.LATENCY)
+        task = task_creator.create_task(comp_chain)
+        scheduler.submit_task(task)
+        scheduler.schedule()
+
+        assert task.is_scheduled
+        return task.engine.engine_id == idle_engine_id
+
+    # Serve-layer info can't tell the two engines apart.
+    assert not scheduled_to_idle_engine("default")
+    # Real-time info shows engine 0 is busy.
+    assert scheduled_to_idle_engine("queueing_delay")
+    assert scheduled_to_idle_engine("kv_free")
+
+    # An engine without a latency report is scored in the same unit (ns) as the others,
+    # so its backlog still counts.
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=TokenizersWrapper(),
+        context_mgr=ServeCoreContextManager(),
+        engine_heartbeat_timeout=666,
+    )
+    unreported_engine = engine_mgr.get_engine(
+        engine_mgr.register_engine(EngineConfig(engine_type=ENGINE_TYPE_OPENAI))
+    )
+    reported_engine = engine_mgr.get_engine(
+        engine_mgr.register_engine(EngineConfig(engine_type=ENGINE_TYPE_OPENAI))
+    )
+    engine_mgr.engine_heartbeat(
+        unreported_engine.engine_id, EngineRuntimeInfo(num_total_jobs=32)
+    )
+    engine_mgr.engine_heartbeat(
+        reported_engine.engine_id,
+        EngineRuntimeInfo(num_total_jobs=1, recent_average_latency=5e7),
+    )
+    assert queueing_delay_score(reported_engine, []) < queueing_delay_score(
+        unreported_engine, []
+    )
+
+
 if __name__ == "__main__":
     # test_default_policy_throughput()
     # test_default_policy_latency()
     test_app_fifo()
+    test_token_nums_bookkeeping()
+    test_criteria_deadline()
+    test_edf_aging()
+    test_critical_path_rekey()
+    test_fair_share()
+    test_fair_share_cross_session_charge()
+    test_scheduler_policies()
+    test_split_group()
+    test_engine_scoring()
     # test_graph_group()
     # test_ctx_group()
     # test_ctx_aware()
@@ -1,8 +1,13 @@
+import os
 import time
 import pytest
 import asyncio
+import contextlib
+from aiohttp import web
 
 from parrot.exceptions import ParrotCoreUserError
+from parrot.engine.config import EngineConfig
+from parrot.constants import ENGINE_TYPE_OPENAI, DEFAULT_ENGINE_SERVER_PORT
 
 from parrot.serve.session_manager import SessionManager
 from parrot.serve.scheduler import TaskCreator, GlobalScheduler, GlobalSchedulerConfig
@@ -26,7 +31,7 @@ from parrot.serve.graph import (
     PerformanceCriteria,
     activate_completion_chain,
 )
-from parrot.serve.graph.request import RequestPlaceholder
+from parrot.serve.graph.request import RequestPlaceholder, SemanticCallMetadata
 
 
 def test_session_manager():
@@ -124,6 +129,341 @@ def test_graph_executor():
         asyncio.run(main())
 
 
+def test_engine_failover():
+    session_id = 0
+
+    scheduler_config = GlobalSchedulerConfig()
+    var_mgr = SemanticVariableManager(666)
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    task_creator = TaskCreator()
+    scheduler = GlobalScheduler(scheduler_config, engine_mgr, context_mgr)
+    executor = GraphExecutor(
+        session_id=session_id,
+        task_creator=task_creator,
+        scheduler=scheduler,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+        tokenizers_wrapper=tokenizers_wrapper,
+        task_max_retries=1,
+    )
+
+    var_mgr.register_local_var_space(session_id)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+    request = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill("Hello world, I'm a prefix. " * 4),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+        ],
+        metadata=metadata,
+    )
+    var_mgr.create_vars_for_request(session_id, request)
+
+    dying_port = DEFAULT_ENGINE_SERVER_PORT
+    healthy_port = DEFAULT_ENGINE_SERVER_PORT + 1
+
+    def _register(port: int) -> int:
+        return engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=f"Fake Engine {port}",
+                port=port,
+                engine_type=ENGINE_TYPE_OPENAI,
+            )
+        )
+
+    async def main(dying_server: contextlib.ExitStack):
+        # Only the dying engine is available when the task is scheduled.
+        dying_engine_id = _register(dying_port)
+        executor.add_request(request)
+        activate_completion_chain(request.comp_chains[0], PerformanceCriteria.LATENCY)
+        await asyncio.sleep(0.1)
+        scheduler.schedule()
+
+        # Kill the engine in the middle of the Fill.
+        await asyncio.sleep(0.5)
+        dying_server.close()
+        await asyncio.sleep(0.5)
+        assert not engine_mgr.get_engine(dying_engine_id).is_running
+
+        # The task is requeued and rescheduled to a healthy engine.
+        healthy_engine_id = _register(healthy_port)
+        scheduler.schedule()
+        gen_sv = request.comp_chains[0].gen_node.sv
+        await asyncio.wait_for(gen_sv.wait_ready(), timeout=10)
+
+        assert executor.bad_exception is None
+        assert engine_mgr.get_engine(healthy_engine_id).is_running
+        print("Generated:", gen_sv.get())
+
+    with fake_engine_server(port=healthy_port):
+        with contextlib.ExitStack() as dying_server:
+            dying_server.enter_context(fake_engine_server(port=dying_port))
+            asyncio.run(main(dying_server))
+
+
+def test_engine_heartbeat_expired():
+    session_id = 0
+
+    scheduler_config = GlobalSchedulerConfig()
+    var_mgr = SemanticVariableManager(666)
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=1,
+    )
+    task_creator = TaskCreator()
+    scheduler = GlobalScheduler(scheduler_config, engine_mgr, context_mgr)
+    executor = GraphExecutor(
+        session_id=session_id,
+        task_creator=task_creator,
+        scheduler=scheduler,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+        tokenizers_wrapper=tokenizers_wrapper,
+        task_max_retries=1,
+    )
+
+    var_mgr.register_local_var_space(session_id)
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+    request = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill("Hello world, I'm a prefix. " * 4),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="a", is_output=True)),
+        ],
+        metadata=metadata,
+    )
+    var_mgr.create_vars_for_request(session_id, request)
+
+    hung_port = DEFAULT_ENGINE_SERVER_PORT
+    healthy_port = DEFAULT_ENGINE_SERVER_PORT + 1
+
+    def _register(port: int) -> int:
+        return engine_mgr.register_engine(
+            EngineConfig(
+                engine_name=f"Fake Engine {port}",
+                port=port,
+                engine_type=ENGINE_TYPE_OPENAI,
+            )
+        )
+
+    async def _hang(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Accept the request, but never respond (nor send heartbeats).
+        await reader.read()
+        writer.close()
+
+    async def main():
+        hung_server = await asyncio.start_server(_hang, "localhost", hung_port)
+
+        # Only the hung engine is available when the task is scheduled.
+        hung_engine_id = _register(hung_port)
+        executor.add_request(request)
+        activate_completion_chain(request.comp_chains[0], PerformanceCriteria.LATENCY)
+        await asyncio.sleep(0.1)
+        scheduler.schedule()
+
+        # The heartbeats of the engine expire. The hung primitive is cancelled right
+        # away (long before the HTTP timeout), and the task is requeued.
+        await asyncio.sleep(1.5)
+        engine_mgr.update_expired_engines()
+        assert not engine_mgr.get_engine(hung_engine_id).is_running
+        await asyncio.sleep(0.1)
+        assert scheduler.num_queued_tasks == 1
+
+        engine_mgr.sweep_not_running_engines()
+        assert hung_engine_id not in engine_mgr.engines
+
+        # The task is rescheduled to a healthy engine.
+        healthy_engine_id = _register(healthy_port)
+        await asyncio.sleep(0.1)
+        scheduler.schedule()
+        gen_sv = request.comp_chains[0].gen_node.sv
+        await asyncio.wait_for(gen_sv.wait_ready(), timeout=10)
+
+        assert executor.bad_exception is None
+        assert engine_mgr.get_engine(healthy_engine_id).is_running
+        print("Generated:", gen_sv.get())
+
+        hung_server.close()
+
+    with fake_engine_server(port=healthy_port):
+        asyncio.run(main())
+
+
+def test_engine_error_prefix_reuse():
+    scheduler_config = GlobalSchedulerConfig()
+    var_mgr = SemanticVariableManager(666)
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    task_creator = TaskCreator()
+    scheduler = GlobalScheduler(scheduler_config, engine_mgr, context_mgr)
+
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"model_type": "text"})
+    )
+    executors = []
+    requests = []
+    for session_id in range(2):
+        executors.append(
+            GraphExecutor(
+                session_id=session_id,
+                task_creator=task_creator,
+                scheduler=scheduler,
+                engine_mgr=engine_mgr,
+                context_mgr=context_mgr,
+                tokenizers_wrapper=tokenizers_wrapper,
+            )
+        )
+        var_mgr.register_local_var_space(session_id)
+        # Both requests start with the same constant prefix.
+        request = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill("Hello world, I'm a prefix. " * 4),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(name="a", is_output=True)
+                ),
+            ],
+            metadata=metadata,
+        )
+        var_mgr.create_vars_for_request(session_id, request)
+        requests.append(request)
+
+    # An engine whose first Fill fails with an HTTP 500, i.e. the engine is reachable.
+    num_fills = 0
+
+    async def fill(request: web.Request) -> web.Response:
+        nonlocal num_fills
+        num_fills += 1
+        if num_fills == 1:
+            return web.Response(status=500)
+        return web.json_response({"filled_len": 1})
+
+    async def generate(request: web.Request) -> web.Response:
+        return web.json_response({"generated_text": "xxx", "generated_ids": []})
+
+    app = web.Application()
+    app.add_routes([web.post("/fill", fill), web.post("/generate", generate)])
+
+    async def run_request(executor: GraphExecutor, request: RequestChain) -> None:
+        executor.add_request(request)
+        activate_completion_chain(request.comp_chains[0], PerformanceCriteria.LATENCY)
+        await asyncio.sleep(0.1)
+        scheduler.schedule()
+        await asyncio.sleep(0.5)
+
+    async def main():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "localhost", DEFAULT_ENGINE_SERVER_PORT).start()
+
+        engine_id = engine_mgr.register_engine(
+            EngineConfig(
+                engine_name="Fake Engine",
+                port=DEFAULT_ENGINE_SERVER_PORT,
+                engine_type=ENGINE_TYPE_OPENAI,
+            )
+        )
+
+        # The first request fails without retrying. The engine is still running.
+        await run_request(executors[0], requests[0])
+        assert executors[0].bad_exception is not None
+        assert engine_mgr.get_engine(engine_id).is_running
+
+        # The failed prefix context is not reused by the second request.
+        await run_request(executors[1], requests[1])
+        gen_sv = requests[1].comp_chains[0].gen_node.sv
+        await asyncio.wait_for(gen_sv.wait_ready(), timeout=5)
+        assert executors[1].bad_exception is None
+        assert num_fills == 2
+
+        await runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_session_prefix_match():
+    scheduler_config = GlobalSchedulerConfig()
+    var_mgr = SemanticVariableManager(666)
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    task_creator = TaskCreator()
+    scheduler = GlobalScheduler(scheduler_config, engine_mgr, context_mgr)
+
+    session_mgr = SessionManager(
+        life_span=10,
+        prefix_matcher=PrefixMatcher(),
+        task_creator=task_creator,
+        scheduler=scheduler,
+        var_mgr=var_mgr,
+        engine_mgr=engine_mgr,
+        context_mgr=context_mgr,
+        tokenizers_wrapper=tokenizers_wrapper,
+    )
+
+    # Two apps whose system prompts differ only in the suffix.
+    system_prompt = "You are a helpful assistant. Answer the question concisely. "
+    app_prompts = [
+        system_prompt + "You are working for app A. ",
+        system_prompt + "You are working for app B. ",
+    ]
+    session_ids = [session_mgr.register_session() for _ in range(2)]
+
+    async def main():
+        first_nodes = []
+        for i in range(PrefixMatcher._GP_THRESHOLD + 2):
+            for app_prompt, session_id in zip(app_prompts, session_ids):
+                session = session_mgr.get_session(session_id)
+                session.add_request(
+                    {
+                        "template": app_prompt + "Question: {{q}} Answer: {{a}}",
+                        "placeholders": [
+                            {"name": "q", "is_output": False},
+                            {"name": "a", "is_output": True},
+                        ],
+                    }
+                )
+                first_nodes.append(session.executor.graph.chains[-1].first_node)
+
+        # The last requests are split at the global prefix boundary and share the same
+        # constant prefix SV across sessions.
+        common_prefix = os.path.commonprefix(app_prompts)
+        last_a, last_b = first_nodes[-2:]
+        assert last_a.constant_text == common_prefix
+        assert last_b.constant_text == common_prefix
+        assert last_a.sv.is_constant_prefix
+        assert last_a.sv == last_b.sv
+        print("Shared prefix SV:", last_a.sv.id)
+
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    asyncio.run(main())
+
+
 if __name__ == "__main__":
     # test_session_manager()
     test_graph_executor()
+    test_engine_failover()
+    test_engine_heartbeat_expired()
+    test_engine_error_prefix_reuse()
@@ -1,10 +1,16 @@
+import asyncio
+
 from parrot.serve.tokenizer_wrapper import TokenizersWrapper
 
 from parrot.serve.variable_manager import SemanticVariableManager
 from parrot.serve.scheduler import CompletionTask
+from parrot.serve.context_manager import ServeCoreContextManager
+from parrot.serve.engine_manager import EngineManager
+from parrot.engine.config import EngineConfig
 from parrot.sampling_config import SamplingConfig
 from parrot.serve.graph import (
     RequestChain,
+    ComputeGraph,
     ConstantFill,
     PlaceholderGen,
     PlaceholderFill,
@@ -97,7 +103,231 @@ def test_tokenize_request():
         print(tokenizers_wrapper.detokenize(token_ids, tokenizer_name1))
 
 
+def test_tokenize_cache():
+    session_id = 0
+    var_mgr = SemanticVariableManager(666)
+    var_mgr.register_local_var_space(session_id=0)
+
+    tokenizers_wrapper = TokenizersWrapper()
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    tokenizers_wrapper.register_tokenizer(tokenizer_name)
+
+    system_prompt = "You are a helpful assistant. " * 200
+    for i in range(8):
+        request_chain = RequestChain.from_nodes(
+            nodes=[
+                ConstantFill(system_prompt),
+                ConstantFill(f"Question {i}: "),
+                PlaceholderGen(
+                    placeholder=RequestPlaceholder(
+                        name="b", is_output=True, sampling_config=SamplingConfig()
+                    )
+                ),
+            ]
+        )
+        var_mgr.create_vars_for_request(session_id, request_chain)
+        task = CompletionTask(task_id=i, chain=request_chain.comp_chains[0])
+        task.tokenize_chain(tokenizers_wrapper)
+        assert task.tokenized_result[tokenizer_name][0] == (
+            tokenizers_wrapper.tokenize(system_prompt, tokenizer_name)
+        )
+
+    # The system prompt is tokenized only once.
+    stats = tokenizers_wrapper.get_cache_stats()[tokenizer_name]
+    print(stats)
+    assert stats["hits"] == 7
+    assert stats["misses"] == 8 + 1
+
+
+def test_lazy_tokenize():
+    session_id = 0
+    var_mgr = SemanticVariableManager(666)
+    var_mgr.register_local_var_space(session_id=0)
+
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            ConstantFill(TESTING_PROMPT_TEXT),
+            PlaceholderGen(
+                placeholder=RequestPlaceholder(
+                    name="b",
+                    is_output=True,
+                    sampling_config=SamplingConfig(max_gen_length=10),
+                )
+            ),
+        ]
+    )
+    var_mgr.create_vars_for_request(session_id, request_chain)
+    task = CompletionTask(task_id=0, chain=request_chain.comp_chains[0])
+
+    tokenizers_wrapper = TokenizersWrapper()
+    tokenizer_name1 = "hf-internal-testing/llama-tokenizer"
+    tokenizer_name2 = "facebook/opt-13b"
+    tokenizers_wrapper.register_tokenizer(tokenizer_name1)
+    tokenizers_wrapper.register_tokenizer(tokenizer_name2)
+    # Counting tokens doesn't materialize token ids, and only uses one tokenizer.
+    asyncio.run(task.acompute_token_nums(tokenizers_wrapper, [tokenizer_name1]))
+    asyncio.run(task.acompute_token_nums(tokenizers_wrapper, [tokenizer_name1]))
+    assert task.has_token_nums(tokenizer_name1)
+    assert not task.has_token_nums(tokenizer_name2)
+    assert task.get_token_nums(tokenizer_name1) == len(TESTING_TOKEN_IDS) + 10
+    assert task.get_token_nums(tokenizer_name1) == len(TESTING_TOKEN_IDS) + 10
+    assert not task.is_tokenized
+    stats = tokenizers_wrapper.get_cache_stats()
+    assert stats[tokenizer_name1]["misses"] == 1
+    assert stats[tokenizer_name2]["misses"] == 0
+
+    # Materialize token ids for the chosen tokenizer only.
+    task.tokenize_chain(tokenizers_wrapper, [tokenizer_name1])
+    assert task.is_tokenized_by(tokenizer_name1)
+    assert not task.is_tokenized_by(tokenizer_name2)
+    assert task.tokenized_result[tokenizer_name1] == [TESTING_TOKEN_IDS]
+    assert tokenizers_wrapper.get_cache_stats()[tokenizer_name1]["hits"] == 1
+
+
+def test_eager_tokenize():
+    session_id = 0
+    var_mgr = SemanticVariableManager(666)
+    var_mgr.register_local_var_space(session_id=0)
+    var0 = var_mgr.create_var(session_id, "a")
+
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            PlaceholderFill(
+                placeholder=RequestPlaceholder(
+                    name="a", var_id=var0.id, is_output=False
+                )
+            ),
+            PlaceholderGen(
+                placeholder=RequestPlaceholder(
+                    name="b", is_output=True, sampling_config=SamplingConfig()
+                )
+            ),
+        ]
+    )
+    var_mgr.create_vars_for_request(session_id, request_chain)
+    task = CompletionTask(task_id=0, chain=request_chain.comp_chains[0])
+
+    tokenizers_wrapper = TokenizersWrapper()
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    tokenizers_wrapper.register_tokenizer(tokenizer_name)
+
+    async def main():
+        # The SV is tokenized in the background once it's set.
+        var0.set(
+            TESTING_PROMPT_TEXT,
+            tokenizers_wrapper=tokenizers_wrapper,
+            tokenizer_names=[tokenizer_name],
+        )
+        await var0.wait_tokenized()
+        assert var0.get_token_ids(tokenizer_name) == TESTING_TOKEN_IDS
+
+        # The task uses the result directly.
+        await task.atokenize_chain(tokenizers_wrapper, [tokenizer_name])
+        assert task.tokenized_result[tokenizer_name][0] is var0.get_token_ids(
+            tokenizer_name
+        )
+        stats = tokenizers_wrapper.get_cache_stats()[tokenizer_name]
+        assert stats["misses"] == 1 and stats["hits"] == 0
+
+    asyncio.run(main())
+
+
+def test_async_tokenize():
+    tokenizer_name = "hf-internal-testing/llama-tokenizer"
+    long_text = TESTING_PROMPT_TEXT * 200
+
+    async def main():
+        for executor_type in ["thread", "process"]:
+            tokenizers_wrapper = TokenizersWrapper(executor_type=executor_type)
+            tokenizers_wrapper.register_tokenizer(tokenizer_name)
+
+            expected = tokenizers_wrapper.tokenize(long_text, tokenizer_name)
+            results = await asyncio.gather(
+                *[
+                    tokenizers_wrapper.atokenize(long_text, tokenizer_name, "sv")
+                    for _ in range(4)
+                ]
+            )
+            assert all(result == expected for result in results)
+            # Concurrent tokenizations of the same SV are done once.
+            stats = tokenizers_wrapper.get_cache_stats()[tokenizer_name]
+            assert stats["entries_num"] == 1
+
+            decoded = await tokenizers_wrapper.adetokenize(expected, tokenizer_name)
+            assert decoded == tokenizers_wrapper.detokenize(expected, tokenizer_name)
+            tokenizers_wrapper.shutdown()
+
+    asyncio.run(main())
+
+
+def test_eager_tokenize_consumers():
+    session_id = 0
+    var_mgr = SemanticVariableManager(666)
+    var_mgr.register_local_var_space(session_id=0)
+    var0 = var_mgr.create_var(session_id, "a")
+    var1 = var_mgr.create_var(session_id, "b")
+
+    tokenizers_wrapper = TokenizersWrapper()
+    context_mgr = ServeCoreContextManager()
+    engine_mgr = EngineManager(
+        tokenizers_wrapper=tokenizers_wrapper,
+        context_mgr=context_mgr,
+        engine_heartbeat_timeout=666,
+    )
+    tokenizer_name1 = "hf-internal-testing/llama-tokenizer"
+    tokenizer_name2 = "facebook/opt-13b"
+    engine_mgr.register_engine(EngineConfig(model="model1", tokenizer=tokenizer_name1))
+    engine_mgr.register_engine(EngineConfig(model="model2", tokenizer=tokenizer_name2))
+
+    # var0 is consumed by a request served with model1 only.
+    metadata = SemanticCallMetadata(
+        **(SemanticCallMetadata.get_default_dict() | {"models": ["model1"]})
+    )
+    request_chain = RequestChain.from_nodes(
+        nodes=[
+            PlaceholderFill(
+                placeholder=RequestPlaceholder(
+                    name="a", var_id=var0.id, is_output=False
+                )
+            ),
+            PlaceholderGen(placeholder=RequestPlaceholder(name="b", is_output=True)),
+        ],
+        metadata=metadata,
+    )
+    var_mgr.create_vars_for_request(session_id, request_chain)
+    ComputeGraph().insert_and_update_request_chain(request_chain)
+
+    assert engine_mgr.get_live_tokenizer_names_by_consumers(var0) == [
+        tokenizer_name1
+    ]
+    # No consumers, no eager tokenization.
+    assert engine_mgr.get_live_tokenizer_names_by_consumers(var1) == []
+
+    async def main():
+        for var in [var0, var1]:
+            var.set(
+                TESTING_PROMPT_TEXT,
+                tokenizers_wrapper=tokenizers_wrapper,
+                tokenizer_names=engine_mgr.get_live_tokenizer_names_by_consumers(var),
+            )
+            await var.wait_tokenized()
+
+        assert var0.get_token_ids(tokenizer_name1) is not None
+        assert var0.get_token_ids(tokenizer_name2) is None
+        assert var1.get_token_ids(tokenizer_name1) is None
+        stats = tokenizers_wrapper.get_cache_stats()
+        assert stats[tokenizer_name1]["entries_num"] == 1
+        assert stats[tokenizer_name2]["entries_num"] == 0
+
+    asyncio.run(main())
+
+
 if __name__ == "__main__":
     # test_encode()
     # test_decode()
     test_tokenize_request()
+    test_tokenize_cache()
+    test_lazy_tokenize()
+    test_eager_tokenize()
+    test_eager_tokenize_consumers()
+    test_async_tokenize()
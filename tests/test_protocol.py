@@ -26,6 +26,7 @@ from parrot.protocol.internal.layer_apis import (
     register_engine,
 )
 from parrot.protocol.internal.primitive_request import Fill, Generate
+from parrot.protocol.client_session_pool import ClientSessionPool
 from parrot.sampling_config import SamplingConfig
 
 from parrot.testing.fake_core_server import TESTING_SERVER_URL as CORE_URL
@@ -271,6 +272,39 @@ def test_generate():
         asyncio.run(main())
 
 
+def test_fill_with_session_pool():
+    async def main():
+        pool = ClientSessionPool(limit_per_host=4, keepalive_timeout=10)
+        client_session = pool.get_session(ENGINE_URL)
+        assert pool.get_session(ENGINE_URL) is client_session
+
+        # More concurrent requests than the connection limit.
+        primitives = [
+            Fill(
+                session_id=0,
+                task_id=i,
+                context_id=i,
+                parent_context_id=-1,
+                end_flag=False,
+                token_ids=[1],
+            )
+            for i in range(16)
+        ]
+        resps = await asyncio.gather(
+            *[p.apost(ENGINE_URL, client_session) for p in primitives]
+        )
+        assert all(resp.filled_len == 1 for resp in resps)
+
+        pool.remove_session(ENGINE_URL)
+        await asyncio.sleep(0.1)  # Closed in the background
+        assert client_session.closed
+        assert pool.get_session(ENGINE_URL) is not client_session
+        await pool.close_all()
+
+    with fake_engine_server():
+        asyncio.run(main())
+
+
 if __name__ == "__main__":
     # test_register_session()
     # test_remove_session()
@@ -281,4 +315,5 @@ if __name__ == "__main__":
     # test_free_context()
     # test_fill()
     # test_generate()
+    # test_fill_with_session_pool()
     pass
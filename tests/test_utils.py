@@ -1,4 +1,5 @@
 from parrot.utils import RecyclePool
+from parrot.exceptions import ParrotError
 
 
 def test_recycle_pool():
@@ -30,6 +31,52 @@ def test_recycle_pool_error():
         pass
 
 
+def test_recycle_pool_batch():
+    pool = RecyclePool(pool_size=8)
+    ids = pool.allocate_many(6)
+    assert ids == list(range(6))
+    assert pool.get_allocated_num() == 6
+
+    pool.free_many(ids[:4])
+    assert pool.get_allocated_num() == 2
+
+    # Reuse the freed ids first, then new ids.
+    ids = pool.allocate_many(6)
+    assert sorted(ids) == [0, 1, 2, 3, 6, 7]
+    assert pool.get_allocated_num() == 8
+    assert pool.get_history_max_allocated_num() == 8
+
+    # Full
+    try:
+        pool.allocate()
+        assert False
+    except ParrotError:
+        pass
+    assert pool.get_allocated_num() == 8
+
+    # Double free in a batch. Nothing is freed.
+    try:
+        pool.free_many([0, 1, 1])
+        assert False
+    except ValueError:
+        pass
+    assert pool.get_allocated_num() == 8
+    pool.free_many([0, 1])
+
+
+def test_recycle_pool_history_max():
+    pool = RecyclePool()
+    for _ in range(3):
+        pool.allocate()
+    # No reuse. The high-water mark is still tracked.
+    assert pool.get_history_max_allocated_num() == 3
+    pool.free(0)
+    pool.allocate()
+    assert pool.get_history_max_allocated_num() == 3
+
+
 if __name__ == "__main__":
     test_recycle_pool()
     test_recycle_pool_error()
+    test_recycle_pool_batch()
+    test_recycle_pool_history_max()